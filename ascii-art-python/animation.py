@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Animation
+动画输入（GIF / WebP / APNG）的逐帧读取与动画输出
+
+Frames are read one at a time with ``seek`` so only the current frame is
+ever decoded in memory. Rendered frames are encoded independently (they
+can come back from worker processes) and spliced into the output file as
+they arrive:
+
+- ApngWriter turns single-frame PNGs into an animated PNG, moving each
+  frame's IDAT data into fcTL/fdAT chunks.
+- GifWriter turns single-frame GIFs into an animated GIF, moving each
+  frame's global palette into a local color table.
+
+Neither writer keeps earlier frames around, unlike Pillow's ``save_all``.
+"""
+
+import io
+import os
+import struct
+import zlib
+
+from PIL import Image
+
+
+# 动画最多转换的帧数，可通过环境变量 ASCII_ART_MAX_FRAMES 配置
+MAX_FRAMES = int(os.getenv('ASCII_ART_MAX_FRAMES', 1000))
+
+# 帧时长缺失或为0时使用的时长（毫秒），与浏览器的处理一致
+DEFAULT_FRAME_DURATION = 100
+
+ANIMATION_FORMATS = ('png', 'gif')
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def is_animated(img: Image.Image) -> bool:
+    """Return True if an opened image has more than one frame."""
+    return getattr(img, 'is_animated', False) and getattr(img, 'n_frames', 1) > 1
+
+
+def frame_count(img: Image.Image, max_frames: int | None = None) -> int:
+    """Return the number of frames that will be converted (capped at max_frames, default MAX_FRAMES)."""
+    if max_frames is None:
+        max_frames = MAX_FRAMES
+    return max(1, min(getattr(img, 'n_frames', 1), max_frames))
+
+
+def iter_frames(img: Image.Image, max_frames: int | None = None):
+    """Yield ``(rgb_frame, duration_ms)`` for each frame of an opened image.
+
+    Frames are decoded one at a time; Pillow applies the format's disposal
+    and blending, so every yielded frame is the full composited picture.
+    """
+    for index in range(frame_count(img, max_frames)):
+        img.seek(index)
+        frame = img.convert('RGB')
+        # WebP 的帧时长在解码后才写入 info
+        duration = img.info.get('duration') or DEFAULT_FRAME_DURATION
+        yield frame, int(duration)
+
+
+def encode_frame(canvas: Image.Image, fmt: str) -> bytes:
+    """Encode one rendered frame as a standalone PNG or GIF for the writers below."""
+    buffer = io.BytesIO()
+    canvas.save(buffer, format=fmt.upper())
+    return buffer.getvalue()
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _png_chunks(data: bytes):
+    if not data.startswith(_PNG_SIGNATURE):
+        raise ValueError("not a PNG image")
+    offset = len(_PNG_SIGNATURE)
+    while offset < len(data):
+        length, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        yield kind, data[offset + 8:offset + 8 + length]
+        offset += length + 12
+
+
+class ApngWriter:
+    """Streaming animated PNG writer.
+
+    Args:
+        fp: Binary file object to write to
+        frames: Total number of frames (stored in the header before any frame data)
+        loop: Number of plays, 0 for infinite
+    """
+
+    def __init__(self, fp, frames: int, loop: int = 0):
+        self.fp = fp
+        self.frames = frames
+        self.loop = loop
+        self.written = 0
+        self._sequence = 0
+        self._header = None
+
+    def add_frame(self, png: bytes, duration_ms: int) -> None:
+        """Append a frame given as a complete single-frame PNG of the same size and mode."""
+        if self.written >= self.frames:
+            raise ValueError(f"APNG declared {self.frames} frames, got more")
+        chunks = list(_png_chunks(png))
+        header = next(data for kind, data in chunks if kind == b'IHDR')
+        if self._header is None:
+            self._header = header
+            self.fp.write(_PNG_SIGNATURE)
+            self.fp.write(_png_chunk(b'IHDR', header))
+            self.fp.write(_png_chunk(b'acTL', struct.pack('>II', self.frames, self.loop)))
+            # 调色板等辅助块只能出现一次，取第一帧的
+            for kind, data in chunks:
+                if kind in (b'PLTE', b'tRNS', b'gAMA', b'sRGB', b'pHYs'):
+                    self.fp.write(_png_chunk(kind, data))
+        elif header != self._header:
+            raise ValueError("all APNG frames must have the same size and mode")
+
+        width, height = struct.unpack('>II', header[:8])
+        self.fp.write(_png_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self._next_sequence(), width, height, 0, 0, duration_ms, 1000, 0, 0)))
+        for kind, data in chunks:
+            if kind != b'IDAT':
+                continue
+            if self.written == 0:
+                # 第一帧同时也是不支持动画的查看器显示的静态图
+                self.fp.write(_png_chunk(b'IDAT', data))
+            else:
+                self.fp.write(_png_chunk(b'fdAT', struct.pack('>I', self._next_sequence()) + data))
+        self.written += 1
+
+    def _next_sequence(self) -> int:
+        self._sequence += 1
+        return self._sequence - 1
+
+    def close(self) -> None:
+        """Finish the file; raises ValueError if fewer frames were added than declared."""
+        if self.written != self.frames:
+            raise ValueError(f"APNG declared {self.frames} frames, got {self.written}")
+        self.fp.write(_png_chunk(b'IEND', b''))
+
+
+def _gif_skip_blocks(data: bytes, offset: int) -> int:
+    """Return the offset after a chain of GIF data sub-blocks."""
+    while data[offset]:
+        offset += data[offset] + 1
+    return offset + 1
+
+
+def _gif_frame(gif: bytes) -> tuple[int, int, bytes, bytes, bytes]:
+    """Split a single-frame GIF into (width, height, color_table, descriptor, image_data)."""
+    if gif[:6] not in (b'GIF87a', b'GIF89a'):
+        raise ValueError("not a GIF image")
+    width, height, flags = struct.unpack('<HHB', gif[6:11])
+    offset = 13
+    table = b''
+    if flags & 0x80:
+        size = 3 << ((flags & 0x07) + 1)
+        table = gif[offset:offset + size]
+        offset += size
+    while gif[offset] == 0x21:
+        # 跳过扩展块（图形控制、注释等），帧时长由写入器重新生成
+        offset = _gif_skip_blocks(gif, offset + 2)
+    if gif[offset] != 0x2C:
+        raise ValueError("GIF has no image")
+    descriptor = bytearray(gif[offset:offset + 10])
+    offset += 10
+    if descriptor[9] & 0x80:
+        size = 3 << ((descriptor[9] & 0x07) + 1)
+        table = gif[offset:offset + size]
+        offset += size
+    end = _gif_skip_blocks(gif, offset + 1)
+    return width, height, table, bytes(descriptor), gif[offset:end]
+
+
+class GifWriter:
+    """Streaming animated GIF writer; every frame keeps its own palette.
+
+    Args:
+        fp: Binary file object to write to
+        loop: Number of repeats, 0 for infinite
+    """
+
+    def __init__(self, fp, loop: int = 0):
+        self.fp = fp
+        self.loop = loop
+        self.written = 0
+        self._size = None
+
+    def add_frame(self, gif: bytes, duration_ms: int) -> None:
+        """Append a frame given as a complete single-frame GIF of the same size."""
+        width, height, table, descriptor, image_data = _gif_frame(gif)
+        if self._size is None:
+            self._size = (width, height)
+            self.fp.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0x70, 0, 0))
+            self.fp.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+        elif (width, height) != self._size:
+            raise ValueError("all GIF frames must have the same size")
+
+        # GIF 时长单位是 1/100 秒
+        delay = max(1, round(duration_ms / 10))
+        self.fp.write(b'\x21\xf9\x04\x04' + struct.pack('<H', delay) + b'\x00\x00')
+        table_bits = (max(len(table) // 3, 2) - 1).bit_length() - 1
+        flags = 0x80 | (descriptor[9] & 0x40) | table_bits
+        self.fp.write(descriptor[:9] + bytes([flags]))
+        self.fp.write(table.ljust(3 << (table_bits + 1), b'\0'))
+        self.fp.write(image_data)
+        self.written += 1
+
+    def close(self) -> None:
+        """Write the trailer."""
+        self.fp.write(b'\x3b')
+
+
+def animation_writer(fp, fmt: str, frames: int, loop: int = 0):
+    """Return the streaming writer for an output format ('png' or 'gif')."""
+    if fmt == 'png':
+        return ApngWriter(fp, frames, loop)
+    if fmt == 'gif':
+        return GifWriter(fp, loop)
+    raise ValueError(f"Unsupported animation format '{fmt}', expected one of {', '.join(ANIMATION_FORMATS)}")
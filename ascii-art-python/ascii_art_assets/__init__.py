@@ -0,0 +1,4 @@
+"""
+ASCII Art Assets
+随包安装的数据文件（附带的等宽字体及其许可证），通过 importlib.resources 定位
+"""
@@ -4,60 +4,99 @@ ASCII Art Generator MCP Server
 提供ASCII艺术生成功能的MCP服务器
 """
 
+import argparse
+import asyncio
+import json
 import os
-import tempfile
+import signal
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from uuid import uuid4
 from urllib.parse import urlparse
-import httpx
-from mcp.server.fastmcp import FastMCP
-from PIL import Image as PILImage
-from PIL import ImageEnhance, ImageDraw
-from supabase import create_client, Client
 
-# 导入主程序的ASCIIArtGenerator类
-from main import ASCIIArtGenerator
+import uvicorn
+from mcp.server.fastmcp import Context, FastMCP
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+# 只导入轻量模块：numpy、Pillow 和 main 只在工作进程（或线程模式下第一次渲染时）加载
+from cache import ResultCache, digest_bytes, make_key
+from downloader import ImageDownloader
+from metrics import StageMetrics, StageTimer, format_timings, merge_timings, stage, timing
+from options import IMAGE_FORMATS, MARKUP_FORMATS, MIME_TYPES, resolve_charset
+from singleflight import SingleFlight
+from storage import StorageError, storage_from_env
+from workers import WorkerPool, markup_job, render_identity_job, render_job
 
 # 初始化FastMCP服务器
 mcp = FastMCP("ascii-art-generator")
 
-# 初始化Supabase客户端
-supabase_url = os.getenv("SUPABASE_URL", "")
-supabase_key = os.getenv("SUPABASE_KEY", "")
-supabase_bucket = os.getenv("SUPABASE_BUCKET", "ascii-art-images")
-supabase_client: Client | None = None
-if supabase_url and supabase_key:
-    supabase_client = create_client(supabase_url, supabase_key)
+# 结果缓存：相同输入内容 + 相同参数直接返回已上传的URL
+result_cache = ResultCache.from_env()
+# 相同输入 + 相同参数的并发请求只转换一次，其余请求等待同一个结果
+inflight = SingleFlight.from_env()
+# 下载器：共享连接池，流式读取并限制大小
+downloader = ImageDownloader.from_env()
+# 工作池：渲染在工作进程中执行，限制并发请求数和排队长度
+worker_pool = WorkerPool.from_env()
+# 各工作进程网格缓存和图片编码器计数的最新快照（按进程号）
+worker_grid_stats: dict[int, dict] = {}
+worker_encoder_stats: dict[int, dict] = {}
+# 工作进程的字体和编码器配置（第一次渲染图片前查询一次），计入图片结果的缓存键
+render_config: dict | None = None
+# 各阶段耗时和数据量的直方图（所有请求累计，工作进程中的阶段随结果一起返回）
+stage_metrics = StageMetrics()
+
+# 批量转换：单批最多条目数，下载和上传阶段各自的并行上限
+BATCH_MAX_ITEMS = int(os.getenv("ASCII_ART_MAX_BATCH", 100))
+BATCH_DOWNLOADS = int(os.getenv("ASCII_ART_BATCH_DOWNLOADS", 8))
+BATCH_UPLOADS = int(os.getenv("ASCII_ART_BATCH_UPLOADS", 4))
+
+# 每个条目可以单独覆盖的选项
+ITEM_OPTIONS = ('width', 'charset', 'color_mode', 'brightness', 'contrast', 'invert', 'font_size', 'output_format')
+
+# 输出格式：png/webp 渲染后上传；html/svg 直接在结果中返回文档，不需要上传
+OUTPUT_FORMATS = IMAGE_FORMATS + MARKUP_FORMATS
+
+# 存储后端：Supabase 或本地目录（ASCII_ART_STORAGE_URL）
+storage = storage_from_env()
+
+# 网络传输模式：一个监听端口服务所有客户端，共享缓存、工作进程和字体
+HTTP_TRANSPORTS = ('streamable-http', 'sse')
+# 收到退出信号后等待进行中请求完成的最长秒数
+SHUTDOWN_TIMEOUT = float(os.getenv("ASCII_ART_SHUTDOWN_TIMEOUT", 30))
+# 工作进程预热任务（/readyz 在全部完成后才返回就绪），以及是否已收到退出信号
+warmup: list = []
+draining = False
+# 进行中的工具调用和 HTTP 请求（不含 GET 事件流），退出时等它们结束再关闭连接
+active_requests = 0
 
 
-def upload_to_supabase(file_path: str, input_basename: str) -> str:
-    """Upload file to Supabase Storage and return public URL.
+async def upload_image(data: bytes, input_basename: str, content_key: str | None = None,
+                       image_format: str = 'png') -> str:
+    """Upload image data to the configured storage backend and return public URL.
     
     Args:
-        file_path: Path to the file to upload
+        data: Encoded PNG or WebP bytes to upload
         input_basename: Base name of the original input file
+        content_key: Cache key of the render; when given the object name is
+            derived from it and uploads of the same result overwrite one object
+        image_format: 'png' or 'webp', used for the file suffix and content type
         
     Returns:
         Public URL of the uploaded file
         
     Raises:
-        Exception: If Supabase is not configured or upload fails
+        StorageError: If no storage is configured or the upload fails after retries
     """
-    if not supabase_client:
-        raise Exception("Supabase is not configured. Set SUPABASE_URL and SUPABASE_KEY environment variables.")
+    if storage is None:
+        raise StorageError("Storage is not configured. Set SUPABASE_URL and SUPABASE_KEY (or ASCII_ART_STORAGE_URL) environment variables.")
     
-    file_name = f"{input_basename}_{uuid4().hex}.png"
-    
-    with open(file_path, 'rb') as f:
-        supabase_client.storage.from_(supabase_bucket).upload(
-            file=f,
-            path=file_name,
-            file_options={"content-type": "image/png"}
-        )
-    
-    # Return public URL
-    public_url = supabase_client.storage.from_(supabase_bucket).get_public_url(file_name)
-    return public_url
+    suffix = content_key[:32] if content_key else uuid4().hex
+    file_name = f"{input_basename}_{suffix}.{image_format}"
+    return await storage.upload(file_name, data, MIME_TYPES[image_format])
 
 
 def is_valid_url(s: str) -> bool:
@@ -69,50 +108,175 @@ def is_valid_url(s: str) -> bool:
         return False
 
 
-def download_image(url: str) -> tuple[str, str]:
-    """Download image from URL to temporary file.
+def normalize_params(chars: str, width: int, color_mode: str, brightness: float,
+                     contrast: float, font_size: int, output_format: str = 'png',
+                     renderer: dict | None = None) -> dict:
+    """Normalize tool parameters so equivalent requests share one cache key.
+    
+    The charset is keyed by its resolved characters (after inversion, see
+    options.resolve_charset), so a preset name and the same custom string
+    hit the same entry. For PNG/WebP output ``renderer`` (see
+    render_identity) adds the resolved font and the encoder settings, so a
+    cache that outlives a configuration change does not return images
+    produced under the old one.
+    
+    Raises:
+        ValueError: If the output format is not supported
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output_format '{output_format}', expected one of {', '.join(OUTPUT_FORMATS)}")
+    params = {
+        'chars': chars,
+        'width': int(width),
+        'color_mode': 'color' if color_mode == 'color' else 'gray',
+        'brightness': float(brightness),
+        'contrast': float(contrast),
+        'font_size': int(font_size),
+    }
+    # PNG 不写入格式，升级前缓存的结果仍然命中
+    if output_format != 'png':
+        params['format'] = output_format
+    if renderer is not None and output_format in IMAGE_FORMATS:
+        params['renderer'] = renderer
+    return params
+
+
+async def render_identity() -> dict:
+    """Font and encoder configuration of the workers (render_identity_job), queried once per process."""
+    global render_config
+    if render_config is None:
+        render_config = await worker_pool.run(render_identity_job)
+    return render_config
+
+
+def input_identity(image_path: str) -> tuple | None:
+    """Identify the input of a request without reading it.
+    
+    URLs are identified by the URL, local files by path, modification time
+    and size, so a file rewritten in place is not coalesced with a request
+    for its old content.
+    
+    Returns:
+        Hashable identity, or None if the path is not an existing absolute
+        path (load_source reports the error)
+    """
+    if is_valid_url(image_path):
+        return ('url', image_path)
+    input_file = Path(image_path)
+    if not input_file.is_absolute():
+        return None
+    try:
+        info = input_file.stat()
+    except OSError:
+        return None
+    return ('file', str(input_file), info.st_mtime_ns, info.st_size)
+
+
+def request_key(image_path: str, params: dict) -> str | None:
+    """Coalescing key of a request: input identity plus normalized parameters (None: do not coalesce)."""
+    identity = input_identity(image_path)
+    if identity is None:
+        return None
+    return make_key(json.dumps(identity), params)
+
+
+async def download_image(url: str) -> tuple[bytes | bytearray, str]:
+    """Download image from URL into memory over the shared connection pool.
     
     Args:
         url: HTTP/HTTPS URL of the image
         
     Returns:
-        Tuple of (temp_file_path, basename)
+        Tuple of (image_bytes, basename)
         
     Raises:
-        Exception: If download fails or URL doesn't point to an image
+        DownloadError: If download fails, exceeds the size limit or the body is not an image
     """
-    with httpx.Client(follow_redirects=True, timeout=30.0) as client:
-        response = client.get(url)
-        response.raise_for_status()
-        
-        content_type = response.headers.get('content-type', '')
-        if not content_type.startswith('image/'):
-            raise Exception(f"URL does not point to an image. Content-Type: {content_type}")
-        
-        # Determine file extension from content-type
-        ext = '.jpg'  # default
-        if 'png' in content_type:
-            ext = '.png'
-        elif 'gif' in content_type:
-            ext = '.gif'
-        elif 'webp' in content_type:
-            ext = '.webp'
-        elif 'jpeg' in content_type or 'jpg' in content_type:
-            ext = '.jpg'
-        elif 'bmp' in content_type:
-            ext = '.bmp'
-        
-        # Extract filename from URL
-        url_path = urlparse(url).path
-        url_filename = url_path.split('/')[-1] if url_path else ''
-        basename = url_filename.rsplit('.', 1)[0] if url_filename else 'image'
-        if not basename:
-            basename = 'image'
-        
-        # Save to temp file with correct extension
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-            tmp.write(response.content)
-            return tmp.name, basename
+    return await downloader.fetch(url)
+
+
+def cache_state(cache_hit: bool, coalesced: bool = False) -> str:
+    """Describe where a result came from: 'hit', 'miss', or shared with an in-flight request."""
+    state = 'hit' if cache_hit else 'miss'
+    return f"{state}, shared with an identical in-flight request" if coalesced else state
+
+
+def format_markup_result(result: dict, cache_hit: bool, coalesced: bool = False) -> str:
+    """Format an HTML/SVG result: its sizes followed by the document itself."""
+    fmt = result['format']
+    headline = (f"✅ ASCII art {fmt.upper()} found in cache!" if cache_hit
+                else f"✅ ASCII art generated as inline {fmt.upper()} (no upload needed)!")
+    return (
+        f"{headline}\n"
+        f"📐 Grid: {result['cols']}×{result['rows']} characters\n"
+        f"💾 Size: {result['size'] / 1024:.2f} KB ({result['gzip_size'] / 1024:.2f} KB gzipped)\n"
+        f"🗃️ Cache: {cache_state(cache_hit, coalesced)}\n\n"
+        f"```{fmt}\n{result['markup']}\n```"
+    )
+
+
+def encoding_details(result: dict) -> str:
+    """Describe how an image result was encoded, e.g. ' (PNG, palette, encoded in 12 ms)'."""
+    if result.get('encode_ms') is None:
+        return ""
+    palette = ", palette" if result.get('palette') else ""
+    return f" ({result.get('format', 'png').upper()}{palette}, encoded in {result['encode_ms']:.0f} ms)"
+
+
+def format_timing_block(timer: StageTimer | None) -> str:
+    """Format the stage timings of one request, or say that timing is disabled."""
+    if timer is None:
+        return "⏱️ Timing: disabled (ASCII_ART_TIMING=0)"
+    return f"⏱️ Timing: {format_timings(timer.as_dict())}"
+
+
+def format_result(result: dict, cache_hit: bool, coalesced: bool = False) -> str:
+    """Format a render result as the tool's success message."""
+    if result.get('format') in MARKUP_FORMATS:
+        return format_markup_result(result, cache_hit, coalesced)
+    if cache_hit:
+        headline = "✅ ASCII art image found in cache (no render or upload needed)!"
+    else:
+        headline = "✅ ASCII art image generated and uploaded successfully!"
+    # 旧版本写入磁盘缓存的结果没有 frames、format 等字段
+    frames = result.get('frames', 1)
+    frames_line = f"🎞️ Frames: {frames} (animated PNG)\n" if frames > 1 else ""
+    return (
+        f"{headline}\n"
+        f"🌐 Public URL: {result['url']}\n"
+        f"📐 Dimensions: {result['width']}×{result['height']} pixels\n"
+        f"{frames_line}"
+        f"💾 File size: {result['size'] / 1024:.2f} KB{encoding_details(result)}\n"
+        f"🗃️ Cache: {cache_state(cache_hit, coalesced)}"
+    )
+
+
+def observe_request(timer: StageTimer | None, joined: bool) -> None:
+    """Add a finished request's timer to the stage histograms, unless it joined another request.
+
+    The conversion a coalesced request waited for is recorded once, by the
+    request that executed it; the joined requests are counted by
+    ``requests_coalesced_total`` instead.
+    """
+    if timer is not None and not joined:
+        stage_metrics.observe(timer)
+
+
+@contextmanager
+def tracked_request():
+    """Count a request as in flight so a graceful shutdown waits for it.
+    
+    Raises:
+        Exception: If the server is shutting down and takes no new work
+    """
+    global active_requests
+    if draining:
+        raise Exception("Server is shutting down, retry on another instance")
+    active_requests += 1
+    try:
+        yield
+    finally:
+        active_requests -= 1
 
 
 @mcp.tool()
@@ -124,13 +288,21 @@ async def generate_ascii_image(
     brightness: float = 1.0,
     contrast: float = 1.0,
     invert: bool = False,
-    font_size: int = 10
+    font_size: int = 10,
+    output_format: str = "png",
+    show_timing: bool = False,
+    ctx: Context | None = None
 ) -> str:
     """Generate ASCII art and upload to cloud storage.
 
     This tool converts an image to ASCII art, renders it as a PNG image with
-    VS Code dark theme styling, uploads to Supabase, and returns the public URL.
-    Supports both local file paths and image URLs.
+    VS Code dark theme styling, uploads to Supabase (or the configured storage), and returns the public URL.
+    Supports both local file paths and image URLs. Animated GIF/WebP/APNG
+    inputs are converted frame by frame into an animated PNG.
+
+    With output_format 'webp' the image is uploaded as lossless WebP (smaller,
+    slower to encode). With output_format 'html' or 'svg' nothing is uploaded: the document is
+    returned inline, usually a few KB gzipped instead of a PNG of hundreds of KB.
 
     Args:
         image_path: ABSOLUTE path to the input image file OR a URL (http/https) to an image
@@ -147,155 +319,531 @@ async def generate_ascii_image(
         contrast: Contrast adjustment (1.0 = original)
         invert: Reverse character brightness mapping
         font_size: Font size in pixels (default: 10, affects output image size)
+        output_format: 'png' (default) or 'webp' (uploaded image), 'html' (<pre> with
+            colored spans) or 'svg' (one <text> per row), the latter two returned inline
+        show_timing: Append the time spent per stage (queue, download, decode, resize,
+            mapping, draw, encode, upload, ...) to the result
 
     Returns:
-        Success message with public URL and image dimensions, or error message if failed
+        Success message with public URL (or the inline HTML/SVG document), dimensions
+        and whether the result came from the cache, or error message if failed
     """
-    temp_file = None
-    downloaded_file = None
+    async def convert() -> tuple[dict, bool]:
+        # 超出并发和排队上限时立即拒绝，而不是无限堆积
+        async with worker_pool.slot():
+            return await _generate_ascii_image(
+                image_path, width, charset, color_mode, brightness, contrast, invert, font_size, ctx,
+                output_format)
+
+    timer, joined = None, False
     try:
-        # Check if input is a URL
-        if is_valid_url(image_path):
-            # Download image from URL
-            downloaded_file, input_basename = download_image(image_path)
-            input_file_path = downloaded_file
-        else:
-            # 验证输入路径必须是绝对路径
-            input_file = Path(image_path)
-            if not input_file.is_absolute():
-                return f"❌ Error: Only absolute paths are allowed. Got relative path: {image_path}\n💡 Hint: Use full path like 'D:\\folder\\image.jpg' or use a URL like 'https://example.com/image.jpg'"
-            
-            # 验证文件是否存在
-            if not input_file.exists():
-                return f"❌ Error: Image file not found: {image_path}"
-            
-            input_file_path = str(input_file)
-            input_basename = input_file.stem
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            temp_file = tmp.name
-        
-        # 创建生成器
-        generator = ASCIIArtGenerator(char_set=charset, invert=invert)
-        
-        # 生成ASCII艺术图片到内存
-        img_original = PILImage.open(input_file_path)
-        
-        # 应用亮度和对比度调整
-        if brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(img_original)
-            img_original = enhancer.enhance(brightness)
-        
-        if contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(img_original)
-            img_original = enhancer.enhance(contrast)
-        
-        # 保存原始长宽比
-        original_aspect_ratio = img_original.height / img_original.width
-        
-        # 获取字体
-        font = generator._get_font(font_size)
-        
-        # 计算字符尺寸
-        bbox = font.getbbox('M')
-        char_width = bbox[2] - bbox[0]
-        char_height = bbox[3] - bbox[1]
-        
-        # 计算高度以保持纵横比
-        new_height = int(original_aspect_ratio * width * (char_width / char_height))
-        
-        # 调整图片大小
-        img_small = img_original.resize((width, new_height))
-        gray_img = img_small.convert('L')
-        gray_pixels = gray_img.getdata()
-        
-        # 创建画布
-        canvas_width = width * char_width
-        canvas_height = new_height * char_height
-        bg_color = (40, 44, 52)  # VS Code 深色背景
-        text_color = (171, 178, 191)  # VS Code 浅色文字
-        
-        canvas = PILImage.new('RGB', (canvas_width, canvas_height), bg_color)
-        
-        draw = ImageDraw.Draw(canvas)
-        char_count = len(generator.chars)
-        
-        # 获取RGB像素（如果需要）
-        if color_mode == 'color':
-            img_rgb = img_small.convert('RGB')
-            rgb_pixels = img_rgb.getdata()
-        
-        # 绘制字符
-        for i in range(new_height):
-            for j in range(width):
-                idx = i * width + j
-                if idx >= len(gray_pixels):
-                    break
-                
-                # 获取字符
-                gray_val = gray_pixels[idx]
-                char_idx = min(gray_val * char_count // 256, char_count - 1)
-                char = generator.chars[char_idx]
-                
-                # 跳过空格
-                if char == ' ':
-                    continue
-                
-                # 计算位置
-                x = j * char_width
-                y = i * char_height
-                
-                # 确定颜色
-                if color_mode == 'color':
-                    r, g, b = rgb_pixels[idx]
-                    min_brightness = 80
-                    if r + g + b < min_brightness * 3:
-                        factor = (min_brightness * 3) / max(r + g + b, 1)
-                        r, g, b = min(255, int(r * factor)), min(255, int(g * factor)), min(255, int(b * factor))
-                    color = (r, g, b)
-                else:
-                    brightness_factor = gray_val / 255.0
-                    r = int(text_color[0] * (0.3 + 0.7 * brightness_factor))
-                    g = int(text_color[1] * (0.3 + 0.7 * brightness_factor))
-                    b = int(text_color[2] * (0.3 + 0.7 * brightness_factor))
-                    color = (r, g, b)
-                
-                draw.text((x, y), char, font=font, fill=color)
-        
-        # 保存图片到临时文件
-        canvas.save(temp_file, format="PNG")
+        with tracked_request(), timing() as timer:
+            params = normalize_params(resolve_charset(charset, invert), width, color_mode, brightness, contrast,
+                                      font_size, output_format)
+            # 相同的请求正在处理时不再占用名额，等待它的结果（包括错误）
+            key = request_key(image_path, params)
+            joined = inflight.running(key)
+            (result, cache_hit), coalesced = await inflight.run(key, convert)
+    except Exception as e:
+        return f"❌ Error: {str(e)}"
+    finally:
+        observe_request(timer, joined)
+    message = format_result(result, cache_hit, coalesced)
+    if show_timing:
+        message += "\n" + format_timing_block(timer)
+    return message
+
+
+async def _generate_ascii_image(image_path: str, width: int, charset: str, color_mode: str,
+                                brightness: float, contrast: float, invert: bool, font_size: int,
+                                ctx: Context | None = None, output_format: str = 'png') -> tuple[dict, bool]:
+    """Body of generate_ascii_image, run while holding a worker pool slot.
+
+    Reports progress in three steps: loading, rendering, uploading (skipped for HTML/SVG).
+
+    Returns:
+        Tuple of (result dict, whether it came from the cache), see convert_source
+    """
+    async def progress(step: int, message: str) -> None:
+        await report_progress(ctx, step, 3, message)
+
+    await progress(0, "Loading image")
+    source, input_basename = await load_source(image_path)
+    result, cache_hit = await convert_source(
+        source, input_basename, width, charset, color_mode, brightness, contrast, invert, font_size,
+        progress=progress, output_format=output_format)
+    await progress(3, "Done")
+    return result, cache_hit
+
+
+async def report_progress(ctx: Context | None, progress: float, total: float, message: str) -> None:
+    """Send an MCP progress notification if the client asked for them.
+
+    Without a request context (direct calls) or a progress token this is a
+    no-op; a failing notification never fails the conversion itself.
+    """
+    if ctx is None:
+        return
+    try:
+        await ctx.report_progress(progress, total, message)
+    except Exception:
+        pass
+
+
+async def load_source(image_path: str) -> tuple[bytes | bytearray, str]:
+    """Read a local image or download an image URL into memory.
+    
+    Args:
+        image_path: Absolute local path or http/https URL
         
-        # Upload to Supabase
-        public_url = upload_to_supabase(temp_file, input_basename)
+    Returns:
+        Tuple of (image_bytes, basename)
         
-        # 获取文件大小
-        file_size_kb = Path(temp_file).stat().st_size / 1024
+    Raises:
+        Exception: With a user-facing message if the input cannot be read
+    """
+    # Check if input is a URL
+    if is_valid_url(image_path):
+        # Download image from URL into memory
+        with stage('download') as downloading:
+            source, basename = await download_image(image_path)
+            downloading.nbytes = len(source)
+        return source, basename
+    
+    # 验证输入路径必须是绝对路径
+    input_file = Path(image_path)
+    if not input_file.is_absolute():
+        raise Exception(f"Only absolute paths are allowed. Got relative path: {image_path}\n💡 Hint: Use full path like 'D:\\folder\\image.jpg' or use a URL like 'https://example.com/image.jpg'")
+    
+    # 验证文件是否存在
+    if not input_file.exists():
+        raise Exception(f"Image file not found: {image_path}")
+    
+    with stage('download') as reading:
+        source = await asyncio.to_thread(input_file.read_bytes)
+        reading.nbytes = len(source)
+    return source, input_file.stem
+
+
+async def convert_source(source: bytes | bytearray, input_basename: str, width: int, charset: str, color_mode: str,
+                         brightness: float, contrast: float, invert: bool, font_size: int,
+                         render_limit: asyncio.Semaphore | None = None,
+                         upload_limit: asyncio.Semaphore | None = None,
+                         progress: Callable[[int, str], Awaitable[None]] | None = None,
+                         output_format: str = 'png') -> tuple[dict, bool]:
+    """Render image bytes and upload the PNG or WebP, or return the cached result.
+    
+    Args:
+        source: Encoded input image
+        input_basename: Base name used for the uploaded object
+        render_limit: Optional semaphore bounding concurrent renders (batch stage limit)
+        upload_limit: Optional semaphore bounding concurrent uploads (batch stage limit)
+        progress: Optional ``await progress(step, message)`` callback, called
+            with step 1 before rendering and step 2 before uploading
+        output_format: 'png' or 'webp' to render and upload an image, or
+            'html'/'svg' to convert to an inline document without uploading anything
         
-        return f"✅ ASCII art image generated and uploaded successfully!\n🌐 Public URL: {public_url}\n📐 Dimensions: {canvas_width}×{canvas_height} pixels\n💾 File size: {file_size_kb:.2f} KB"
+    Returns:
+        Tuple of (result dict with url/width/height/size/format/palette/encode_ms, or
+        format/markup/cols/rows/size/gzip_size for HTML and SVG, whether it came from the cache)
+    """
+    # 按输入内容和规范化参数查找缓存，命中则直接返回已上传的URL
+    renderer = await render_identity() if output_format in IMAGE_FORMATS else None
+    params = normalize_params(resolve_charset(charset, invert), width, color_mode, brightness, contrast, font_size,
+                              output_format, renderer)
+    # 整个输入的哈希和磁盘缓存读写在线程中进行，大图或慢磁盘不会卡住其他客户端
+    digest = await asyncio.to_thread(digest_bytes, source)
+    cache_key = make_key(digest, params)
+    cached = await result_cache.aget(cache_key)
+    if cached is not None:
+        return cached, True
+    
+    if output_format in MARKUP_FORMATS:
+        if progress is not None:
+            await progress(1, "Rendering")
+        async with render_limit or nullcontext():
+            rendered = await worker_pool.run(
+                markup_job, source, digest, charset, invert, output_format, params['width'],
+                params['color_mode'], params['brightness'], params['contrast'], params['font_size']
+            )
+        worker_grid_stats[rendered['pid']] = rendered.pop('grid_cache')
+        merge_timings(rendered.pop('timings'))
+        del rendered['pid']
+        result = {'format': output_format, **rendered}
+        await result_cache.aput(cache_key, result)
+        return result, False
     
+    # 在工作池中渲染ASCII艺术图片（VS Code 深色主题）并编码为PNG或WebP
+    if progress is not None:
+        await progress(1, "Rendering")
+    async with render_limit or nullcontext():
+        rendered = await worker_pool.run(
+            render_job, source, digest, charset, invert, params['width'], params['color_mode'],
+            params['brightness'], params['contrast'], params['font_size'], output_format
+        )
+    worker_grid_stats[rendered['pid']] = rendered['grid_cache']
+    worker_encoder_stats[rendered['pid']] = rendered['encoder']
+    merge_timings(rendered['timings'])
+    
+    # 上传到存储后端（异步连接池，失败自动重试）；等待上传时工作池可以渲染下一个请求
+    if progress is not None:
+        await progress(2, "Uploading")
+    async with upload_limit or nullcontext():
+        with stage('upload') as uploading:
+            public_url = await upload_image(rendered['data'], input_basename, cache_key, rendered['format'])
+            uploading.nbytes = len(rendered['data'])
+    
+    result = {
+        'url': public_url,
+        'width': rendered['width'],
+        'height': rendered['height'],
+        'size': len(rendered['data']),
+        'frames': rendered['frames'],
+        'format': rendered['format'],
+        'palette': rendered['palette'],
+        'encode_ms': rendered['encode_ms'],
+    }
+    await result_cache.aput(cache_key, result)
+    return result, False
+
+
+def format_batch_item(index: int, image_path: str, outcome) -> str:
+    """Format one batch entry: the result and cache state, or the error."""
+    if isinstance(outcome, Exception):
+        return f"{index}. ❌ {image_path}\n   Error: {outcome}"
+    result, cache_hit, coalesced = outcome
+    if result.get('format') in MARKUP_FORMATS:
+        return (
+            f"{index}. ✅ {image_path}\n"
+            f"   📐 {result['cols']}×{result['rows']} characters, {result['size'] / 1024:.2f} KB "
+            f"({result['gzip_size'] / 1024:.2f} KB gzipped), cache {cache_state(cache_hit, coalesced)}\n"
+            f"```{result['format']}\n{result['markup']}\n```"
+        )
+    return (
+        f"{index}. ✅ {image_path}\n"
+        f"   🌐 {result['url']}\n"
+        f"   📐 {result['width']}×{result['height']} pixels, {result['size'] / 1024:.2f} KB"
+        f"{encoding_details(result)}, "
+        f"cache {cache_state(cache_hit, coalesced)}"
+    )
+
+
+@mcp.tool()
+async def generate_ascii_batch(
+    images: list[str | dict],
+    width: int = 100,
+    charset: str = "simple",
+    color_mode: str = "gray",
+    brightness: float = 1.0,
+    contrast: float = 1.0,
+    invert: bool = False,
+    font_size: int = 10,
+    output_format: str = "png",
+    ctx: Context | None = None
+) -> str:
+    """Generate ASCII art images for many inputs in one call and upload them.
+
+    Use this instead of calling generate_ascii_image repeatedly, e.g. for a
+    gallery. Downloads, renders and uploads of different images overlap, and
+    one failing image does not stop the others.
+
+    Args:
+        images: List of inputs. Each entry is either an ABSOLUTE path / image URL,
+            or an object with an "image_path" key plus any of width, charset,
+            color_mode, brightness, contrast, invert, font_size, output_format to
+            override the shared options for that image
+        width: Shared width of ASCII art in characters (default: 100)
+        charset: Shared character set ('simple', 'detailed', 'blocks', 'minimal',
+            'numbers' or a custom string from dark to bright)
+        color_mode: Shared mode, 'gray' for grayscale or 'color' for colored ASCII
+        brightness: Shared brightness adjustment (1.0 = original)
+        contrast: Shared contrast adjustment (1.0 = original)
+        invert: Shared reverse character brightness mapping
+        font_size: Shared font size in pixels (default: 10)
+        output_format: Shared format, 'png' (default) or 'webp' (uploaded), 'html'
+            or 'svg' (returned inline)
+
+    Returns:
+        Summary line followed by one numbered entry per input with its public
+        URL, dimensions and cache state, or its error
+    """
+    if not images:
+        return "❌ Error: No images given"
+    if len(images) > BATCH_MAX_ITEMS:
+        return f"❌ Error: Too many images in one batch: {len(images)} (limit {BATCH_MAX_ITEMS})"
+    shared = {
+        'width': width, 'charset': charset, 'color_mode': color_mode, 'brightness': brightness,
+        'contrast': contrast, 'invert': invert, 'font_size': font_size, 'output_format': output_format,
+    }
+    try:
+        with tracked_request():
+            # 整批占用一个请求名额；批内各阶段再分别限流
+            async with worker_pool.slot():
+                started = time.perf_counter()
+                outcomes = await _generate_batch(images, shared, ctx)
+                elapsed = time.perf_counter() - started
     except Exception as e:
         return f"❌ Error: {str(e)}"
+
+    lines = []
+    failed = cached = coalesced_count = 0
+    for index, (item, outcome) in enumerate(zip(images, outcomes), start=1):
+        image_path = item.get('image_path', '?') if isinstance(item, dict) else item
+        if isinstance(outcome, Exception):
+            failed += 1
+        else:
+            cached += outcome[1]
+            coalesced_count += outcome[2]
+        lines.append(format_batch_item(index, image_path, outcome))
+    headline = "✅" if not failed else ("⚠️" if failed < len(images) else "❌")
+    summary = (f"{headline} Batch finished: {len(images) - failed} of {len(images)} images converted, "
+               f"{failed} failed, {cached} from cache, {coalesced_count} shared with identical requests, "
+               f"in {elapsed:.2f} s")
+    return "\n".join([summary] + lines)
+
+
+async def _generate_batch(images: list, shared: dict, ctx: Context | None = None) -> list:
+    """Run every batch entry through download -> render -> upload with per-stage limits.
+    
+    A progress notification is sent each time an entry finishes.
+    
+    Returns:
+        One entry per input: a (result, cache_hit, coalesced) tuple or the
+        exception that stopped that input
+    """
+    download_limit = asyncio.Semaphore(BATCH_DOWNLOADS)
+    render_limit = asyncio.Semaphore(max(worker_pool.workers, 1))
+    upload_limit = asyncio.Semaphore(BATCH_UPLOADS)
+
+    async def one(item):
+        if isinstance(item, dict):
+            unknown = set(item) - set(ITEM_OPTIONS) - {'image_path'}
+            if unknown:
+                raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+            if 'image_path' not in item:
+                raise ValueError("Missing 'image_path'")
+            options = {**shared, **{key: item[key] for key in ITEM_OPTIONS if key in item}}
+            image_path = item['image_path']
+        else:
+            options = shared
+            image_path = item
+        image_path = str(image_path)
+
+        async def convert() -> tuple[dict, bool]:
+            async with download_limit:
+                source, input_basename = await load_source(image_path)
+            return await convert_source(
+                source, input_basename, options['width'], options['charset'], options['color_mode'],
+                options['brightness'], options['contrast'], options['invert'], options['font_size'],
+                render_limit=render_limit, upload_limit=upload_limit, output_format=options['output_format']
+            )
+
+        # 每个条目单独计时，计入各阶段的直方图；批内重复的条目和其他请求正在处理的相同输入只转换一次
+        timer, joined = None, False
+        try:
+            with timing() as timer:
+                params = normalize_params(
+                    resolve_charset(options['charset'], options['invert']), options['width'], options['color_mode'],
+                    options['brightness'], options['contrast'], options['font_size'], options['output_format'])
+                key = request_key(image_path, params)
+                joined = inflight.running(key)
+                (result, cache_hit), coalesced = await inflight.run(key, convert)
+                return result, cache_hit, coalesced
+        finally:
+            observe_request(timer, joined)
+
+    finished = 0
+
+    async def tracked(item):
+        nonlocal finished
+        try:
+            return await one(item)
+        finally:
+            finished += 1
+            await report_progress(ctx, finished, len(images), f"{finished} of {len(images)} images processed")
+
+    return await asyncio.gather(*(tracked(item) for item in images), return_exceptions=True)
+
+
+def _sum_worker_stats(per_worker: dict[int, dict]) -> dict:
+    """Add up the latest counter snapshots of all worker processes."""
+    totals: dict[str, float] = {}
+    for stats in per_worker.values():
+        for name, value in stats.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+@mcp.resource("ascii-art://stats")
+def server_stats() -> str:
+    """Cache counters, image encoder totals, request coalescing and worker pool load, as JSON.
     
+    Grid caches and image encoders live in the worker processes; their
+    counters are summed from the snapshot each worker returned with its
+    latest render. Encoder totals (images, palette images, bytes, seconds)
+    show what the configured palette mode and compression level cost in CPU
+    time and save in upload bytes. Coalescing counts conversions executed
+    and requests that instead awaited an identical request in flight.
+    """
+    return json.dumps({
+        'result_cache': result_cache.stats(),
+        'grid_cache': _sum_worker_stats(worker_grid_stats),
+        'encoder': _sum_worker_stats(worker_encoder_stats),
+        'coalescing': inflight.stats(),
+        'worker_pool': worker_pool.stats(),
+    }, indent=2)
+
+
+@mcp.resource("ascii-art://metrics", mime_type="text/plain")
+def server_metrics() -> str:
+    """Per-stage latency and size histograms in the Prometheus text exposition format.
+    
+    Every request adds the seconds it spent in each stage (queue, download,
+    decode, resize, enhance, mapping, export, draw, encode, upload) and the
+    bytes downloaded, encoded and uploaded; stages run in worker processes
+    travel back with the render result (empty when ASCII_ART_TIMING=0).
+    Followed by the request coalescing counters.
+    """
+    return stage_metrics.prometheus() + inflight.prometheus()
+
+
+def readiness_status() -> str:
+    """'ready', 'starting' (workers still warming up), 'failed' (a warm-up job raised) or 'draining'."""
+    if draining:
+        return 'draining'
+    if not all(future.done() for future in warmup):
+        return 'starting'
+    if any(future.cancelled() or future.exception() is not None for future in warmup):
+        return 'failed'
+    return 'ready'
+
+
+@mcp.custom_route("/healthz", methods=["GET"])
+async def health(request: Request) -> JSONResponse:
+    """Liveness probe of the HTTP transports: the process is up and its event loop responds."""
+    return JSONResponse({'status': 'ok'})
+
+
+@mcp.custom_route("/readyz", methods=["GET"])
+async def readiness(request: Request) -> JSONResponse:
+    """Readiness probe of the HTTP transports.
+    
+    200 once the worker processes are started and have loaded the rendering
+    modules and fonts; 503 while they are warming up, if warming up failed
+    and after a shutdown signal. The body includes the worker pool load.
+    """
+    status = readiness_status()
+    body = {'status': status, 'worker_pool': worker_pool.stats(), 'coalescing': inflight.stats()}
+    return JSONResponse(body, status_code=200 if status == 'ready' else 503)
+
+
+class _TrackRequests:
+    """ASGI middleware counting requests in progress, except GET (long-lived event streams and probes)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        global active_requests
+        if scope['type'] != 'http' or scope['method'] == 'GET':
+            await self.app(scope, receive, send)
+            return
+        active_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            active_requests -= 1
+
+
+class _DrainingServer(uvicorn.Server):
+    """uvicorn server that lets requests in progress finish before it stops.
+    
+    uvicorn (and sse-starlette, which closes every event stream on
+    ``handle_exit``) would end the streams carrying pending tool results
+    right away. On the first signal this server only starts draining:
+    /readyz turns 503 and new tool calls are refused, and once the requests
+    in progress are done (or SHUTDOWN_TIMEOUT passed) the normal shutdown
+    runs. A second signal shuts down immediately.
+    """
+
+    def handle_exit(self, sig, frame) -> None:
+        global draining
+        if draining:
+            super().handle_exit(sig, frame)
+            return
+        draining = True
+        # 信号处理函数中不直接操作事件循环
+        asyncio.get_running_loop().call_soon_threadsafe(lambda: asyncio.ensure_future(self._drain(sig, frame)))
+
+    async def _drain(self, sig, frame) -> None:
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while active_requests and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        super().handle_exit(sig, frame)
+
+
+async def serve_http(transport: str, host: str, port: int) -> None:
+    """Serve MCP over streamable HTTP or SSE until SIGINT/SIGTERM, then shut down gracefully.
+    
+    After the signal /readyz turns 503 and new tool calls are refused, so a
+    load balancer can move traffic away; requests in progress get up to
+    SHUTDOWN_TIMEOUT seconds to finish. Then the listener closes and the
+    pooled download and upload clients are released.
+    
+    Args:
+        transport: 'streamable-http' (MCP endpoint /mcp) or 'sse' (/sse and /messages/)
+        host: Address to listen on
+        port: Port to listen on
+    """
+    mcp.settings.host, mcp.settings.port = host, port
+    if host not in ('127.0.0.1', 'localhost', '::1'):
+        # DNS 重绑定保护只允许 localhost 的 Host 头；监听其他地址时由部署环境（反向代理、防火墙）负责访问控制
+        mcp.settings.transport_security = None
+    app = mcp.streamable_http_app() if transport == 'streamable-http' else mcp.sse_app()
+    config = uvicorn.Config(_TrackRequests(app), host=host, port=port, log_level=mcp.settings.log_level.lower(),
+                            timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
+    try:
+        await _DrainingServer(config).serve()
     finally:
-        # Clean up temporary files
-        if temp_file and Path(temp_file).exists():
-            try:
-                Path(temp_file).unlink()
-            except:
-                pass
-        # Clean up downloaded file if any
-        if downloaded_file and Path(downloaded_file).exists():
-            try:
-                Path(downloaded_file).unlink()
-            except:
-                pass
+        await downloader.aclose()
+        if storage is not None:
+            await storage.aclose()
+
+
+def _exit_on_signal(signum, frame) -> None:
+    raise SystemExit(0)
 
 
 def main():
-    """启动MCP服务器"""
-    # 使用stdio传输协议运行服务器
-    mcp.run(transport='stdio')
+    """启动MCP服务器：默认使用stdio传输协议，--transport streamable-http/sse 启动长期运行的网络服务"""
+    global worker_pool
+    parser = argparse.ArgumentParser(description='ASCII Art MCP 服务器')
+    parser.add_argument('--transport', choices=('stdio',) + HTTP_TRANSPORTS,
+                        default=os.getenv('ASCII_ART_TRANSPORT', 'stdio'),
+                        help='传输协议（默认 stdio，每个客户端启动一个进程；网络模式下所有客户端共享一个服务）')
+    parser.add_argument('--host', default=os.getenv('ASCII_ART_HOST', '127.0.0.1'), help='网络模式的监听地址')
+    parser.add_argument('--port', type=int, default=int(os.getenv('ASCII_ART_PORT', 8000)), help='网络模式的监听端口')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='渲染工作进程数（默认 ASCII_ART_WORKERS，0 表示在服务进程的线程中渲染）')
+    args = parser.parse_args()
+    if args.workers is not None:
+        worker_pool = WorkerPool.from_env(args.workers)
+    
+    http = args.transport in HTTP_TRANSPORTS
+    if http:
+        # uvicorn 排空请求后会重新发出 SIGTERM；转为 SystemExit，下面的 finally 才能关闭工作进程
+        signal.signal(signal.SIGTERM, _exit_on_signal)
+    # 在后台启动工作进程并加载渲染模块和字体，第一个请求不用等；
+    # 网络模式长期运行，总是预热（ASCII_ART_PREWARM=1 对 stdio 同样生效）
+    if http or os.getenv('ASCII_ART_PREWARM', '0') == '1':
+        warmup.extend(worker_pool.prewarm())
+    try:
+        if http:
+            asyncio.run(serve_http(args.transport, args.host, args.port))
+        else:
+            mcp.run(transport='stdio')
+    finally:
+        worker_pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,867 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Benchmarks
+ASCII艺术生成各阶段的性能基准测试
+
+用法:
+  python benchmark.py mapping                 # 字符映射：查找表 vs 逐像素
+  python benchmark.py mapping -w 400 -r 20    # 指定宽度和重复次数
+  python benchmark.py ansi -w 200             # 彩色ANSI：逐字符转义 vs 颜色段合并
+  python benchmark.py render -w 200           # 图片渲染：字形图集 vs 逐字符 draw.text
+  python benchmark.py tone -w 100             # 亮度/对比度：原图上 ImageEnhance vs 网格上查找表
+  python benchmark.py retune -w 100           # 反复调参：无缓存 vs 网格缓存
+  python benchmark.py loader -w 100           # 大图加载：完整解码 vs 按目标尺寸解码（耗时与峰值内存）
+  python benchmark.py workers -w 200 -r 16    # 并发请求：事件循环内渲染 vs 工作池（吞吐与事件循环卡顿）
+  python benchmark.py upload -r 32            # 上传：每次新建连接 vs 连接池（假存储服务器，模拟往返延迟）
+  python benchmark.py batch -w 100 -r 16      # 图集：逐个调用 generate_ascii_image vs 一次 generate_ascii_batch
+  python benchmark.py bands -w 400 -f 20 -r 3 # 超宽画布：单进程 vs 1/2/4/8 进程分带渲染
+  python benchmark.py animation -w 120 -r 60  # 动画：save_all 收集所有帧 vs 流式写出 / 多进程并行（-r 为帧数）
+  python benchmark.py stream -w 2000 -r 3     # 文本输出：拼接完整字符串 vs 逐行生成（首行耗时与峰值内存）
+  python benchmark.py grid -w 200 -r 5        # 文本+PNG输出：各自解码 vs 一次解码共享字符网格
+  python benchmark.py markup -w 100 -r 5      # scan_*.png：PNG vs HTML/SVG 的体积（原始/gzip）与生成耗时
+  python benchmark.py encode -w 100 -r 3      # 调色板模式 × 压缩级别 × PNG/WebP：体积、编码耗时与误差
+  python benchmark.py timing -w 150 -r 10     # 阶段计时的开销与单次渲染各阶段耗时
+  python benchmark.py startup -r 5            # MCP服务器冷启动：到响应 initialize 的耗时与空闲RSS
+  python benchmark.py coalesce -w 100 -r 16   # 16 个相同请求同时到达：各自转换 vs 合并为一次
+  python benchmark.py fonts -w 60 -r 50       # 每次渲染的字体开销：逐次查找加载 vs 字体注册表（含小图整体渲染）
+"""
+
+import argparse
+import asyncio
+import io
+import multiprocessing
+import platform
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+from animation import iter_frames
+from fonts import BUNDLED_FONT, SYSTEM_FONTS, FontRegistry, cell_size
+from main import ASCIIArtGenerator
+from renderer import DEFAULT_BG_COLOR, DEFAULT_TEXT_COLOR, font_cell_size
+
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / "scan_test.jpg"
+
+
+def _timeit(func, repeat):
+    """运行 repeat 次，返回 (最短耗时, 中位耗时)，单位毫秒"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return min(samples), statistics.median(samples)
+
+
+def _report(name, baseline, optimized):
+    """打印一组对比结果"""
+    speedup = baseline[1] / optimized[1] if optimized[1] else float('inf')
+    print(f"{name:<24} baseline {baseline[1]:9.2f} ms   optimized {optimized[1]:9.2f} ms   x{speedup:.1f}")
+
+
+def _legacy_grayscale(chars, img, width):
+    """优化前的逐像素灰度映射"""
+    img = img.convert('L')
+    pixels = img.tobytes()
+    char_count = len(chars)
+    ascii_str = ''.join(chars[min(p * char_count // 256, char_count - 1)] for p in pixels)
+    return '\n'.join(ascii_str[i:i+width] for i in range(0, len(ascii_str), width))
+
+
+def _legacy_colored(chars, img, width):
+    """优化前的逐像素ANSI彩色映射"""
+    img = img.convert('RGB')
+    rgb = img.tobytes()
+    gray_pixels = img.convert('L').tobytes()
+    char_count = len(chars)
+    lines = []
+    for i in range(0, len(gray_pixels), width):
+        line = ''
+        for j in range(width):
+            idx = i + j
+            r, g, b = rgb[idx*3:idx*3+3]
+            char = chars[min(gray_pixels[idx] * char_count // 256, char_count - 1)]
+            line += f'\033[38;2;{r};{g};{b}m{char}\033[0m'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _legacy_render(chars, img_small, font, color_mode):
+    """优化前的逐字符 draw.text 渲染"""
+    char_width, char_height = font_cell_size(font)
+    width, height = img_small.size
+    gray_pixels = img_small.convert('L').tobytes()
+    rgb = img_small.convert('RGB').tobytes()
+    canvas = Image.new('RGB', (width * char_width, height * char_height), DEFAULT_BG_COLOR)
+    draw = ImageDraw.Draw(canvas)
+    char_count = len(chars)
+    for idx, gray_val in enumerate(gray_pixels):
+        char = chars[min(gray_val * char_count // 256, char_count - 1)]
+        if char == ' ':
+            continue
+        if color_mode == 'color':
+            r, g, b = rgb[idx*3:idx*3+3]
+            if r + g + b < 240:
+                factor = 240 / max(r + g + b, 1)
+                r, g, b = min(255, int(r * factor)), min(255, int(g * factor)), min(255, int(b * factor))
+            color = (r, g, b)
+        else:
+            color = tuple(int(c * (0.3 + 0.7 * (gray_val / 255.0))) for c in DEFAULT_TEXT_COLOR)
+        draw.text(((idx % width) * char_width, (idx // width) * char_height), char, font=font, fill=color)
+    return canvas
+
+
+def _image_diff(a, b):
+    """返回 (相同像素比例, 平均绝对误差)"""
+    a = np.asarray(a, dtype=np.int16)
+    b = np.asarray(b, dtype=np.int16)
+    same = np.all(a == b, axis=-1).mean()
+    return same, np.abs(a - b).mean()
+
+
+def _grid_image(image_path, width):
+    """按CLI相同的比例把样例图缩放到字符网格"""
+    img = Image.open(image_path)
+    height = int(img.height / img.width * width * 0.55)
+    return img.resize((width, height))
+
+
+def bench_mapping(args):
+    """字符映射：查找表 vs 逐像素"""
+    img = _grid_image(args.image, args.width)
+    print(f"grid {img.width}x{img.height}, charset={args.charset}, repeat={args.repeat}")
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    chars = generator.chars
+
+    assert generator._create_grayscale_ascii(img, img.width) == _legacy_grayscale(chars, img, img.width)
+
+    _report('gray mapping',
+            _timeit(lambda: _legacy_grayscale(chars, img, img.width), args.repeat),
+            _timeit(lambda: generator._create_grayscale_ascii(img, img.width), args.repeat))
+
+
+def bench_ansi(args):
+    """彩色ANSI输出：逐字符转义 vs 颜色段合并（体积与耗时）"""
+    img = _grid_image(args.image, args.width)
+    print(f"grid {img.width}x{img.height}, charset={args.charset}, repeat={args.repeat}")
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    chars = generator.chars
+
+    legacy = _legacy_colored(chars, img, img.width)
+    gray_size = len(generator._create_grayscale_ascii(img, img.width).encode('utf-8'))
+    legacy_size = len(legacy.encode('utf-8'))
+    legacy_time = _timeit(lambda: _legacy_colored(chars, img, img.width), args.repeat)
+    print(f"{'per-cell (legacy)':<24} {legacy_size:>10,} bytes  x{legacy_size / gray_size:5.1f} of gray   {legacy_time[1]:8.2f} ms")
+
+    variants = [
+        ('truecolor exact', {'ansi_palette': 'truecolor', 'color_step': 1}),
+        ('truecolor step 8', {'ansi_palette': 'truecolor', 'color_step': 8}),
+        ('truecolor step 32', {'ansi_palette': 'truecolor', 'color_step': 32}),
+        ('xterm-256', {'ansi_palette': '256'}),
+    ]
+    for name, options in variants:
+        art = generator._create_colored_ascii(img, img.width, **options)
+        size = len(art.encode('utf-8'))
+        elapsed = _timeit(lambda: generator._create_colored_ascii(img, img.width, **options), args.repeat)
+        print(f"{name:<24} {size:>10,} bytes  x{size / gray_size:5.1f} of gray   {elapsed[1]:8.2f} ms"
+              f"   {1 - size / legacy_size:6.1%} smaller than legacy")
+
+
+def bench_render(args):
+    """图片渲染：字形图集 vs 逐字符 draw.text"""
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    font = generator._get_font(args.font_size)
+    char_width, char_height = font_cell_size(font)
+    img = Image.open(args.image)
+    height = int(img.height / img.width * args.width * (char_width / char_height))
+    img_small = img.resize((args.width, height))
+    print(f"grid {args.width}x{height}, font_size={args.font_size}, charset={args.charset}, repeat={args.repeat}")
+
+    for color_mode in ('gray', 'color'):
+        legacy = _legacy_render(generator.chars, img_small, font, color_mode)
+        atlas = generator._render_canvas(img_small, font, color_mode)
+        same, mae = _image_diff(legacy, atlas)
+        print(f"{color_mode}: {atlas.width}x{atlas.height} px, identical pixels {same:.2%}, mean abs error {mae:.3f}")
+        _report(f'{color_mode} render',
+                _timeit(lambda: _legacy_render(generator.chars, img_small, font, color_mode), max(1, args.repeat // 5)),
+                _timeit(lambda: generator._render_canvas(img_small, font, color_mode), args.repeat))
+
+
+def bench_tone(args):
+    """亮度/对比度：原图上 ImageEnhance vs 缩放后的查找表（耗时与误差）"""
+    from main import apply_tone
+
+    source = Image.open(args.image)
+    source.load()
+    height = int(source.height / source.width * args.width * 0.55)
+    size = (args.width, height)
+    print(f"source {source.width}x{source.height} -> grid {args.width}x{height}, repeat={args.repeat}")
+
+    def legacy(brightness, contrast):
+        img = ImageEnhance.Brightness(source).enhance(brightness)
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+        return img.resize(size)
+
+    def lut(brightness, contrast):
+        return apply_tone(source.resize(size), brightness, contrast)
+
+    for brightness, contrast in ((1.2, 1.0), (1.0, 1.5), (0.8, 2.0)):
+        diff = np.abs(np.asarray(legacy(brightness, contrast).convert('L'), dtype=np.int16)
+                      - np.asarray(lut(brightness, contrast).convert('L'), dtype=np.int16))
+        print(f"brightness={brightness} contrast={contrast}: mean abs error {diff.mean():.3f}, max {diff.max()}")
+        _report('  enhance + resize',
+                _timeit(lambda: legacy(brightness, contrast), args.repeat),
+                _timeit(lambda: lut(brightness, contrast), args.repeat))
+
+
+def bench_retune(args):
+    """同一张图反复调参（字符集/颜色/亮度）：无缓存 vs 网格缓存"""
+    from cache import GridCache, digest_bytes
+
+    variants = [
+        {'char_set': 'simple'}, {'char_set': 'blocks'}, {'char_set': 'detailed', 'invert': True},
+    ]
+    tunings = [
+        {'color_mode': 'gray'}, {'color_mode': 'color'}, {'brightness': 1.2, 'contrast': 1.3},
+    ]
+    for label, image_path in (('scan_test.jpg', args.image), ('synthetic 50 MP', str(_synthetic_image(50)))):
+        data = Path(image_path).read_bytes()
+        print(f"{label}: {len(variants) * len(tunings)} renders at width={args.width}")
+
+        def session(grid_cache):
+            digest = digest_bytes(data)
+            for variant in variants:
+                generator = ASCIIArtGenerator(grid_cache=grid_cache, **variant)
+                for tuning in tunings:
+                    generator.render_image(data, width=args.width, font_size=args.font_size, digest=digest, **tuning)
+
+        grid_cache = GridCache()
+        _report('  session',
+                _timeit(lambda: session(None), args.repeat),
+                _timeit(lambda: session(grid_cache), args.repeat))
+        print(f"  grid cache: {grid_cache.stats()}")
+
+
+def _synthetic_image(megapixels):
+    """生成（并缓存到临时目录）指定像素数的合成JPEG大图"""
+    path = Path(tempfile.gettempdir()) / f"ascii_art_bench_{megapixels}mp.jpg"
+    if not path.exists():
+        width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+        height = megapixels * 1_000_000 // width
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        rgb = np.empty((height, width, 3), dtype=np.uint8)
+        rgb[..., 0] = x
+        rgb[..., 1] = y
+        rgb[..., 2] = (x + y) % 256
+        Image.fromarray(rgb).save(path, quality=90)
+    return path
+
+
+def _peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）。Linux上读VmHWM，exec后不会继承父进程的峰值"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load_once(pipeline, image_path, width, brightness):
+    """在独立进程中执行一次加载+转换，返回 (耗时ms, 峰值RSS MB)"""
+    start = time.perf_counter()
+    if pipeline == 'legacy':
+        # 优化前：完整解码、全分辨率调整亮度，再缩放
+        img = Image.open(image_path)
+        if brightness != 1.0:
+            img = ImageEnhance.Brightness(img).enhance(brightness)
+        height = int(img.height / img.width * width * 0.55)
+        img = img.resize((width, height))
+        ASCIIArtGenerator()._create_grayscale_ascii(img, width)
+    else:
+        ASCIIArtGenerator().image_to_ascii(image_path, width=width, brightness=brightness)
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, _peak_rss_mb()
+
+
+def bench_loader(args):
+    """大图加载：完整解码 vs 按目标尺寸解码（耗时与峰值内存）"""
+    images = [('scan_test.jpg', args.image), ('synthetic 50 MP', str(_synthetic_image(50)))]
+    context = multiprocessing.get_context('spawn')
+    for label, image_path in images:
+        with Image.open(image_path) as img:
+            print(f"{label}: {img.width}x{img.height}, width={args.width}, repeat={args.repeat}")
+        for brightness in (1.0, 1.2):
+            results = {}
+            for pipeline in ('legacy', 'draft'):
+                samples = []
+                for _ in range(args.repeat):
+                    # 每次使用新进程，峰值内存互不影响
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        samples.append(pool.submit(_load_once, pipeline, image_path, args.width, brightness).result())
+                results[pipeline] = (statistics.median(s[0] for s in samples), max(s[1] for s in samples))
+            legacy, draft = results['legacy'], results['draft']
+            print(f"  brightness={brightness}: legacy {legacy[0]:8.1f} ms {legacy[1]:7.1f} MB peak   "
+                  f"draft {draft[0]:8.1f} ms {draft[1]:7.1f} MB peak   x{legacy[0] / draft[0]:.1f} faster")
+
+
+async def _serve_jobs(run, jobs):
+    """并发执行 jobs，同时用一个定时协程测量事件循环最长卡顿（毫秒）"""
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append((time.perf_counter() - start) * 1000 - 1)
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(run(job) for job in jobs))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+    return elapsed, max(stalls, default=0.0)
+
+
+def bench_workers(args):
+    """并发请求：事件循环内渲染 vs 工作池（吞吐与事件循环卡顿）"""
+    from cache import digest_bytes
+    from workers import WorkerPool, render_job
+
+    data = Path(args.image).read_bytes()
+    digest = digest_bytes(data)
+    # 宽度各不相同，避免网格缓存命中
+    jobs = [(data, digest, args.charset, False, args.width + i, 'color', 1.0, 1.0, args.font_size)
+            for i in range(args.repeat)]
+    print(f"{args.repeat} concurrent renders at width~{args.width}, {multiprocessing.cpu_count()} CPUs")
+
+    async def inline(job):
+        # 旧实现：在事件循环线程上直接渲染
+        render_job(*job)
+
+    elapsed, stall = asyncio.run(_serve_jobs(inline, jobs))
+    print(f"  {'event loop':<12} {elapsed:7.2f} s  {len(jobs) / elapsed:6.1f} renders/s  max loop stall {stall:8.1f} ms")
+
+    for workers in (0, 1, 2, 4):
+        pool = WorkerPool(workers=workers, max_concurrency=max(workers, 1) * 2, max_queue=len(jobs))
+        # 预热工作进程，不计入进程启动时间
+        asyncio.run(pool.run(render_job, *jobs[0]))
+
+        async def pooled(job):
+            async with pool.slot():
+                await pool.run(render_job, *job)
+
+        elapsed, stall = asyncio.run(_serve_jobs(pooled, jobs))
+        pool.shutdown()
+        label = f"{workers} procs" if workers else 'threads'
+        print(f"  {label:<12} {elapsed:7.2f} s  {len(jobs) / elapsed:6.1f} renders/s  max loop stall {stall:8.1f} ms")
+
+
+def bench_upload(args):
+    """上传：每次新建连接 vs 连接池（假存储服务器，模拟往返延迟）"""
+    from storage import FakeStorageServer, SupabaseStorage
+
+    png = ASCIIArtGenerator(char_set=args.charset).render_png(args.image, width=100, font_size=args.font_size)
+    uploads = [(f'bench_{i}.png', png) for i in range(args.repeat)]
+    print(f"{len(uploads)} uploads of {len(png) / 1024:.0f} KB, 20 ms simulated latency")
+
+    async def fresh_clients(backend_factory):
+        # 旧实现：每个请求一个新客户端
+        for name, data in uploads:
+            backend = backend_factory()
+            await backend.upload(name, data)
+            await backend.aclose()
+
+    async def pooled(backend_factory, concurrency):
+        backend = backend_factory()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(name, data):
+            async with limit:
+                await backend.upload(name, data)
+
+        await asyncio.gather(*(one(name, data) for name, data in uploads))
+        await backend.aclose()
+
+    cases = [
+        ('new client each', lambda factory: fresh_clients(factory)),
+        ('pooled, serial', lambda factory: pooled(factory, 1)),
+        ('pooled, 8 at once', lambda factory: pooled(factory, 8)),
+    ]
+    for label, case in cases:
+        with FakeStorageServer(latency=0.02) as server:
+            start = time.perf_counter()
+            asyncio.run(case(lambda: SupabaseStorage(server.url, 'key', 'bench')))
+            elapsed = time.perf_counter() - start
+            print(f"  {label:<18} {elapsed * 1000:8.1f} ms  {len(uploads) / elapsed:6.1f} uploads/s  "
+                  f"{server.requests / len(uploads):.1f} requests/upload  {server.connections} connections")
+
+
+def bench_batch(args):
+    """图集：逐个调用 generate_ascii_image vs 一次 generate_ascii_batch"""
+    import logging
+
+    import ascii_art_server as server
+    from cache import ResultCache
+    from storage import FakeStorageServer, SupabaseStorage
+    from workers import WorkerPool
+
+    # 服务器导入时配置了 INFO 日志，httpx 会逐个请求打印
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    image_path = str(Path(args.image).resolve())
+    print(f"{args.repeat} images at width~{args.width}, uploads with 20 ms simulated latency")
+
+    async def serial():
+        for i in range(args.repeat):
+            await server.generate_ascii_image(image_path, width=args.width + i, charset=args.charset)
+
+    async def batch():
+        items = [{'image_path': image_path, 'width': args.width + i} for i in range(args.repeat)]
+        summary = await server.generate_ascii_batch(items, charset=args.charset)
+        assert summary.startswith('✅'), summary
+
+    async def session(workers):
+        # 连接池绑定事件循环，同一配置的所有调用放在一个循环里
+        # 预热工作进程、字体和图集
+        # 宽度各不相同，否则相同的条目会合并为一次转换
+        await server.generate_ascii_batch(
+            [{'image_path': image_path, 'width': args.width - 1 - i} for i in range(max(workers, 1))])
+        times = {}
+        for name, run in (('serial', serial), ('batch', batch)):
+            start = time.perf_counter()
+            await run()
+            times[name] = time.perf_counter() - start
+        await server.storage.aclose()
+        return times
+
+    for workers in (0, 2):
+        with FakeStorageServer(latency=0.02) as storage_server:
+            server.storage = SupabaseStorage(storage_server.url, 'key', 'bench')
+            server.worker_pool = WorkerPool(workers=workers, max_concurrency=max(workers, 1) * 2)
+            server.result_cache = ResultCache(max_entries=0)
+            times = asyncio.run(session(workers))
+            server.worker_pool.shutdown()
+        label = f"{workers} procs" if workers else 'threads'
+        print(f"  {label:<10} serial {times['serial']:6.2f} s   batch {times['batch']:6.2f} s   "
+              f"x{times['serial'] / times['batch']:.1f}")
+
+
+def bench_coalesce(args):
+    """突发的相同请求：各自转换 vs 合并为一次转换（耗时、渲染与上传次数）"""
+    import logging
+
+    import ascii_art_server as server
+    from cache import ResultCache
+    from singleflight import SingleFlight
+    from storage import FakeStorageServer, SupabaseStorage
+    from workers import WorkerPool
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    image_path = str(Path(args.image).resolve())
+    print(f"bursts of {args.repeat} identical requests at width {args.width}, uploads with 20 ms simulated latency")
+
+    async def session():
+        # 预热字体和图集（宽度不同，不影响计数）
+        await server.generate_ascii_image(image_path, width=args.width - 1, charset=args.charset)
+        start = time.perf_counter()
+        messages = await asyncio.gather(*(
+            server.generate_ascii_image(image_path, width=args.width, charset=args.charset)
+            for _ in range(args.repeat)
+        ))
+        elapsed = time.perf_counter() - start
+        await server.storage.aclose()
+        assert all(message.startswith('✅') for message in messages), messages
+        return elapsed
+
+    for label, enabled in (('each request', False), ('coalesced', True)):
+        with FakeStorageServer(latency=0.02) as storage_server:
+            server.storage = SupabaseStorage(storage_server.url, 'key', 'bench')
+            server.worker_pool = WorkerPool(workers=0, max_concurrency=args.repeat, max_queue=args.repeat)
+            server.result_cache = ResultCache(max_entries=0)
+            server.inflight = SingleFlight(enabled=enabled)
+            elapsed = asyncio.run(session())
+            uploads = storage_server.requests
+        stats = server.inflight.stats()
+        print(f"  {label:<13} {elapsed * 1000:8.1f} ms   {stats['executed'] - 1:3d} conversions   "
+              f"{uploads - 1:3d} uploads   {stats['coalesced']:3d} coalesced")
+
+
+def bench_bands(args):
+    """超宽画布：单进程 vs 1/2/4/8 进程分带渲染"""
+    from renderer import composite, composite_bands, get_atlas, gray_ink_colors
+
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    font = generator._get_font(args.font_size)
+    atlas = get_atlas(font, generator.chars)
+    cw, ch = font_cell_size(font)
+    grid = generator.make_grid(args.image, args.width, cell_ratio=cw / ch)
+    glyphs = grid.glyphs
+    inks = gray_ink_colors(grid.luma, DEFAULT_TEXT_COLOR)
+    rows, cols = glyphs.shape
+    print(f"canvas {cols * cw}x{rows * ch} ({cols * cw * rows * ch / 1e6:.1f} MP), "
+          f"{multiprocessing.cpu_count()} CPUs, repeat={args.repeat}")
+
+    reference = composite(atlas, glyphs, inks, DEFAULT_BG_COLOR).tobytes()
+    serial, _ = _timeit(lambda: composite(atlas, glyphs, inks, DEFAULT_BG_COLOR), args.repeat)
+    print(f"  {'serial':<10} {serial:8.1f} ms")
+    for workers in (1, 2, 4, 8):
+        # 第一次调用启动进程池（不计时），同时检查输出一致
+        assert composite_bands(atlas, glyphs, inks, DEFAULT_BG_COLOR, workers).tobytes() == reference
+        best, _ = _timeit(lambda: composite_bands(atlas, glyphs, inks, DEFAULT_BG_COLOR, workers), args.repeat)
+        print(f"  {f'{workers} procs':<10} {best:8.1f} ms   x{serial / best:.2f}   identical")
+
+
+def _synthetic_animation(image_path, frames):
+    """把示例图片裁成平移的镜头，生成（并缓存到临时目录）一个多帧GIF"""
+    path = Path(tempfile.gettempdir()) / f"ascii_art_bench_{Path(image_path).stem}_{frames}f.gif"
+    if not path.exists():
+        with Image.open(image_path) as img:
+            source = img.convert('RGB')
+        crop_width, crop_height = source.width * 2 // 3, source.height * 2 // 3
+        step = (source.width - crop_width) / max(frames - 1, 1)
+        images = [source.crop((int(i * step), 0, int(i * step) + crop_width, crop_height)) for i in range(frames)]
+        images[0].save(path, save_all=True, append_images=images[1:], duration=60, loop=0)
+    return path
+
+
+def _animate_once(mode, image_path, width, font_size, workers):
+    """在独立进程中把动画渲染为APNG一次，返回 (耗时ms, 峰值RSS MB, 输出字节数)"""
+    generator = ASCIIArtGenerator(char_set='simple')
+    output = io.BytesIO()
+    start = time.perf_counter()
+    if mode == 'save_all':
+        # 逐帧渲染后交给 Pillow 的 save_all：所有帧的画布同时留在内存中
+        img = Image.open(image_path)
+        frames = [generator.render_image(frame, width=width, font_size=font_size) for frame, _ in iter_frames(img)]
+        frames[0].save(output, format='PNG', save_all=True, append_images=frames[1:], duration=60, loop=0)
+    else:
+        generator.render_animation(image_path, output, width=width, font_size=font_size, workers=workers)
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, _peak_rss_mb(), len(output.getvalue())
+
+
+def bench_animation(args):
+    """动画：save_all 收集所有帧 vs 流式写出 / 多进程并行，以及ANSI帧流的增量编码"""
+    image_path = str(_synthetic_animation(args.image, args.repeat))
+    print(f"{args.repeat} frames, width={args.width}, font_size={args.font_size}, "
+          f"{multiprocessing.cpu_count()} CPUs")
+    context = multiprocessing.get_context('spawn')
+    for label, mode, workers in (('save_all', 'save_all', 1), ('streaming', 'stream', 1),
+                                 ('stream 2 procs', 'stream', 2), ('stream 4 procs', 'stream', 4)):
+        # 每次使用新进程，峰值内存互不影响
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            elapsed, peak, size = pool.submit(
+                _animate_once, mode, image_path, args.width, args.font_size, workers).result()
+        print(f"  {label:<15} {elapsed:8.1f} ms {peak:7.1f} MB peak   {size / 1024:8.1f} KB")
+
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    for color_mode in ('gray', 'color'):
+        full = 0
+        with Image.open(image_path) as img:
+            for frame, _ in iter_frames(img):
+                full += len(generator.image_to_ascii(frame, width=args.width, color_mode=color_mode))
+        delta = sum(len(text) for text, _ in generator.ascii_animation(image_path, width=args.width,
+                                                                       color_mode=color_mode))
+        print(f"  ansi {color_mode:<5} full frames {full / 1024:8.1f} KB   deltas {delta / 1024:8.1f} KB   "
+              f"x{full / delta:.1f} smaller")
+
+
+def bench_stream(args):
+    """文本输出：拼接完整字符串 vs 逐行生成（首行耗时、总耗时与Python堆峰值）"""
+    from cache import GridCache
+
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    # 网格预先加载，只比较映射和编码
+    generator.grid_cache = GridCache(max_bytes=1 << 30)
+    data = Path(args.image).read_bytes()
+    generator.image_to_ascii(data, width=args.width, color_mode='color')
+    rows = generator._load_grid(data, args.width).height
+    print(f"grid {args.width}x{rows}, repeat={args.repeat}")
+
+    def whole(color_mode):
+        art = generator.image_to_ascii(data, width=args.width, color_mode=color_mode)
+        first = time.perf_counter()
+        for line in art.split('\n'):
+            pass
+        return first
+
+    def streamed(color_mode):
+        first = None
+        for line in generator.iter_ascii_rows(data, width=args.width, color_mode=color_mode):
+            if first is None:
+                first = time.perf_counter()
+        return first
+
+    for color_mode in ('gray', 'color'):
+        results = {}
+        for label, func in (('whole string', whole), ('row stream', streamed)):
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                first = func(color_mode)
+                samples.append(((first - start) * 1000, (time.perf_counter() - start) * 1000))
+            # 峰值内存单独测一次（tracemalloc 会拖慢计时）
+            tracemalloc.start()
+            func(color_mode)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[label] = (min(s[0] for s in samples), min(s[1] for s in samples), peak / 1024 / 1024)
+        for label, (first, total, peak) in results.items():
+            print(f"  {color_mode:<5} {label:<13} first row {first:8.1f} ms   total {total:8.1f} ms   "
+                  f"{peak:8.1f} MB peak")
+
+
+def bench_grid(args):
+    """CLI 同时输出文本和PNG：各自解码 vs 一次解码得到两个字符网格；网格与小图的传输体积"""
+    import pickle
+
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    font = generator._get_font(args.font_size)
+    ratio = generator.image_cell_ratio(font)
+    print(f"width {args.width}, font {args.font_size}, repeat={args.repeat}")
+
+    for color_mode in ('gray', 'color'):
+        def separate():
+            text = generator.image_to_ascii(args.image, width=args.width, color_mode=color_mode)
+            return text, generator.render_image(args.image, width=args.width, color_mode=color_mode,
+                                                font_size=args.font_size)
+
+        def shared():
+            text_grid, image_grid = generator.make_grids(args.image, args.width, [(None, 0.55), (None, ratio)],
+                                                         color=color_mode == 'color')
+            text = '\n'.join(generator.export_rows(text_grid, color_mode))
+            return text, generator.render_grid(image_grid, font, color_mode)
+
+        a, b = separate(), shared()
+        assert a[0] == b[0] and a[1].tobytes() == b[1].tobytes()
+        _report(f'{color_mode} text+png', _timeit(separate, args.repeat), _timeit(shared, args.repeat))
+
+    # 交给渲染进程的数据：灰度/彩色网格 vs 渲染好的画布
+    gray = generator.make_grid(args.image, args.width, cell_ratio=ratio)
+    color = generator.make_grid(args.image, args.width, cell_ratio=ratio, color=True)
+    canvas = generator.render_grid(color, font, 'color')
+    print(f"  pickled: gray grid {len(pickle.dumps(gray)):,} bytes, color grid {len(pickle.dumps(color)):,} bytes, "
+          f"rendered canvas {len(pickle.dumps(canvas)):,} bytes")
+
+
+def bench_markup(args):
+    """scan_*.png 示例图片：PNG 与 HTML/SVG 输出的体积（原始与gzip）和生成耗时"""
+    import gzip
+
+    from main import encode_png
+
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    samples = sorted(SAMPLE_IMAGE.parent.glob('scan_*.png'))
+    print(f"width {args.width}, font {args.font_size}, repeat={args.repeat}")
+    for sample in samples:
+        data = sample.read_bytes()
+        for color_mode in ('gray', 'color'):
+            print(f"{sample.name} {color_mode}")
+            outputs = {
+                'png': lambda: encode_png(generator.render_image(data, width=args.width, color_mode=color_mode,
+                                                                 font_size=args.font_size)),
+                'html': lambda: generator.render_markup(data, 'html', width=args.width, color_mode=color_mode,
+                                                        font_size=args.font_size).encode('utf-8'),
+                'svg': lambda: generator.render_markup(data, 'svg', width=args.width, color_mode=color_mode,
+                                                       font_size=args.font_size).encode('utf-8'),
+            }
+            png_size = None
+            for name, func in outputs.items():
+                payload = func()
+                packed = len(gzip.compress(payload))
+                png_size = png_size or len(payload)
+                _, elapsed = _timeit(func, args.repeat)
+                print(f"  {name:<5} {len(payload):>9,} bytes   gzip {packed:>8,} bytes   "
+                      f"{len(payload) / png_size:6.1%} of png   {elapsed:8.2f} ms")
+
+
+def bench_encode(args):
+    """调色板模式 × 压缩级别 × PNG/WebP：编码后体积、耗时和与RGB画布的最大误差"""
+    import io as _io
+
+    import numpy as np
+    from PIL import Image
+
+    from encoder import ImageEncoder
+
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    print(f"{Path(args.image).name}, width {args.width}, font {args.font_size}, repeat={args.repeat}")
+    for color_mode in ('gray', 'color'):
+        canvas = generator.render_image(args.image, width=args.width, color_mode=color_mode,
+                                        font_size=args.font_size)
+        reference = np.asarray(canvas).astype(int)
+        print(f"{color_mode} ({canvas.width}×{canvas.height}, {len(canvas.getcolors(1 << 24))} colors)")
+        for fmt in ('png', 'webp'):
+            for palette in ('never', 'auto', 'always'):
+                for level in (1, 6, 9):
+                    encoder = ImageEncoder(palette, level)
+                    encoded = encoder.encode(canvas, fmt)
+                    _, elapsed = _timeit(lambda: encoder.encode(canvas, fmt), args.repeat)
+                    decoded = np.asarray(Image.open(_io.BytesIO(encoded.data)).convert('RGB')).astype(int)
+                    error = int(np.abs(decoded - reference).max())
+                    print(f"  {fmt:<4} {palette:<6} level {level}  {len(encoded.data):>9,} bytes  "
+                          f"{elapsed:8.2f} ms  max error {error}")
+
+
+def bench_timing(args):
+    """阶段计时的开销：计时关闭与开启时渲染PNG的耗时，以及每个阶段的耗时"""
+    from metrics import format_timings, timing
+
+    data = Path(args.image).read_bytes()
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    render = lambda: generator.render_png(data, width=args.width, font_size=args.font_size)
+    render()
+
+    def timed_render():
+        with timing(enabled=True):
+            render()
+
+    off = _timeit(render, args.repeat)
+    on = _timeit(timed_render, args.repeat)
+    print(f"{Path(args.image).name}, width {args.width}, repeat={args.repeat}")
+    print(f"  timing off {off[1]:8.2f} ms   timing on {on[1]:8.2f} ms   overhead {on[1] - off[1]:+.2f} ms")
+    with timing(enabled=True) as timer:
+        render()
+    print(f"  {format_timings(timer.as_dict())}")
+
+
+def _server_startup(env):
+    """启动一次stdio MCP服务器，返回 (导入耗时ms, 到响应 initialize 的耗时ms, 空闲RSS MB, 已加载的重型模块)"""
+    import json
+    import subprocess
+    import sys
+
+    server = Path(__file__).resolve().parent / 'ascii_art_server.py'
+    request = {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize', 'params': {
+        'protocolVersion': '2025-06-18', 'capabilities': {}, 'clientInfo': {'name': 'benchmark', 'version': '0'}}}
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, str(server)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, env=env, cwd=server.parent)
+    try:
+        process.stdin.write((json.dumps(request) + '\n').encode())
+        process.stdin.flush()
+        process.stdout.readline()
+        ready = (time.perf_counter() - start) * 1000
+        notification = {'jsonrpc': '2.0', 'method': 'notifications/initialized'}
+        process.stdin.write((json.dumps(notification) + '\n').encode())
+        process.stdin.flush()
+        # 等后台预热（如果开启）结束后再读空闲内存
+        time.sleep(1.0)
+        with open(f'/proc/{process.pid}/status') as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:')) / 1024
+    finally:
+        process.stdin.close()
+        process.wait(timeout=10)
+
+    probe = ('import sys, time; start = time.perf_counter(); import ascii_art_server; '
+             'print((time.perf_counter() - start) * 1000, '
+             '" ".join(m for m in ("numpy", "PIL.Image", "PIL.ImageDraw", "main") if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, env=env,
+                            cwd=server.parent).stdout.split(maxsplit=1)
+    return float(output[0]), ready, rss, output[1].strip() if len(output) > 1 else ''
+
+
+def bench_startup(args):
+    """stdio MCP服务器冷启动：导入耗时、到响应 initialize 的耗时和空闲RSS（中位数），以及启动时加载了哪些重型模块"""
+    import os
+
+    env = {**os.environ, 'ASCII_ART_WORKERS': os.environ.get('ASCII_ART_WORKERS', '1')}
+    print(f"repeat={args.repeat}")
+    for label, extra in (('default', {}), ('prewarm', {'ASCII_ART_PREWARM': '1'})):
+        runs = [_server_startup({**env, **extra}) for _ in range(args.repeat)]
+        imported = statistics.median(run[0] for run in runs)
+        ready = statistics.median(run[1] for run in runs)
+        rss = statistics.median(run[2] for run in runs)
+        print(f"  {label:<8} import {imported:7.0f} ms   ready {ready:7.0f} ms   idle RSS {rss:6.1f} MB   "
+              f"heavy modules at import: {runs[-1][3] or 'none'}")
+
+
+def _legacy_font(size):
+    """优化前的字体获取：每次按名称探测系统字体，找不到时回退到附带字体"""
+    for name in SYSTEM_FONTS.get(platform.system(), SYSTEM_FONTS['Linux']):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.truetype(str(BUNDLED_FONT), size)
+
+
+def bench_fonts(args):
+    """每次渲染的字体开销：查找并加载字体、测量单元格，以及对整次小图渲染的影响"""
+    registry = FontRegistry()
+    print(f"font {registry.resolve()}, font_size={args.font_size}, repeat={args.repeat}")
+
+    def legacy_lookup():
+        font = _legacy_font(args.font_size)
+        bbox = font.getbbox('M')
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+    _report('font + cell size', _timeit(legacy_lookup, args.repeat),
+            _timeit(lambda: cell_size(registry.font(args.font_size)), args.repeat))
+
+    generator = ASCIIArtGenerator(char_set=args.charset)
+    source = Image.open(args.image)
+    source.load()
+    ratio = generator.image_cell_ratio(registry.font(args.font_size))
+    grid = generator.make_grid(source, args.width, None, ratio)
+
+    def legacy_render():
+        font = _legacy_font(args.font_size)
+        font.getbbox('M')
+        generator.render_grid(grid, font)
+
+    _report(f'render {args.width} cols', _timeit(legacy_render, args.repeat),
+            _timeit(lambda: generator.render_grid(grid, registry.font(args.font_size)), args.repeat))
+
+
+BENCHMARKS = {
+    'mapping': bench_mapping,
+    'ansi': bench_ansi,
+    'render': bench_render,
+    'tone': bench_tone,
+    'retune': bench_retune,
+    'loader': bench_loader,
+    'workers': bench_workers,
+    'upload': bench_upload,
+    'batch': bench_batch,
+    'bands': bench_bands,
+    'animation': bench_animation,
+    'stream': bench_stream,
+    'grid': bench_grid,
+    'markup': bench_markup,
+    'encode': bench_encode,
+    'timing': bench_timing,
+    'startup': bench_startup,
+    'coalesce': bench_coalesce,
+    'fonts': bench_fonts,
+}
+
+
+def main():
+    """主函数 - 命令行界面"""
+    parser = argparse.ArgumentParser(description='ASCII艺术生成器性能基准测试')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS), help='要运行的基准测试')
+    parser.add_argument('-i', '--image', default=str(SAMPLE_IMAGE), help='输入图片（默认 scan_test.jpg）')
+    parser.add_argument('-w', '--width', type=int, default=300, help='字符宽度（默认300）')
+    parser.add_argument('-c', '--charset', default='detailed', help='字符集（默认detailed）')
+    parser.add_argument('-f', '--font-size', type=int, default=10, help='字体大小（默认10）')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='重复次数（默认10）')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
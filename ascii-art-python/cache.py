@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Caches
+ASCII艺术生成结果的缓存
+
+ResultCache maps a content-addressed key (hash of the input bytes plus the
+normalized tool parameters) to the result of a previous render+upload, so a
+repeated request can return the already uploaded public URL. Entries live in
+an in-memory LRU and, optionally, in an on-disk tier of small JSON files
+with size and TTL eviction that survives server restarts.
+
+The async server uses ``aget``/``aput``, which move the on-disk tier's
+file reads and writes to a thread so a slow disk does not stall the event
+loop; the memory-only cache is consulted inline.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+def digest_bytes(data: bytes) -> str:
+    """Return the hex SHA-256 digest of some input bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(digest: str, params: dict) -> str:
+    """Combine an input digest and normalized parameters into one cache key."""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(f"{digest}:{canonical}".encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU of tool results with an optional on-disk tier.
+
+    Values must be JSON-serializable dicts. All methods are thread-safe.
+
+    Args:
+        max_entries: Maximum number of entries kept in memory (0 disables caching)
+        ttl_seconds: Entries older than this are treated as missing (0 = never expire)
+        disk_dir: Directory for the on-disk tier, or None to keep results in memory only
+        disk_max_bytes: Total size of the on-disk tier before the oldest entries are evicted
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 0, disk_dir: str | None = None,
+                 disk_max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_evict()
+
+    @classmethod
+    def from_env(cls) -> 'ResultCache':
+        """Build a cache from ASCII_ART_CACHE_* environment variables."""
+        return cls(
+            max_entries=int(os.getenv('ASCII_ART_CACHE_SIZE', 256)),
+            ttl_seconds=float(os.getenv('ASCII_ART_CACHE_TTL', 7 * 24 * 3600)),
+            disk_dir=os.getenv('ASCII_ART_CACHE_DIR') or None,
+            disk_max_bytes=int(float(os.getenv('ASCII_ART_CACHE_DIR_MAX_MB', 64)) * 1024 * 1024),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - created > self.ttl_seconds
+
+    def get(self, key: str) -> dict | None:
+        """Return the cached value for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            entry = self._disk_get(key)
+            if entry is not None:
+                self._remember(key, *entry)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict) -> None:
+        """Store a value in memory and, when configured, on disk."""
+        if not self.enabled:
+            return
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, value)
+            self._disk_put(key, created, value)
+
+    async def aget(self, key: str) -> dict | None:
+        """``get`` for the event loop: disk lookups run in a thread."""
+        if self.disk_dir is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: dict) -> None:
+        """``put`` for the event loop: disk writes (and evictions) run in a thread."""
+        if self.disk_dir is None:
+            self.put(key, value)
+        else:
+            await asyncio.to_thread(self.put, key, value)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current sizes."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'disk_bytes': self._disk_bytes,
+            }
+
+    def _remember(self, key: str, created: float, value: dict) -> None:
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _disk_get(self, key: str) -> tuple[float, dict] | None:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            record = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if self._expired(record['created']):
+            path.unlink(missing_ok=True)
+            return None
+        # 更新修改时间，淘汰时按最近使用排序
+        os.utime(path)
+        return record['created'], record['value']
+
+    def _disk_put(self, key: str, created: float, value: dict) -> None:
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            # 覆盖已有条目时先减去旧文件的大小，估算总量不虚增
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'created': created, 'value': value}, ensure_ascii=False), encoding='utf-8')
+        tmp.replace(path)
+        self._disk_bytes += path.stat().st_size - replaced
+        # 只有估算总量超限时才扫描目录
+        if self._disk_bytes > self.disk_max_bytes:
+            self._disk_evict()
+
+    def _disk_evict(self) -> None:
+        """Drop expired entries, then the least recently used ones until under the size limit."""
+        files = []
+        total = 0
+        now = time.time()
+        for path in self.disk_dir.glob('*.json'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if self.ttl_seconds and now - stat.st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        files.sort()
+        # 淘汰到上限的 90%，避免每次写入都重新扫描
+        for _, size, path in files:
+            if total <= self.disk_max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._disk_bytes = total
+
+
+class GridCache:
+    """Memory-budgeted LRU of downsampled character grids.
+
+    Keys are ``(image_digest, width, height)``; the grid height already
+    reflects the font metrics (cell aspect ratio) it was computed for.
+    Values are the resized images before tone adjustment and charset
+    mapping, so re-tuning charset, invert, color mode, brightness or contrast
+    only repeats the cheap stages. Cached images are shared and must not be
+    modified in place.
+
+    Args:
+        max_bytes: Memory budget for the stored pixel data (0 disables caching)
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries: OrderedDict[tuple, object] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'GridCache':
+        """Build a cache from the ASCII_ART_GRID_CACHE_MB environment variable."""
+        return cls(max_bytes=int(float(os.getenv('ASCII_ART_GRID_CACHE_MB', 64)) * 1024 * 1024))
+
+    @staticmethod
+    def _size(grid) -> int:
+        return grid.width * grid.height * len(grid.getbands())
+
+    def get(self, key: tuple):
+        """Return the cached grid image for key, or None on a miss."""
+        with self._lock:
+            grid = self._entries.get(key)
+            if grid is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return grid
+
+    def put(self, key: tuple, grid) -> None:
+        """Store a grid, evicting least recently used grids beyond the budget."""
+        size = self._size(grid)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self._size(previous)
+            self._entries[key] = grid
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Return hit/miss/eviction counters and current memory use."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
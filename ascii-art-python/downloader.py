@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Image Downloader
+从URL下载输入图片
+
+One shared ``httpx.AsyncClient`` keeps connections alive between requests,
+bodies are streamed into memory and abandoned as soon as they exceed the
+size limit, and the image type is recognized from the first bytes of the
+body rather than from the ``Content-Type`` header.
+"""
+
+import os
+from urllib.parse import unquote, urlparse
+
+import httpx
+
+
+# 下载大小上限（MB），可通过环境变量 ASCII_ART_MAX_DOWNLOAD_MB 调整
+MAX_DOWNLOAD_BYTES = int(float(os.getenv('ASCII_ART_MAX_DOWNLOAD_MB', 50)) * 1024 * 1024)
+
+# 文件头特征 -> 图片类型（RIFF 需要额外检查 WEBP 标记）
+_MAGIC_BYTES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'\x00\x00\x01\x00', 'ico'),
+)
+
+# 识别类型所需的最少字节数
+SNIFF_BYTES = 16
+
+
+class DownloadError(Exception):
+    """Raised when a URL cannot be fetched or does not contain an image."""
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    """Return the image type recognized from the first bytes of a file, or None."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for magic, kind in _MAGIC_BYTES:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def url_basename(url: str) -> str:
+    """Return the file name of a URL without extension, or 'image'."""
+    url_path = unquote(urlparse(url).path)
+    url_filename = url_path.split('/')[-1] if url_path else ''
+    basename = url_filename.rsplit('.', 1)[0] if url_filename else ''
+    return basename or 'image'
+
+
+class ImageDownloader:
+    """Streaming image downloader over a shared, connection-pooling client.
+
+    The client is created on first use and bound to the running event loop.
+
+    Args:
+        max_bytes: Largest accepted body; larger downloads are aborted
+        timeout: Connect/read timeout in seconds
+        max_connections: Connection pool size across all hosts
+    """
+
+    def __init__(self, max_bytes: int = MAX_DOWNLOAD_BYTES, timeout: float = 30.0, max_connections: int = 20):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: httpx.AsyncClient | None = None
+
+    @classmethod
+    def from_env(cls) -> 'ImageDownloader':
+        """Build a downloader using ASCII_ART_MAX_DOWNLOAD_MB."""
+        return cls(max_bytes=MAX_DOWNLOAD_BYTES)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def fetch(self, url: str) -> tuple[bytearray, str]:
+        """Download an image into memory.
+
+        Args:
+            url: HTTP/HTTPS URL of the image
+
+        Returns:
+            Tuple of (image_bytes, basename); the bytes are the receive buffer
+            itself, not a copy, so a download at the size limit is held once
+
+        Raises:
+            DownloadError: If the request fails, the body is larger than
+                max_bytes or does not start with a known image signature
+        """
+        try:
+            async with self.client.stream('GET', url) as response:
+                response.raise_for_status()
+                declared = response.headers.get('content-length')
+                if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise DownloadError(self._too_large(int(declared)))
+
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) > self.max_bytes:
+                        # 超出上限立即断开，不再读取剩余内容
+                        raise DownloadError(self._too_large(len(body), streamed=True))
+                    if len(body) - len(chunk) < SNIFF_BYTES <= len(body):
+                        self._check_type(body, response)
+        except httpx.HTTPError as e:
+            raise DownloadError(f"Failed to download {url}: {e}") from e
+
+        if len(body) < SNIFF_BYTES:
+            self._check_type(body, response)
+        return body, url_basename(url)
+
+    def _too_large(self, size: int, streamed: bool = False) -> str:
+        limit_mb = self.max_bytes / 1024 / 1024
+        if streamed:
+            return f"Image download exceeds the {limit_mb:.0f} MB limit (aborted after {size / 1024 / 1024:.1f} MB)"
+        return f"Image is too large: {size / 1024 / 1024:.1f} MB (limit {limit_mb:.0f} MB)"
+
+    @staticmethod
+    def _check_type(head: bytes, response: httpx.Response) -> None:
+        if sniff_image_type(bytes(head[:SNIFF_BYTES])) is None:
+            content_type = response.headers.get('content-type', '')
+            raise DownloadError(f"URL does not point to a supported image. Content-Type: {content_type}")
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
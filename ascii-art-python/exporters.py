@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Exporters
+把字符网格编码为各种输出格式
+
+ANSI output is run-length coalesced: an escape sequence is only emitted
+when the (optionally quantized) color changes, spaces never trigger a color
+change because their foreground is invisible, and each line ends with a
+single reset.
+
+The exporters read an AsciiGrid (see grid.py) and yield their output line
+by line, a block of rows at a time.
+
+Animations are encoded as a stream of frame deltas: after a full first
+frame, each frame only repaints the runs of cells that changed, addressed
+with absolute cursor moves.
+
+HTML (a ``<pre>`` with ``<span>`` color runs) and SVG (one ``<text>`` per
+row with ``<tspan>`` color runs) use the same run coalescing. They are a
+fraction of the size of the rendered PNG and compress well with gzip.
+"""
+
+from html import escape
+
+import numpy as np
+
+from grid import AsciiGrid
+from options import MARKUP_FORMATS
+from renderer import DEFAULT_BG_COLOR, DEFAULT_TEXT_COLOR, color_ink_colors
+
+
+ANSI_PALETTES = ('truecolor', '256')
+
+ANSI_RESET = '\033[0m'
+
+# xterm 256 色中 6x6x6 色块每个通道的取值
+_XTERM_CUBE_LEVELS = np.array([0, 95, 135, 175, 215, 255], dtype=np.int32)
+
+
+def quantize_colors(rgb: np.ndarray, step: int = 1) -> np.ndarray:
+    """Snap every channel to the centre of a bucket of ``step`` values.
+
+    ``step=1`` keeps colors exact; larger steps merge nearby colors into
+    longer runs at the cost of color accuracy.
+    """
+    if step <= 1:
+        return rgb
+    rgb = rgb.astype(np.int32)
+    return np.minimum(255, rgb // step * step + step // 2).astype(np.uint8)
+
+
+def xterm256_indices(rgb: np.ndarray) -> np.ndarray:
+    """Map RGB colors to the nearest xterm-256 color (cube or gray ramp)."""
+    rgb = rgb.astype(np.int32)
+    cube = np.abs(rgb[..., None] - _XTERM_CUBE_LEVELS).argmin(axis=-1)
+    cube_rgb = _XTERM_CUBE_LEVELS[cube]
+    cube_index = 16 + cube[..., 0] * 36 + cube[..., 1] * 6 + cube[..., 2]
+
+    gray_level = np.clip((rgb.mean(axis=-1) - 8 + 5) // 10, 0, 23).astype(np.int32)
+    gray_value = 8 + gray_level * 10
+    cube_error = ((rgb - cube_rgb) ** 2).sum(axis=-1)
+    gray_error = ((rgb - gray_value[..., None]) ** 2).sum(axis=-1)
+    return np.where(gray_error < cube_error, 232 + gray_level, cube_index)
+
+
+# 逐行输出时每次处理的行数
+BLOCK_ROWS = 64
+
+
+def text_lines(grid: AsciiGrid, block_rows: int = BLOCK_ROWS):
+    """Yield the plain text lines of a grid."""
+    cols = grid.cols
+    for first in range(0, grid.rows, block_rows):
+        chunk = grid.row_chars(first, first + block_rows)
+        for start in range(0, len(chunk), cols):
+            yield chunk[start:start + cols]
+
+
+def ansi_lines(grid: AsciiGrid, palette: str = 'truecolor', color_step: int = 1, block_rows: int = BLOCK_ROWS):
+    """Yield the ANSI colored lines of a grid built with colors (see ``encode_ansi``)."""
+    if grid.rgb is None:
+        raise ValueError("ANSI color output needs a grid built with colors")
+    for first in range(0, grid.rows, block_rows):
+        last = first + block_rows
+        yield from iter_ansi_lines(grid.row_chars(first, last), grid.rgb[first:last], palette, color_step,
+                                   block_rows)
+
+
+def color_keys(rgb: np.ndarray, palette: str = 'truecolor', color_step: int = 1) -> np.ndarray:
+    """Return one integer per cell that identifies its escape sequence.
+
+    The key is the xterm-256 index for the '256' palette and the packed
+    (quantized) 24-bit color for 'truecolor'.
+    """
+    if palette not in ANSI_PALETTES:
+        raise ValueError(f"Unknown ANSI palette '{palette}', expected one of {', '.join(ANSI_PALETTES)}")
+    if palette == '256':
+        return xterm256_indices(rgb)
+    rgb = quantize_colors(rgb, color_step)
+    return (rgb[..., 0].astype(np.int32) << 16) | (rgb[..., 1].astype(np.int32) << 8) | rgb[..., 2]
+
+
+def _color_escape(key: int, palette: str) -> str:
+    if palette == '256':
+        return f'\033[38;5;{key}m'
+    return f'\033[38;2;{key >> 16};{(key >> 8) & 0xFF};{key & 0xFF}m'
+
+
+def encode_ansi(ascii_str: str, rgb: np.ndarray, palette: str = 'truecolor', color_step: int = 1) -> str:
+    """Encode a character grid with per-cell colors as ANSI text.
+
+    Args:
+        ascii_str: Characters of the grid, row-major, ``rows * cols`` long
+        rgb: ``(rows, cols, 3)`` uint8 array of cell colors
+        palette: 'truecolor' (24-bit escapes) or '256' (xterm-256 escapes)
+        color_step: Bucket size used to merge nearby truecolor values (1 = exact)
+
+    Returns:
+        ANSI colored text, one line per grid row
+    """
+    return '\n'.join(iter_ansi_lines(ascii_str, rgb, palette, color_step))
+
+
+def iter_ansi_lines(ascii_str: str, rgb: np.ndarray, palette: str = 'truecolor', color_step: int = 1,
+                    block_rows: int = 64):
+    """Yield the lines of ``encode_ansi`` one grid row at a time.
+
+    Rows are processed in blocks of ``block_rows`` so the color arrays stay
+    small and the first lines are available before the rest is encoded.
+    """
+    if palette not in ANSI_PALETTES:
+        raise ValueError(f"Unknown ANSI palette '{palette}', expected one of {', '.join(ANSI_PALETTES)}")
+    rows, cols = rgb.shape[:2]
+    if cols == 0:
+        yield from [''] * rows
+        return
+
+    escapes = {}
+    for first in range(0, rows, block_rows):
+        block_chars = ascii_str[first * cols:(first + block_rows) * cols]
+        keys = color_keys(rgb[first:first + block_rows], palette, color_step)
+        for row_chars, runs in _row_runs(block_chars, keys):
+            pieces = []
+            for start, end, key in runs:
+                escape = escapes.get(key)
+                if escape is None:
+                    escape = escapes[key] = _color_escape(key, palette)
+                pieces.append(escape)
+                pieces.append(row_chars[start:end])
+            pieces.append(ANSI_RESET)
+            yield ''.join(pieces)
+
+
+def _row_runs(block_chars: str, keys: np.ndarray):
+    """Split a block of rows into runs of cells sharing one color key.
+
+    Spaces are invisible, so they take the key of the character to their
+    left and never break a run.
+
+    Yields:
+        ``(row_chars, [(start, end, key), ...])`` for each row of the block
+    """
+    block, cols = keys.shape
+    # 空格不可见，沿用左侧字符的颜色，不打断颜色段
+    visible = np.frombuffer(block_chars.encode('utf-32-le'), dtype=np.uint32).reshape(block, cols) != ord(' ')
+    source_col = np.where(visible, np.arange(cols), 0)
+    np.maximum.accumulate(source_col, axis=1, out=source_col)
+    keys = np.take_along_axis(keys, source_col, axis=1)
+
+    starts = np.ones((block, cols), dtype=bool)
+    starts[:, 1:] = keys[:, 1:] != keys[:, :-1]
+
+    for row in range(block):
+        row_starts = np.flatnonzero(starts[row]).tolist()
+        row_keys = keys[row, row_starts].tolist()
+        yield block_chars[row * cols:(row + 1) * cols], list(zip(row_starts, row_starts[1:] + [cols], row_keys))
+
+
+def encode_ansi_delta(ascii_str: str, cols: int, rgb: np.ndarray | None = None, previous: tuple | None = None,
+                      palette: str = 'truecolor', color_step: int = 1, max_gap: int = 4) -> tuple[str, tuple]:
+    """Encode one animation frame as the ANSI text that updates the previous frame in place.
+
+    The first frame (``previous`` is None, or the grid size changed) clears
+    the screen and paints every cell. Later frames only repaint the cells
+    whose character or visible color changed. Changed cells of a row that
+    are at most ``max_gap`` cells apart are merged into one run, because a
+    cursor move costs more than repainting a few unchanged cells.
+
+    Args:
+        ascii_str: Characters of the grid, row-major
+        cols: Grid width in characters
+        rgb: ``(rows, cols, 3)`` uint8 cell colors, or None for uncolored text
+        previous: State returned for the previous frame
+        palette: 'truecolor' or '256'
+        color_step: Bucket size used to merge nearby truecolor values (1 = exact)
+        max_gap: Longest run of unchanged cells repainted to avoid a cursor move
+
+    Returns:
+        Tuple of (ansi_text, state); pass the state with the next frame
+    """
+    codes = np.frombuffer(ascii_str.encode('utf-32-le'), dtype=np.uint32).reshape(-1, cols)
+    keys = None if rgb is None else color_keys(rgb, palette, color_step)
+
+    if previous is None or previous[0].shape != codes.shape:
+        changed = np.ones(codes.shape, dtype=bool)
+        pieces = ['\033[2J']
+    else:
+        previous_codes, previous_keys = previous
+        changed = codes != previous_codes
+        if keys is not None:
+            # 空格的前景色不可见，颜色变化不需要重绘
+            changed |= (keys != previous_keys) & (codes != ord(' '))
+        pieces = []
+
+    escapes = {}
+    current = None
+    for row in np.flatnonzero(changed.any(axis=1)).tolist():
+        changed_cols = np.flatnonzero(changed[row])
+        breaks = np.flatnonzero(np.diff(changed_cols) > max_gap + 1)
+        starts = changed_cols[np.r_[0, breaks + 1]].tolist()
+        ends = (changed_cols[np.r_[breaks, len(changed_cols) - 1]] + 1).tolist()
+        line = ascii_str[row * cols:(row + 1) * cols]
+        for start, end in zip(starts, ends):
+            pieces.append(f'\033[{row + 1};{start + 1}H')
+            if keys is None:
+                pieces.append(line[start:end])
+                continue
+            # 终端的当前颜色在光标移动后保持不变，只在颜色变化时输出转义序列
+            for col, key in zip(range(start, end), keys[row, start:end].tolist()):
+                char = line[col]
+                if char != ' ' and key != current:
+                    escape = escapes.get(key)
+                    if escape is None:
+                        escape = escapes[key] = _color_escape(key, palette)
+                    pieces.append(escape)
+                    current = key
+                pieces.append(char)
+    if current is not None:
+        pieces.append(ANSI_RESET)
+    return ''.join(pieces), (codes, keys)
+
+
+# 网页等宽字体的字符宽度约为字号的0.6，行高取1倍字号，单元格宽高比即为0.6
+MARKUP_CELL_RATIO = 0.6
+
+# HTML/SVG 默认的颜色量化步长：精确颜色会把颜色段切得很碎，16 时体积约为精确颜色的 1/3，肉眼几乎看不出差别
+MARKUP_COLOR_STEP = 16
+
+
+def _hex_color(color) -> str:
+    return '#{:02x}{:02x}{:02x}'.format(*color)
+
+
+def _markup_palette(grid: AsciiGrid, color_mode: str, color_step: int):
+    """Number the distinct ink colors of a grid, most frequent first.
+
+    Color mode uses the same ink colors as the PNG renderer. HTML uses the
+    numbers as CSS class names, so the most common colors get the shortest
+    names.
+
+    Returns:
+        Tuple of (``(rows, cols)`` color indices or None in gray mode, list of hex colors by index)
+    """
+    if color_mode != 'color':
+        return None, []
+    if grid.rgb is None:
+        raise ValueError("Color markup output needs a grid built with colors")
+    ink = quantize_colors(color_ink_colors(grid.rgb), color_step)
+    keys = (ink[..., 0].astype(np.int32) << 16) | (ink[..., 1].astype(np.int32) << 8) | ink[..., 2]
+    colors, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    classes = rank[inverse.reshape(keys.shape)].astype(np.int32)
+    return classes, [f'#{key:06x}' for key in colors[order].tolist()]
+
+
+def _markup_rows(grid: AsciiGrid, classes: np.ndarray | None, block_rows: int, run_markup):
+    """Yield the escaped rows of a grid, wrapping color runs with ``run_markup(color_index, text)``.
+
+    Without classes (gray mode) the characters are emitted without any
+    per-run markup.
+    """
+    for first in range(0, grid.rows, block_rows):
+        last = first + block_rows
+        block_chars = grid.row_chars(first, last)
+        if classes is None:
+            for start in range(0, len(block_chars), grid.cols):
+                yield escape(block_chars[start:start + grid.cols], quote=False)
+            continue
+        for row_chars, runs in _row_runs(block_chars, classes[first:last]):
+            yield ''.join(run_markup(key, escape(row_chars[start:end], quote=False)) for start, end, key in runs)
+
+
+def html_lines(grid: AsciiGrid, color_mode: str = 'gray', font_size: int = 10, bg_color=None, text_color=None,
+               color_step: int = MARKUP_COLOR_STEP, block_rows: int = BLOCK_ROWS):
+    """Yield the lines of a standalone HTML page showing a grid in a ``<pre>``.
+
+    Color runs are ``<i>`` elements (styled upright) with a class from the
+    palette in the page's ``<style>``.
+
+    Args:
+        grid: Grid to export (built with colors for color mode)
+        color_mode: 'gray' for one text color, 'color' for coalesced color runs
+        font_size: CSS font size and line height in pixels
+        bg_color: Page background, defaults to the PNG renderer's dark theme
+        text_color: Text color of gray mode
+        color_step: Bucket size used to merge nearby colors into longer runs (1 = exact)
+    """
+    classes, palette = _markup_palette(grid, color_mode, color_step)
+    bg = _hex_color(bg_color or DEFAULT_BG_COLOR)
+    fg = _hex_color(text_color or DEFAULT_TEXT_COLOR)
+    yield '<!DOCTYPE html>'
+    yield '<html><head><meta charset="utf-8"><title>ASCII art</title><style>'
+    yield (f'body{{margin:0;background:{bg}}}'
+           f'pre{{margin:0;font:{font_size}px/{font_size}px monospace;color:{fg}}}i{{font-style:normal}}')
+    for index, color in enumerate(palette):
+        yield f'.c{index}{{color:{color}}}'
+    # 紧跟 <pre> 的换行会被浏览器忽略
+    yield '</style></head><body><pre>'
+    yield from _markup_rows(grid, classes, block_rows, lambda key, text: f'<i class=c{key}>{text}</i>')
+    yield '</pre></body></html>'
+
+
+def svg_lines(grid: AsciiGrid, color_mode: str = 'gray', font_size: int = 10, bg_color=None, text_color=None,
+              color_step: int = MARKUP_COLOR_STEP, block_rows: int = BLOCK_ROWS):
+    """Yield the lines of an SVG image showing a grid, one ``<text>`` element per row.
+
+    Every row is stretched to exactly ``cols`` cells with ``textLength``, so
+    columns line up whatever monospace font the viewer picks. Color runs are
+    ``<tspan>`` elements with an inline fill (classes do not make SVG
+    smaller). Arguments are the same as for ``html_lines``.
+    """
+    classes, palette = _markup_palette(grid, color_mode, color_step)
+    bg = _hex_color(bg_color or DEFAULT_BG_COLOR)
+    fg = _hex_color(text_color or DEFAULT_TEXT_COLOR)
+    row_width = f'{grid.cols * font_size * MARKUP_CELL_RATIO:g}'
+    height = grid.rows * font_size
+    yield (f'<svg xmlns="http://www.w3.org/2000/svg" width="{row_width}" height="{height}" '
+           f'viewBox="0 0 {row_width} {height}" xml:space="preserve">')
+    yield f'<rect width="100%" height="100%" fill="{bg}"/>'
+    yield f'<g font-family="monospace" font-size="{font_size}" fill="{fg}">'
+    rows = _markup_rows(grid, classes, block_rows, lambda key, text: f'<tspan fill="{palette[key]}">{text}</tspan>')
+    for row, text in enumerate(rows):
+        # 基线位于行高的80%处
+        yield (f'<text y="{(row + 0.8) * font_size:g}" textLength="{row_width}" '
+               f'lengthAdjust="spacingAndGlyphs">{text}</text>')
+    yield '</g></svg>'
+
+
+def markup_lines(grid: AsciiGrid, fmt: str, **options):
+    """Yield the lines of ``html_lines`` or ``svg_lines`` for a format name."""
+    if fmt == 'html':
+        return html_lines(grid, **options)
+    if fmt == 'svg':
+        return svg_lines(grid, **options)
+    raise ValueError(f"Unsupported markup format '{fmt}', expected one of {', '.join(MARKUP_FORMATS)}")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Fonts
+进程级的等宽字体注册表：字体只查找一次，按字号缓存字体对象和字形度量
+
+Rendering needs a monospace font at a few sizes and the size of its
+character cell. Looking the font up means probing ``ImageFont.truetype``
+with several names, and for names that are not a path Pillow walks the
+system font directories on every miss. A FontRegistry does that search
+once, remembers the file it found, keeps one FreeTypeFont per size and
+caches glyph bounding boxes and advances per (font, size), so repeated
+renders only pay for a dictionary lookup.
+
+The font is resolved in this order:
+
+1. the configured path (``font_registry(path)``, ``--font`` or ``ASCII_ART_FONT``)
+2. well-known monospace system fonts for the platform
+3. Source Code Pro, shipped as package data of ``ascii_art_assets`` so
+   rendering works offline, from a checkout or an installed copy,
+   and on machines without a monospace font
+4. Pillow's built-in default font (not monospace), with a single warning
+"""
+
+import os
+import platform
+import sys
+import threading
+from importlib import resources
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import ImageFont
+
+
+# 指定字体文件路径的环境变量（优先于系统字体）
+FONT_ENV = 'ASCII_ART_FONT'
+# 随包附带的等宽字体（SIL Open Font License 1.1，见 ascii_art_assets/fonts/OFL.txt）；
+# 作为包数据安装，从源码目录运行和安装后都能找到
+BUNDLED_FONT = Path(str(resources.files('ascii_art_assets').joinpath('fonts').joinpath('SourceCodePro-Regular.ttf')))
+
+# 各平台常见的等宽系统字体，按优先级排列
+SYSTEM_FONTS = {
+    'Windows': ('consola.ttf', 'lucon.ttf', 'cour.ttf'),
+    'Darwin': ('Menlo.ttc', 'Monaco.ttf', 'Courier New.ttf'),
+    'Linux': ('DejaVuSansMono.ttf', 'LiberationMono-Regular.ttf', 'FreeMono.ttf'),
+}
+
+# 查找字体时探测用的字号（只用于确认字体可以加载）
+_PROBE_SIZE = 10
+
+
+class GlyphMetrics(NamedTuple):
+    """Bounding box ``(left, top, right, bottom)`` and horizontal advance of one glyph."""
+
+    bbox: tuple[int, int, int, int]
+    advance: float
+
+
+def font_key(font) -> tuple:
+    """Identify a font by face and size so equal fonts share cached metrics and atlases."""
+    try:
+        return font.getname(), font.size, getattr(font, 'index', 0)
+    except AttributeError:
+        # 位图字体没有名称和字号信息，只能按对象区分
+        return ('bitmap', id(font))
+
+
+_metrics: dict[tuple, GlyphMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def glyph_metrics(font, glyph: str) -> GlyphMetrics:
+    """Return (and cache per font and size) the bounding box and advance of ``glyph``."""
+    key = (font_key(font), glyph)
+    metrics = _metrics.get(key)
+    if metrics is None:
+        metrics = GlyphMetrics(tuple(font.getbbox(glyph)), font.getlength(glyph))
+        with _metrics_lock:
+            _metrics[key] = metrics
+    return metrics
+
+
+def cell_size(font) -> tuple[int, int]:
+    """Return the (width, height) of one character cell, measured on 'M'."""
+    left, top, right, bottom = glyph_metrics(font, 'M').bbox
+    return right - left, bottom - top
+
+
+class FontRegistry:
+    """Resolves the monospace font once and keeps one font object per size (thread-safe).
+
+    Args:
+        path: Font file to use instead of the system fonts. A path that cannot
+            be loaded raises ValueError rather than silently falling back.
+        candidates: System font names to try, default ``SYSTEM_FONTS`` for
+            the current platform
+        bundled: Fallback font file, default ``BUNDLED_FONT``
+    """
+
+    def __init__(self, path: str | os.PathLike | None = None, candidates: tuple[str, ...] | None = None,
+                 bundled: str | os.PathLike | None = BUNDLED_FONT):
+        self.path = os.fspath(path) if path else None
+        self.candidates = SYSTEM_FONTS.get(platform.system(), SYSTEM_FONTS['Linux']) \
+            if candidates is None else tuple(candidates)
+        self.bundled = os.fspath(bundled) if bundled else None
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._source: str | None = None
+        self._fonts: dict[int, ImageFont.FreeTypeFont | ImageFont.ImageFont] = {}
+
+    def resolve(self) -> str | None:
+        """Find the font file on first use and return it (None: Pillow's default font).
+
+        Raises:
+            ValueError: The configured path cannot be loaded
+        """
+        if not self._resolved:
+            with self._lock:
+                if not self._resolved:
+                    self._source = self._find()
+                    self._resolved = True
+        return self._source
+
+    def _find(self) -> str | None:
+        if self.path:
+            try:
+                ImageFont.truetype(self.path, _PROBE_SIZE)
+            except OSError as e:
+                raise ValueError(f"无法加载字体 '{self.path}': {e}") from e
+            return self.path
+        for name in self.candidates:
+            try:
+                # 不是路径的名称由 Pillow 在系统字体目录中查找，.path 是找到的完整路径
+                return ImageFont.truetype(name, _PROBE_SIZE).path
+            except OSError:
+                continue
+        if self.bundled:
+            try:
+                ImageFont.truetype(self.bundled, _PROBE_SIZE)
+                return self.bundled
+            except OSError:
+                pass
+        # 如果都失败了，使用默认字体（可能不是等宽的，效果会差）；每个注册表只警告一次
+        print("警告: 未找到等宽字体，使用默认字体，效果可能不佳。", file=sys.stderr)
+        return None
+
+    def font(self, size: int = 12):
+        """Return the font at ``size`` pixels, loading it on first use."""
+        font = self._fonts.get(size)
+        if font is None:
+            source = self.resolve()
+            font = ImageFont.truetype(source, size) if source else ImageFont.load_default()
+            with self._lock:
+                font = self._fonts.setdefault(size, font)
+        return font
+
+    def preload(self, sizes=(10,), chars: str = 'M') -> None:
+        """Load the fonts at ``sizes`` and measure ``chars`` ahead of the first render."""
+        for size in sizes:
+            font = self.font(size)
+            for glyph in chars:
+                glyph_metrics(font, glyph)
+
+    def identity(self) -> dict:
+        """The resolved font file and face (family, style, index), e.g. for cache keys.
+
+        Pillow's default font is reported as ``{'file': None, 'face': 'default'}``.
+        """
+        source = self.resolve()
+        if source is None:
+            return {'file': None, 'face': 'default'}
+        name, _, index = font_key(self.font(_PROBE_SIZE))
+        return {'file': source, 'face': [*name, index]}
+
+    def stats(self) -> dict:
+        """The resolved font file and the sizes loaded so far."""
+        return {'font': self._source, 'resolved': self._resolved, 'sizes': sorted(self._fonts)}
+
+
+_registries: dict[str | None, FontRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def font_registry(path: str | os.PathLike | None = None) -> FontRegistry:
+    """Return this process's registry for ``path`` (default: ``ASCII_ART_FONT`` or the system fonts)."""
+    if not path:
+        path = os.getenv(FONT_ENV) or None
+    key = os.fspath(path) if path else None
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(key, FontRegistry(key))
+    return registry
+
+
+def get_font(size: int = 12, path: str | os.PathLike | None = None):
+    """Shortcut for ``font_registry(path).font(size)``."""
+    return font_registry(path).font(size)
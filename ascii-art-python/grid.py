@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Grid
+字符网格：各种输出格式共用的中间表示
+
+An AsciiGrid holds everything the exporters need about a converted image,
+computed once from the downsampled picture:
+
+- ``glyphs``: the charset index of every cell (uint8)
+- ``luma``: the luminance of every cell (uint8); gray-mode rendering shades
+  the text with it, which is finer than the glyph index
+- ``rgb``: the color of every cell as a packed ``(rows, cols, 3)`` uint8
+  array, only for color output
+
+Text, ANSI and PNG output all read the same grid, so one decode serves every
+output. A grid costs 2 bytes per cell (5 with colors), which makes it cheap
+to keep in a cache or to pickle to a worker process.
+"""
+
+import functools
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=64)
+def char_lut(chars):
+    """
+    为字符集编译灰度 -> 字符索引的查找表（按字符集字符串缓存，内置字符集只编译一次）
+
+    Args:
+        chars: 字符集字符串（从暗到亮）
+
+    Returns:
+        长度256的列表，可直接用于 Image.point
+    """
+    char_count = len(chars)
+    return [min(value * char_count // 256, char_count - 1) for value in range(256)]
+
+
+@functools.lru_cache(maxsize=64)
+def _grid_charset(chars):
+    """
+    网格使用的字符集和灰度 -> 字形索引表
+    超过256个字符的自定义字符集只保留查找表实际用到的字符，使索引能放进 uint8
+    """
+    index_lut = char_lut(chars)
+    if len(chars) <= 256:
+        return chars, index_lut
+    used = sorted(set(index_lut))
+    position = {old: new for new, old in enumerate(used)}
+    return ''.join(chars[i] for i in used), [position[i] for i in index_lut]
+
+
+@dataclass(frozen=True, eq=False)
+class AsciiGrid:
+    """Cell data of one converted image.
+
+    Attributes:
+        chars: Charset the glyph indices refer to, dark to bright
+        glyphs: ``(rows, cols)`` uint8 indices into ``chars``
+        luma: ``(rows, cols)`` uint8 cell luminance
+        rgb: ``(rows, cols, 3)`` uint8 cell colors, or None without colors
+    """
+
+    chars: str
+    glyphs: np.ndarray
+    luma: np.ndarray
+    rgb: np.ndarray | None = None
+
+    @classmethod
+    def from_image(cls, img, chars: str, color: bool = False) -> 'AsciiGrid':
+        """Build a grid from an image with one pixel per character cell."""
+        gray = img.convert('L')
+        grid_chars, index_lut = _grid_charset(chars)
+        rgb = np.asarray(img.convert('RGB')) if color else None
+        return cls(grid_chars, np.asarray(gray.point(index_lut)), np.asarray(gray), rgb)
+
+    @property
+    def rows(self) -> int:
+        return self.glyphs.shape[0]
+
+    @property
+    def cols(self) -> int:
+        return self.glyphs.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the cell arrays."""
+        return self.glyphs.nbytes + self.luma.nbytes + (self.rgb.nbytes if self.rgb is not None else 0)
+
+    def row_chars(self, first: int = 0, last: int | None = None) -> str:
+        """Return the characters of rows ``first:last`` concatenated, row-major."""
+        data = self.glyphs[first:last].tobytes()
+        byte_table, char_table = _glyph_tables(self.chars)
+        if byte_table is not None:
+            return data.translate(byte_table).decode('latin-1')
+        return data.decode('latin-1').translate(char_table)
+
+
+@functools.lru_cache(maxsize=64)
+def _glyph_tables(chars):
+    """字形索引 -> 字符的翻译表：(bytes.translate 表或None, str.translate 表)"""
+    char_table = chars + chars[-1] * (256 - len(chars))
+    try:
+        return char_table.encode('latin-1'), char_table
+    except UnicodeEncodeError:
+        return None, char_table
@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Load Test
+用多个并发客户端压测MCP服务器，输出可以在版本之间比较的JSON结果
+
+Starts the server as a long-lived streamable HTTP service (one listener,
+``--workers`` render processes) and drives ``generate_ascii_image`` from N
+concurrent simulated clients, each with its own MCP session. Requests are
+a seeded mix of absolute local paths and URLs of the same fixture images,
+served by an in-process HTTP image host. Uploads go to the in-process
+FakeStorageServer standing in for Supabase, so nothing leaves the machine
+and the numbers do not depend on the network.
+
+The result is one JSON document: throughput, p50/p95/p99 latency (overall
+and per input source), error rate with the distinct error messages, peak
+RSS of the server and of its whole process tree (server plus workers),
+and the server's own stats resource. Keys are stable and sorted, so two
+runs can be diffed directly or with ``--baseline``.
+
+Usage:
+  python loadtest.py -c 16 -n 200 -o results.json
+  python loadtest.py -c 16 -n 200 --baseline results.json   # 与上次结果比较
+  python loadtest.py --url-ratio 1 --image-latency 0.05     # 全部为URL，模拟较慢的图片主机
+  python loadtest.py --env ASCII_ART_CACHE_SIZE=256         # 覆盖服务器环境变量
+
+The result cache is off by default (``ASCII_ART_CACHE_SIZE=0``) so every
+request converts; identical concurrent requests are still coalesced.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+from mcp import ClientSession
+from mcp.client.streamable_http import streamable_http_client
+
+from storage import FakeStorageServer
+
+
+SERVER = Path(__file__).resolve().parent / 'ascii_art_server.py'
+
+# 夹具图片：名称 -> (宽, 高, 格式)，覆盖小图、常见照片和需要按目标尺寸解码的大图
+FIXTURE_IMAGES = {
+    'small.png': (320, 240, 'PNG'),
+    'photo.jpg': (1600, 1200, 'JPEG'),
+    'large.jpg': (4000, 3000, 'JPEG'),
+}
+
+# 结果中比较的指标：(路径, 标签, 数值越大越好)
+COMPARED_METRICS = (
+    (('throughput_rps',), 'throughput (req/s)', True),
+    (('latency_ms', 'p50'), 'p50 latency (ms)', False),
+    (('latency_ms', 'p95'), 'p95 latency (ms)', False),
+    (('latency_ms', 'p99'), 'p99 latency (ms)', False),
+    (('error_rate',), 'error rate', False),
+    (('peak_rss_mb', 'total'), 'peak RSS, all processes (MB)', False),
+)
+
+
+def make_fixtures(directory: Path) -> list[Path]:
+    """Write the fixture images into ``directory`` and return their paths."""
+    from PIL import Image
+
+    paths = []
+    for name, (width, height, image_format) in FIXTURE_IMAGES.items():
+        path = directory / name
+        # 渐变加彩色通道，结果不是单色，映射和调色板检测都要做真实的工作
+        gray = Image.linear_gradient('L').resize((width, height))
+        Image.merge('RGB', (gray, gray.transpose(Image.Transpose.ROTATE_180), gray.rotate(90))).save(
+            path, image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+        paths.append(path)
+    return paths
+
+
+class _ImageHostHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.server.root / self.path.lstrip('/')
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if '/' in self.path.lstrip('/') or not path.is_file():
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = path.read_bytes()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageHost:
+    """In-process HTTP server serving the files of one directory, for load tests.
+
+    Use as a context manager; ``url`` is the base URL to append file names to.
+
+    Args:
+        root: Directory whose files are served
+        latency: Seconds added to every response, to simulate a remote host
+    """
+
+    def __init__(self, root: Path, latency: float = 0.0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _ImageHostHandler)
+        self._server.daemon_threads = True
+        self._server.root = Path(root)
+        self._server.latency = latency
+        self._server.requests = 0
+        self._server.lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def requests(self) -> int:
+        """Number of GET requests received."""
+        return self._server.requests
+
+    def __enter__(self) -> 'ImageHost':
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def build_workload(images: list[Path], image_url: str, count: int, url_ratio: float = 0.5,
+                   widths: tuple[int, ...] = (80, 120), formats: tuple[str, ...] = ('png',),
+                   seed: int = 0) -> list[dict]:
+    """Draw ``count`` tool calls from a seeded mix of inputs, widths and formats.
+
+    Args:
+        images: Local fixture images (absolute paths)
+        image_url: Base URL serving the same files
+        count: Number of requests
+        url_ratio: Share of requests naming the image by URL instead of by path
+        widths: Widths to draw from
+        formats: Output formats to draw from
+        seed: Seed of the random generator, equal seeds give equal workloads
+
+    Returns:
+        List of generate_ascii_image arguments, plus a 'source' entry ('path' or 'url')
+    """
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(count):
+        image = rng.choice(images)
+        by_url = rng.random() < url_ratio
+        workload.append({
+            'source': 'url' if by_url else 'path',
+            'image_path': f'{image_url}/{image.name}' if by_url else str(image),
+            'width': rng.choice(widths),
+            'output_format': rng.choice(formats),
+        })
+    return workload
+
+
+def percentile(samples: list[float], q: float) -> float | None:
+    """Percentile ``q`` (0-100) with linear interpolation between ranks; None without samples."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    """p50/p95/p99, mean and max of latencies in seconds, in milliseconds."""
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        'count': len(latencies),
+        'p50': ms(percentile(latencies, 50)),
+        'p95': ms(percentile(latencies, 95)),
+        'p99': ms(percentile(latencies, 99)),
+        'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'max': ms(max(latencies, default=None)),
+    }
+
+
+def summarize(outcomes: list[dict], elapsed: float) -> dict:
+    """Aggregate per-request outcomes into throughput, latency and error figures.
+
+    Args:
+        outcomes: One dict per request with 'source', 'latency' (seconds) and 'error' (None on success)
+        elapsed: Wall-clock seconds of the measured phase
+
+    Returns:
+        Dict with requests, errors, error_rate, errors_by_message, duration_s,
+        throughput_rps, latency_ms and latency_by_source_ms
+    """
+    errors = Counter(outcome['error'] for outcome in outcomes if outcome['error'] is not None)
+    succeeded = sum(1 for outcome in outcomes if outcome['error'] is None)
+    sources = sorted({outcome['source'] for outcome in outcomes})
+    return {
+        'requests': len(outcomes),
+        'errors': sum(errors.values()),
+        'error_rate': round(sum(errors.values()) / len(outcomes), 4) if outcomes else 0.0,
+        'errors_by_message': dict(errors.most_common()),
+        'duration_s': round(elapsed, 3),
+        # 只计成功的请求：失败得很快的请求不应该抬高吞吐
+        'throughput_rps': round(succeeded / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': latency_summary([outcome['latency'] for outcome in outcomes]),
+        'latency_by_source_ms': {
+            source: latency_summary([outcome['latency'] for outcome in outcomes if outcome['source'] == source])
+            for source in sources
+        },
+    }
+
+
+def _process_tree(pid: int) -> list[int]:
+    """``pid`` and all its descendants, found through /proc (Linux only)."""
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # 第二个字段是带括号的进程名，可能含空格，从最后一个右括号之后解析
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, ()))
+    return tree
+
+
+def _rss_mb(pid: int, field: str = 'VmRSS') -> float:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler:
+    """Sample the resident memory of a process tree in a background thread.
+
+    ``peak_total`` is the largest sum over the server and its worker
+    processes seen at one sample; ``peak_server`` is the server process'
+    own high-water mark. Both stay None where /proc is not available.
+
+    Args:
+        pid: Root process (the server)
+        interval: Seconds between samples
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.available = os.path.exists(f'/proc/{pid}/status')
+        self.peak_total: float | None = None
+        self.peak_server: float | None = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self) -> None:
+        if not self.available:
+            return
+        total = sum(_rss_mb(pid) for pid in _process_tree(self.pid))
+        self.peak_total = max(self.peak_total or 0.0, total)
+        self.peak_server = max(self.peak_server or 0.0, _rss_mb(self.pid, 'VmHWM'))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> 'RssSampler':
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, storage_url: str, workers: int | None = None, env: dict | None = None,
+                 timeout: float = 60.0) -> subprocess.Popen:
+    """Start the MCP server over streamable HTTP and wait until /readyz reports ready.
+
+    Uploads go to the Supabase-compatible API at ``storage_url``; the result
+    cache is off unless ``env`` sets ASCII_ART_CACHE_SIZE.
+    """
+    server_env = {key: value for key, value in os.environ.items()
+                  if key not in ('ASCII_ART_STORAGE_URL', 'ASCII_ART_CACHE_DIR')}
+    server_env.update({'SUPABASE_URL': storage_url, 'SUPABASE_KEY': 'loadtest', 'SUPABASE_BUCKET': 'loadtest',
+                       'ASCII_ART_CACHE_SIZE': '0', **(env or {})})
+    command = [sys.executable, str(SERVER), '--transport', 'streamable-http', '--port', str(port)]
+    if workers is not None:
+        command += ['--workers', str(workers)]
+    process = subprocess.Popen(command, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if httpx.get(f'http://127.0.0.1:{port}/readyz').status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f"server did not become ready: {process.stderr.read().decode()[-2000:]}")
+        time.sleep(0.1)
+
+
+def stop_server(process: subprocess.Popen, timeout: float = 60.0) -> int:
+    """Send SIGTERM (the server drains, then stops its workers) and return the exit code."""
+    process.send_signal(signal.SIGTERM)
+    try:
+        return process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return process.wait()
+
+
+async def call_tool(session: ClientSession, request: dict) -> dict:
+    """Run one generate_ascii_image call and time it; errors are recorded, not raised."""
+    arguments = {key: value for key, value in request.items() if key != 'source'}
+    start = time.perf_counter()
+    try:
+        result = await session.call_tool('generate_ascii_image', arguments)
+        text = result.content[0].text if result.content else ''
+        error = None if not result.isError and text.startswith('✅') else (text.splitlines() or ['empty result'])[0]
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {'source': request['source'], 'latency': time.perf_counter() - start, 'error': error}
+
+
+async def drive(url: str, workload: list[dict], clients: int, warmup: list[dict] = (),
+                on_start: Callable[[], None] | None = None) -> tuple[list[dict], float, dict]:
+    """Run ``workload`` from ``clients`` concurrent MCP sessions sharing one request queue.
+
+    Args:
+        url: MCP endpoint, e.g. http://127.0.0.1:8000/mcp
+        workload: Requests from build_workload
+        clients: Number of simulated clients, each with its own session
+        warmup: Requests run before measuring (not counted)
+        on_start: Called when the measured phase starts, e.g. to snapshot counters
+
+    Returns:
+        Tuple of (outcomes, elapsed seconds, server stats resource)
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for request in workload:
+        queue.put_nowait(request)
+    outcomes: list[dict] = []
+    # 所有客户端建立会话后同时开始，计时从这里算起
+    connected: list[int] = []
+    all_connected, go = asyncio.Event(), asyncio.Event()
+
+    async def client():
+        async with streamable_http_client(url) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                connected.append(1)
+                if len(connected) == clients:
+                    all_connected.set()
+                await go.wait()
+                while True:
+                    try:
+                        request = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    outcomes.append(await call_tool(session, request))
+
+    async with streamable_http_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            for request in warmup:
+                await call_tool(session, request)
+            tasks = [asyncio.create_task(client()) for _ in range(clients)]
+            await all_connected.wait()
+            if on_start is not None:
+                on_start()
+            start = time.perf_counter()
+            go.set()
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+            stats = await session.read_resource('ascii-art://stats')
+    return outcomes, elapsed, json.loads(stats.contents[0].text)
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=SERVER.parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(clients: int = 8, requests: int = 100, url_ratio: float = 0.5, widths: tuple[int, ...] = (80, 120),
+        formats: tuple[str, ...] = ('png',), workers: int | None = None, seed: int = 0, warmup: int = 2,
+        storage_latency: float = 0.02, image_latency: float = 0.0, env: dict | None = None) -> dict:
+    """Start the stand-ins and the server, run the load test and return the results.
+
+    Args:
+        clients: Concurrent simulated clients
+        requests: Measured requests, shared among the clients
+        url_ratio: Share of requests naming the input by URL
+        widths: Widths drawn for the requests
+        formats: Output formats drawn for the requests
+        workers: Render worker processes of the server (None: ASCII_ART_WORKERS)
+        seed: Seed of the workload
+        warmup: Requests run once before measuring
+        storage_latency: Seconds the fake storage adds to every upload
+        image_latency: Seconds the image host adds to every download
+        env: Extra environment variables for the server
+
+    Returns:
+        JSON-serializable results (see summarize), plus config, peak_rss_mb,
+        uploads, downloads, server stats, exit code and platform
+    """
+    with tempfile.TemporaryDirectory() as directory, \
+            FakeStorageServer(latency=storage_latency) as storage, \
+            ImageHost(Path(directory), latency=image_latency) as host:
+        images = make_fixtures(Path(directory))
+        workload = build_workload(images, host.url, requests, url_ratio, widths, formats, seed)
+        # 预热请求的宽度不在压测宽度中，不会与压测请求合并
+        warmup_requests = build_workload(images, host.url, warmup, 0.0, (max(widths) + 1,), formats, seed + 1)
+        port = _free_port()
+        process = start_server(port, storage.url, workers, env)
+        before = {}
+        try:
+            with RssSampler(process.pid) as rss:
+                outcomes, elapsed, stats = asyncio.run(drive(
+                    f'http://127.0.0.1:{port}/mcp', workload, clients, warmup_requests,
+                    on_start=lambda: before.update(downloads=host.requests, uploads=storage.requests)))
+        finally:
+            exit_code = stop_server(process)
+        downloads = host.requests - before['downloads']
+        uploads = storage.requests - before['uploads']
+
+    if not rss.available:
+        # 没有 /proc 时只能得到已退出子进程中最大的一个
+        rss.peak_total = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {
+        'config': {
+            'clients': clients, 'requests': requests, 'url_ratio': url_ratio, 'widths': list(widths),
+            'formats': list(formats), 'workers': stats['worker_pool'].get('workers', workers), 'seed': seed,
+            'warmup': warmup, 'storage_latency_s': storage_latency, 'image_latency_s': image_latency,
+            'env': env or {},
+        },
+        **summarize(outcomes, elapsed),
+        'peak_rss_mb': {
+            'server': None if rss.peak_server is None else round(rss.peak_server, 1),
+            'total': None if rss.peak_total is None else round(rss.peak_total, 1),
+        },
+        'uploads': uploads,
+        'downloads': downloads,
+        'server_stats': stats,
+        'server_exit_code': exit_code,
+        'platform': {'python': platform.python_version(), 'system': platform.system(),
+                     'machine': platform.machine(), 'cpus': os.cpu_count(), 'revision': _git_revision()},
+    }
+
+
+def _lookup(results: dict, path: tuple[str, ...]):
+    for key in path:
+        if not isinstance(results, dict):
+            return None
+        results = results.get(key)
+    return results
+
+
+def compare(baseline: dict, current: dict) -> list[str]:
+    """One line per headline metric: baseline, current and relative change, marked better or worse."""
+    lines = []
+    for path, label, higher_is_better in COMPARED_METRICS:
+        before, after = _lookup(baseline, path), _lookup(current, path)
+        if before is None or after is None:
+            lines.append(f"  {label:<30} {before!s:>10} -> {after!s:>10}")
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        verdict = '' if after == before else ('better' if (after > before) == higher_is_better else 'worse')
+        lines.append(f"  {label:<30} {before:>10} -> {after:>10}  {change:+6.1f}%  {verdict}")
+    return lines
+
+
+def format_report(results: dict) -> str:
+    """Short human-readable summary of a run."""
+    latency = results['latency_ms']
+    rss = results['peak_rss_mb']
+    lines = [
+        f"{results['requests']} requests from {results['config']['clients']} clients in {results['duration_s']} s: "
+        f"{results['throughput_rps']} req/s, error rate {results['error_rate']:.2%}",
+        f"  latency ms  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}",
+        f"  peak RSS MB  server {rss['server']}  server + workers {rss['total']}",
+        f"  {results['downloads']} downloads, {results['uploads']} uploads",
+    ]
+    lines += [f"  {count} x {message}" for message, count in results['errors_by_message'].items()]
+    return '\n'.join(lines)
+
+
+def _env_pair(text: str) -> tuple[str, str]:
+    key, sep, value = text.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got '{text}'")
+    return key, value
+
+
+def main():
+    """命令行入口：JSON 结果写到标准输出（或 --output 文件），摘要写到标准错误"""
+    parser = argparse.ArgumentParser(description='ASCII Art MCP 服务器压力测试')
+    parser.add_argument('-c', '--clients', type=int, default=8, help='并发客户端数（默认8）')
+    parser.add_argument('-n', '--requests', type=int, default=100, help='请求总数（默认100）')
+    parser.add_argument('--url-ratio', type=float, default=0.5, help='以URL提供输入的请求比例（默认0.5）')
+    parser.add_argument('--widths', default='80,120', help='请求宽度，逗号分隔（默认 80,120）')
+    parser.add_argument('--formats', default='png', help='输出格式，逗号分隔（默认 png）')
+    parser.add_argument('--workers', type=int, default=None, help='服务器渲染工作进程数（默认 ASCII_ART_WORKERS）')
+    parser.add_argument('--seed', type=int, default=0, help='请求序列的随机种子（默认0）')
+    parser.add_argument('--warmup', type=int, default=2, help='压测前的预热请求数（默认2，不计入结果）')
+    parser.add_argument('--storage-latency', type=float, default=0.02, help='假存储每次上传的延迟秒数（默认0.02）')
+    parser.add_argument('--image-latency', type=float, default=0.0, help='图片主机每次下载的延迟秒数（默认0）')
+    parser.add_argument('--env', type=_env_pair, action='append', default=[], metavar='KEY=VALUE',
+                        help='传给服务器的环境变量，可重复')
+    parser.add_argument('-o', '--output', help='把JSON结果写入文件')
+    parser.add_argument('--baseline', help='与之前保存的JSON结果比较')
+    args = parser.parse_args()
+
+    results = run(clients=args.clients, requests=args.requests, url_ratio=args.url_ratio,
+                  widths=tuple(int(width) for width in args.widths.split(',')),
+                  formats=tuple(args.formats.split(',')), workers=args.workers, seed=args.seed,
+                  warmup=args.warmup, storage_latency=args.storage_latency, image_latency=args.image_latency,
+                  env=dict(args.env))
+    document = json.dumps(results, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(document + '\n', encoding='utf-8')
+    else:
+        print(document)
+    print(format_report(results), file=sys.stderr)
+    if args.baseline:
+        print(f"compared with {args.baseline}:", file=sys.stderr)
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        print('\n'.join(compare(baseline, results)), file=sys.stderr)
+    sys.exit(1 if results['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,174 +4,576 @@ ASCII Art Generator
 将图片转换为ASCII艺术的生成器
 """
 
-from PIL import Image, ImageEnhance, ImageDraw, ImageFont
+from PIL import Image
 import argparse
+import glob
+import hashlib
+import io
+import json
+import os
 import sys
-import platform
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 from pathlib import Path
 
+from animation import ANIMATION_FORMATS, animation_writer, encode_frame, frame_count, is_animated, iter_frames
+from cache import digest_bytes
+from encoder import IMAGE_FORMATS, PALETTE_MODES, ImageEncoder
+from exporters import (
+    ANSI_PALETTES, MARKUP_CELL_RATIO, MARKUP_COLOR_STEP, MARKUP_FORMATS, ansi_lines, encode_ansi_delta, markup_lines,
+    text_lines
+)
+from fonts import font_registry
+from grid import AsciiGrid
+from metrics import StageMetrics, StageTimer, format_timings, stage, timed, timing
+from options import CHAR_SETS, resolve_charset
+from renderer import RENDER_WORKERS, font_cell_size, render_grid, render_pool
+
+
+# 输入图片的像素上限（按文件头声明的尺寸，解码前检查），可通过环境变量配置
+MAX_IMAGE_PIXELS = int(os.getenv('ASCII_ART_MAX_PIXELS', 100_000_000))
+# 解码后像素缓冲区的内存上限（字节）
+MAX_DECODE_BYTES = int(float(os.getenv('ASCII_ART_MAX_DECODE_MB', 512)) * 1024 * 1024)
+# 缩放前最多保留目标尺寸的几倍（与 Image.thumbnail 相同的取舍，画质与直接缩放几乎无差别）
+REDUCING_GAP = 2.0
+# 批量模式下从目录中收集的图片扩展名
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+# 批量模式的断点续传清单文件名（位于输出目录）
+MANIFEST_NAME = '.ascii_manifest.jsonl'
+# 批量模式下各文本格式的输出扩展名
+TEXT_SUFFIXES = {'text': '.txt', 'html': '.html', 'svg': '.svg'}
+# 逐行输出时每次映射的行数：块内仍然整体向量化，同时第一行可以尽早输出
+STREAM_ROW_BLOCK = 64
+
+
+class _BufferReader(io.RawIOBase):
+    """只读的类文件对象，直接读取 bytearray/memoryview，不像 io.BytesIO 那样先复制一份"""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = bytes(self._view[self._pos:end])
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self._view[self._pos:self._pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def open_image(source, max_pixels=None):
+    """
+    打开输入图片，支持文件路径、内存中的字节数据、类文件对象或已打开的PIL图片
+    只读取文件头，超过像素上限的图片在解码前就被拒绝
+    
+    Args:
+        source: 图片路径 (str/Path)、bytes、类文件对象或 PIL.Image.Image
+        max_pixels: 像素上限，默认 MAX_IMAGE_PIXELS
+    
+    Returns:
+        PIL图片对象（尚未解码）
+    """
+    if max_pixels is None:
+        max_pixels = MAX_IMAGE_PIXELS
+    name = '<内存图片>' if isinstance(source, (bytes, bytearray, memoryview)) else source
+    if isinstance(source, Image.Image):
+        img = source
+    else:
+        try:
+            # 像素上限由下面的检查负责，不依赖Pillow的解压炸弹警告
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                if isinstance(source, bytes):
+                    img = Image.open(io.BytesIO(source))
+                elif isinstance(source, (bytearray, memoryview)):
+                    # 下载得到的 bytearray：BytesIO 会复制整个缓冲区，峰值内存翻倍
+                    img = Image.open(_BufferReader(source))
+                else:
+                    img = Image.open(source)
+        except Exception as e:
+            raise ValueError(f"无法打开图片文件 {name}: {e}")
+    
+    if img.width * img.height > max_pixels:
+        raise ValueError(
+            f"图片过大 {name}: {img.width}x{img.height} 像素，超过上限 {max_pixels:,} 像素"
+        )
+    return img
+
+
+def draft_for_grid(img, size, max_decode_bytes=None):
+    """
+    让解码器直接输出接近目标网格的分辨率（JPEG的DCT缩放），并检查解码内存上限
+    
+    Args:
+        img: open_image 返回的未解码图片
+        size: 最终网格尺寸 (宽, 高)
+        max_decode_bytes: 解码缓冲区上限，默认 MAX_DECODE_BYTES
+    
+    Returns:
+        同一个图片对象（尺寸可能已缩小）
+    """
+    if max_decode_bytes is None:
+        max_decode_bytes = MAX_DECODE_BYTES
+    
+    # 只对尚未解码的图片生效；非JPEG格式会忽略draft
+    if img.mode in ('RGB', 'L', 'CMYK', 'YCbCr'):
+        img.draft(img.mode, (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+    
+    decode_bytes = img.width * img.height * len(img.getbands())
+    if decode_bytes > max_decode_bytes:
+        raise ValueError(
+            f"图片解码需要 {decode_bytes / 1024 / 1024:.0f} MB，超过上限 {max_decode_bytes / 1024 / 1024:.0f} MB"
+        )
+    return img
+
+
+def _clip8(value):
+    """截断并限制到 0-255（与 Image.blend 的取整方式一致）"""
+    if value <= 0:
+        return 0
+    if value >= 255:
+        return 255
+    return int(value)
+
+
+def apply_tone(img, brightness=1.0, contrast=1.0):
+    """
+    在已缩放的字符网格上调整亮度和对比度
+    两个调整合并成一张256项查找表，彩色图每个通道各用一份，耗时与原图大小无关
+    
+    误差范围：对同一张图，结果与 ImageEnhance.Brightness / Contrast 相差不超过1个灰度级；
+    与“先在原图上调整再缩放”相比，对比度均值取自缩放后的网格、截断发生在缩放之后，
+    平均误差小于1个灰度级，仅在被截断的高对比边缘处个别像素差异较大。
+    
+    Args:
+        img: 已缩放到字符网格的图片
+        brightness: 亮度调整系数 (1.0为原图)
+        contrast: 对比度调整系数 (1.0为原图)
+    
+    Returns:
+        调整后的图片（'L' 或 'RGB' 模式）
+    """
+    if brightness == 1.0 and contrast == 1.0:
+        return img
+    img = img.convert('L') if img.mode in ('L', 'LA', '1') else img.convert('RGB')
+    bands = len(img.getbands())
+    
+    table = [_clip8(value * brightness) for value in range(256)]
+    if contrast != 1.0:
+        # 与 ImageEnhance.Contrast 相同：以（调整亮度后的）平均灰度为中心拉伸
+        histogram = img.point(table * bands).convert('L').histogram()
+        mean = int(sum(value * count for value, count in enumerate(histogram)) / max(sum(histogram), 1) + 0.5)
+        table = [_clip8(mean + contrast * (value - mean)) for value in table]
+    
+    return img.point(table * bands)
+
+
+def encode_png(canvas, encoder=None):
+    """
+    将画布编码为内存中的PNG数据
+    
+    Args:
+        canvas: PIL图片
+        encoder: encoder.ImageEncoder（调色板与压缩级别），默认按环境变量配置
+    
+    Returns:
+        PNG格式的字节数据
+    """
+    return (encoder or ImageEncoder.from_env()).encode(canvas, 'png').data
+
 
 class ASCIIArtGenerator:
     """ASCII艺术生成器类"""
     
-    # 不同的ASCII字符集
-    CHAR_SETS = {
-        'simple': ' .:-=+*#%@',
-        'detailed': ' .\'"`,^:;Il!i><~+_-?][}{1)(|\\/tfjrxnuvczXYUJCLQ0OZmwqpdbkhao*#MW&8%B@$',
-        'blocks': ' ░▒▓█',
-        'minimal': ' .-+*@',
-        'numbers': ' 123456789',
-    }
+    # 不同的ASCII字符集（定义在 options.py，服务器不加载图像库也能解析）
+    CHAR_SETS = CHAR_SETS
     
-    def __init__(self, char_set='simple', invert=False):
+    def __init__(self, char_set='simple', invert=False, max_pixels=None, max_decode_bytes=None, grid_cache=None,
+                 render_workers=None, encoder=None, font_path=None):
         """
         初始化生成器
         
         Args:
             char_set: 字符集名称或自定义字符集字符串
             invert: 是否反转字符顺序（亮度映射）
+            max_pixels: 输入图片像素上限，默认 MAX_IMAGE_PIXELS
+            max_decode_bytes: 解码缓冲区内存上限（字节），默认 MAX_DECODE_BYTES
+            grid_cache: 可选的 cache.GridCache，缓存缩放后的字符网格供多次调参复用
+            render_workers: 大画布分带并行渲染的进程数，默认 renderer.RENDER_WORKERS（1 表示不分带）
+            encoder: 图片编码器 encoder.ImageEncoder（调色板、压缩级别），默认按环境变量配置
+            font_path: 渲染图片用的字体文件，默认环境变量 ASCII_ART_FONT 或系统等宽字体（见 fonts.py）
         """
-        if char_set in self.CHAR_SETS:
-            self.chars = self.CHAR_SETS[char_set]
-        else:
-            self.chars = char_set
-        
-        if invert:
-            self.chars = self.chars[::-1]
+        self.max_pixels = max_pixels
+        self.max_decode_bytes = max_decode_bytes
+        self.grid_cache = grid_cache
+        self.render_workers = render_workers
+        self.encoder = encoder if encoder is not None else ImageEncoder.from_env()
+        self.font_path = font_path
+        self.fonts = font_registry(font_path)
+
+        self.chars = resolve_charset(char_set, invert)
             
     def _get_font(self, size=12):
         """
         获取等宽字体
-        尝试加载系统常见的等宽字体
+        字体由进程级的字体注册表查找一次，按字号缓存（见 fonts.FontRegistry）
         """
-        system = platform.system()
-        fonts = []
-        
-        if system == 'Windows':
-            fonts = ['consola.ttf', 'lucon.ttf', 'arial.ttf']
-        elif system == 'Darwin':  # macOS
-            fonts = ['Menlo.ttc', 'Monaco.ttf', 'Courier New.ttf']
-        else:  # Linux
-            fonts = ['DejaVuSansMono.ttf', 'LiberationMono-Regular.ttf', 'FreeMono.ttf']
-            
-        # 尝试加载字体
-        for font_name in fonts:
-            try:
-                return ImageFont.truetype(font_name, size)
-            except IOError:
-                continue
-                
-        # 如果都失败了，尝试加载默认字体（可能不是等宽的，效果会差）
-        print("警告: 未找到系统等宽字体，使用默认字体，效果可能不佳。", file=sys.stderr)
-        return ImageFont.load_default()
+        return self.fonts.font(size)
     
-    def image_to_ascii(self, image_path, width=100, height=None, color_mode='gray', brightness=1.0, contrast=1.0):
+    def image_to_ascii(self, image_path, width=100, height=None, color_mode='gray', brightness=1.0, contrast=1.0,
+                       ansi_palette='truecolor', color_step=1, digest=None):
         """
         将图片转换为ASCII艺术
         
         Args:
-            image_path: 图片文件路径
+            image_path: 图片文件路径（也可以是bytes、类文件对象或PIL图片）
             width: 输出宽度（字符数）
             height: 输出高度（字符数），如果为None则自动计算保持比例
             color_mode: 颜色模式 ('gray', 'color')
             brightness: 亮度调整系数 (1.0为原图)
             contrast: 对比度调整系数 (1.0为原图)
+            ansi_palette: 彩色模式的ANSI调色板 ('truecolor' 24位色, '256' xterm 256色)
+            color_step: truecolor 模式下合并相近颜色的量化步长 (1为精确颜色)
+            digest: 输入内容的哈希（用于网格缓存，输入为bytes时自动计算）
         
         Returns:
             ASCII艺术字符串
         """
-        try:
-            img = Image.open(image_path)
-        except Exception as e:
-            raise ValueError(f"无法打开图片文件 {image_path}: {e}")
+        return '\n'.join(self.iter_ascii_rows(
+            image_path, width, height, color_mode, brightness, contrast, ansi_palette, color_step, digest
+        ))
+    
+    def iter_ascii_rows(self, image_path, width=100, height=None, color_mode='gray', brightness=1.0, contrast=1.0,
+                        ansi_palette='truecolor', color_step=1, digest=None):
+        """
+        逐行生成ASCII艺术，参数同 image_to_ascii
+        每次只导出 STREAM_ROW_BLOCK 行，调用方可以边生成边输出，不需要拼出完整字符串
+        
+        Yields:
+            每行的文本（不含换行符）
+        """
+        # 0.55 调整字符高宽比（因为字符通常比宽度高）
+        grid = self.make_grid(image_path, width, height, 0.55, brightness, contrast, color_mode == 'color', digest)
+        return self.export_rows(grid, color_mode, ansi_palette, color_step)
+    
+    def export_rows(self, grid, color_mode='gray', ansi_palette='truecolor', color_step=1):
+        """
+        把字符网格逐行导出为文本（彩色模式为ANSI彩色文本）
+        
+        Args:
+            grid: make_grid 得到的 AsciiGrid（彩色模式需要带颜色）
+            color_mode, ansi_palette, color_step: 同 image_to_ascii
         
-        # 调整亮度和对比度
-        if brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(brightness)
+        Yields:
+            每行的文本（不含换行符）
+        """
+        if color_mode == 'color':
+            return timed('export', ansi_lines(grid, ansi_palette, color_step, STREAM_ROW_BLOCK))
+        return timed('export', text_lines(grid, STREAM_ROW_BLOCK))
+    
+    def iter_markup_lines(self, source, fmt='html', width=100, height=None, color_mode='gray', brightness=1.0,
+                          contrast=1.0, font_size=10, bg_color=None, text_color=None, color_step=MARKUP_COLOR_STEP,
+                          digest=None):
+        """
+        逐行生成HTML或SVG格式的ASCII艺术（不需要渲染和上传PNG）
         
-        if contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(contrast)
+        Args:
+            source: 输入图片，路径、bytes、类文件对象或PIL图片
+            fmt: 'html' 或 'svg'
+            width, height, color_mode, brightness, contrast, digest: 同 image_to_ascii
+            font_size: 字体大小（像素）
+            bg_color: 背景色，默认深色主题
+            text_color: 灰度模式文字颜色，默认浅色
+            color_step: 合并相近颜色的量化步长（1为精确颜色，默认 MARKUP_COLOR_STEP）
+        
+        Yields:
+            文档的每一行
+        """
+        if fmt not in MARKUP_FORMATS:
+            raise ValueError(f"不支持的格式 '{fmt}'，可选: {', '.join(MARKUP_FORMATS)}")
+        grid = self.make_grid(source, width, height, MARKUP_CELL_RATIO, brightness, contrast,
+                              color_mode == 'color', digest)
+        return self.export_markup(grid, fmt, color_mode, font_size, bg_color, text_color, color_step)
+    
+    def export_markup(self, grid, fmt='html', color_mode='gray', font_size=10, bg_color=None, text_color=None,
+                      color_step=MARKUP_COLOR_STEP):
+        """把字符网格逐行导出为HTML或SVG，参数同 iter_markup_lines"""
+        return timed('export', markup_lines(grid, fmt, color_mode=color_mode, font_size=font_size, bg_color=bg_color,
+                                            text_color=text_color, color_step=color_step,
+                                            block_rows=STREAM_ROW_BLOCK))
+    
+    def render_markup(self, source, fmt='html', **options):
+        """
+        生成完整的HTML或SVG文档，参数同 iter_markup_lines
+        
+        Returns:
+            文档字符串
+        """
+        return '\n'.join(self.iter_markup_lines(source, fmt, **options))
+    
+    def make_grid(self, source, width, height=None, cell_ratio=0.55, brightness=1.0, contrast=1.0, color=False,
+                  digest=None):
+        """
+        计算字符网格（AsciiGrid），文本、ANSI和PNG输出都从它导出，不需要重新解码
+        
+        Args:
+            source: 输入图片，路径、bytes、类文件对象或PIL图片
+            width: 字符宽度
+            height: 字符行数，为None时按原图长宽比和 cell_ratio 计算
+            cell_ratio: 字符单元格的宽高比
+            brightness: 亮度调整系数
+            contrast: 对比度调整系数
+            color: 是否保存每个单元格的颜色（彩色输出需要）
+            digest: 输入内容的哈希（用于网格缓存，输入为bytes时自动计算）
+        
+        Returns:
+            AsciiGrid
+        """
+        return self.make_grids(source, width, [(height, cell_ratio)], brightness, contrast, color, digest)[0]
+    
+    def make_grids(self, source, width, shapes, brightness=1.0, contrast=1.0, color=False, digest=None):
+        """
+        只解码一次，为同一张图片计算多个字符网格（例如文本用0.55的单元格比例，PNG用字体的比例）
+        
+        Args:
+            shapes: [(字符行数或None, 单元格宽高比), ...]
+            其余参数同 make_grid
+        
+        Returns:
+            与 shapes 一一对应的 AsciiGrid 列表（尺寸相同的网格是同一个对象）
+        """
+        grids = {}
+        result = []
+        for img in self._load_grids(source, width, shapes, digest):
+            if img.size not in grids:
+                with stage('enhance'):
+                    img = apply_tone(img, brightness, contrast)
+                with stage('mapping'):
+                    grids[img.size] = AsciiGrid.from_image(img, self.chars, color)
+            result.append(grids[img.size])
+        return result
+    
+    def _load_grid(self, source, width, height=None, cell_ratio=0.55, digest=None):
+        """
+        打开图片并缩放到字符网格，命中网格缓存时跳过解码和缩放
+        
+        Args:
+            source: 输入图片，路径、bytes、类文件对象或PIL图片
+            width: 字符宽度
+            height: 字符行数，为None时按原图长宽比和 cell_ratio 计算
+            cell_ratio: 字符单元格的宽高比
+            digest: 输入内容的哈希，为None且输入为bytes时自动计算
+        
+        Returns:
+            每个像素对应一个字符的小图（共享对象，不要原地修改）
+        """
+        return self._load_grids(source, width, [(height, cell_ratio)], digest)[0]
+    
+    def _load_grids(self, source, width, shapes, digest=None):
+        """
+        _load_grid 的多尺寸版本：按需要的最大网格解码一次，再分别缩放
+        
+        Args:
+            shapes: [(字符行数或None, 单元格宽高比), ...]
+        
+        Returns:
+            与 shapes 一一对应的小图列表
+        """
+        with stage('decode'):
+            img = open_image(source, self.max_pixels)
         
         # 计算新的尺寸，保持纵横比
-        aspect_ratio = img.height / img.width
-        if height is None:
-            # 0.55 调整字符高宽比（因为字符通常比宽度高）
-            new_height = int(aspect_ratio * width * 0.55)
-        else:
-            new_height = height
+        sizes = [
+            (width, height if height is not None else int(img.height / img.width * width * cell_ratio))
+            for height, cell_ratio in shapes
+        ]
         
-        # 调整图片大小
-        img = img.resize((width, new_height))
+        if self.grid_cache is not None and digest is None and isinstance(source, (bytes, bytearray, memoryview)):
+            digest = digest_bytes(source)
+        use_cache = self.grid_cache is not None and digest is not None
+        grids = {}
+        if use_cache:
+            for size in sizes:
+                grid = self.grid_cache.get((digest, *size))
+                if grid is not None:
+                    grids[size] = grid
         
-        if color_mode == 'color':
-            return self._create_colored_ascii(img, width)
-        else:
-            return self._create_grayscale_ascii(img, width)
+        missing = [size for size in dict.fromkeys(sizes) if size not in grids]
+        if missing:
+            # 按最大的目标尺寸解码，避免完整解码大图；显式解码，使解码和缩放分开计时
+            with stage('decode'):
+                img = draft_for_grid(img, max(missing, key=lambda size: size[1]), self.max_decode_bytes)
+                img.load()
+            
+            # 调整图片大小到字符网格
+            with stage('resize'):
+                for size in missing:
+                    grids[size] = img.resize(size, reducing_gap=REDUCING_GAP)
+            if use_cache:
+                for size in missing:
+                    self.grid_cache.put((digest, *size), grids[size])
+        return [grids[size] for size in sizes]
     
     def _create_grayscale_ascii(self, img, width):
         """创建灰度ASCII艺术"""
-        # 转换为灰度图
-        img = img.convert('L')
-        pixels = img.getdata()
-        
-        # 将像素值映射到字符
-        char_count = len(self.chars)
-        ascii_str = ''.join(
-            self.chars[min(pixel * char_count // 256, char_count - 1)]
-            for pixel in pixels
-        )
-        
-        # 格式化为多行
-        ascii_img = '\n'.join(
-            ascii_str[i:i+width] for i in range(0, len(ascii_str), width)
-        )
-        return ascii_img
-    
-    def _create_colored_ascii(self, img, width):
-        """创建彩色ASCII艺术（使用ANSI颜色代码）"""
-        # 转换为RGB模式
-        img = img.convert('RGB')
-        pixels = img.getdata()
-        
-        # 创建灰度版本用于字符选择
-        gray_img = img.convert('L')
-        gray_pixels = gray_img.getdata()
-        
-        ascii_lines = []
-        char_count = len(self.chars)
-        
-        for i in range(0, len(pixels), width):
-            line = ''
-            for j in range(width):
-                if i + j < len(pixels):
-                    # 获取RGB值
-                    r, g, b = pixels[i + j]
-                    # 获取对应的ASCII字符
-                    gray_val = gray_pixels[i + j]
-                    char = self.chars[min(gray_val * char_count // 256, char_count - 1)]
-                    # 添加ANSI颜色代码
-                    line += f'\033[38;2;{r};{g};{b}m{char}\033[0m'
-            ascii_lines.append(line)
-        
-        return '\n'.join(ascii_lines)
+        return '\n'.join(text_lines(AsciiGrid.from_image(img, self.chars), STREAM_ROW_BLOCK))
+    
+    def _create_colored_ascii(self, img, width, ansi_palette='truecolor', color_step=1):
+        """
+        创建彩色ASCII艺术（使用ANSI颜色代码）
+        只在颜色变化时输出转义序列，每行末尾统一重置颜色
+        """
+        grid = AsciiGrid.from_image(img, self.chars, color=True)
+        return '\n'.join(ansi_lines(grid, ansi_palette, color_step, STREAM_ROW_BLOCK))
     
     def save_to_file(self, ascii_art, output_path):
         """
         将ASCII艺术保存到文件
         
         Args:
-            ascii_art: ASCII艺术字符串
+            ascii_art: ASCII艺术字符串，或逐行生成的可迭代对象（边生成边写入）
             output_path: 输出文件路径
         """
         try:
             with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(ascii_art)
+                if isinstance(ascii_art, str):
+                    f.write(ascii_art)
+                else:
+                    for index, line in enumerate(ascii_art):
+                        f.write('\n' + line if index else line)
             print(f"ASCII艺术已保存到: {output_path}")
         except Exception as e:
             raise ValueError(f"无法保存文件 {output_path}: {e}")
 
+    def _render_canvas(self, img_small, font, color_mode='gray', bg_color=None, text_color=None):
+        """
+        将已缩放到字符网格的图片绘制为画布（见 render_grid）
+        
+        Args:
+            img_small: 每个像素对应一个字符的小图
+            font, color_mode, bg_color, text_color: 同 render_grid
+        
+        Returns:
+            RGB画布图片
+        """
+        grid = AsciiGrid.from_image(img_small, self.chars, color=color_mode == 'color')
+        return self.render_grid(grid, font, color_mode, bg_color, text_color)
+
+    def render_grid(self, grid, font, color_mode='gray', bg_color=None, text_color=None):
+        """
+        将字符网格绘制为画布
+        用字形图集一次性合成，每个字形只栅格化一次（按字体、字号缓存）
+        
+        Args:
+            grid: AsciiGrid（彩色模式需要带颜色）
+            font: 绘制用字体
+            color_mode: 'gray' 或 'color'
+            bg_color: 背景色，默认深色主题
+            text_color: 灰度模式文字颜色，默认浅色
+        
+        Returns:
+            RGB画布图片
+        """
+        with stage('draw'):
+            return render_grid(grid, font, color_mode=color_mode, bg_color=bg_color, text_color=text_color,
+                               workers=self.render_workers)
+
+    def render_image(self, source, width=100, color_mode='gray', brightness=1.0, contrast=1.0, font_size=10, bg_color=None, text_color=None, digest=None):
+        """
+        在内存中把图片渲染为ASCII艺术画布（CLI与MCP服务器共用的渲染流程）
+        
+        Args:
+            source: 输入图片，路径、bytes、类文件对象或PIL图片
+            width: 字符宽度
+            color_mode: 'gray' 或 'color'
+            brightness: 亮度调整
+            contrast: 对比度调整
+            font_size: 字体大小
+            bg_color: 背景色，默认深色主题 (40, 44, 52)
+            text_color: 文字颜色，默认浅色 (171, 178, 191)
+            digest: 输入内容的哈希（用于网格缓存，输入为bytes时自动计算）
+        
+        Returns:
+            RGB画布图片
+        """
+        # 加载字体
+        font = self._get_font(font_size)
+        
+        # 计算字符行数，保持原图长宽比
+        grid = self.make_grid(source, width, None, self.image_cell_ratio(font), brightness, contrast,
+                              color_mode == 'color', digest)
+        
+        # 绘制字符画布
+        return self.render_grid(grid, font, color_mode, bg_color, text_color)
+
+    @staticmethod
+    def image_cell_ratio(font):
+        """
+        渲染图片时字符单元格的宽高比
+        我们希望：(height * char_height) / (width * char_width) = original_aspect_ratio
+        所以：height = original_aspect_ratio * width * (char_width / char_height)
+        """
+        char_width, char_height = font_cell_size(font)
+        return char_width / char_height
+
+    def render_png(self, source, **options):
+        """
+        渲染ASCII艺术并返回内存中的PNG数据，参数同 render_image
+        
+        Returns:
+            PNG格式的字节数据
+        """
+        return self.render_encoded(source, 'png', **options).data
+
+    def render_encoded(self, source, fmt='png', **options):
+        """
+        渲染ASCII艺术并用生成器的编码器编码，参数同 render_image
+        
+        Args:
+            fmt: 'png' 或 'webp'（无损）
+        
+        Returns:
+            encoder.EncodedImage（数据、格式、是否使用调色板、编码耗时）
+        """
+        return self.encoder.encode(self.render_image(source, **options), fmt)
+
+    def save_canvas(self, canvas, output_path):
+        """
+        保存画布：.png 和 .webp 使用生成器的编码器（调色板、压缩级别），其他扩展名交给 Pillow
+        
+        Returns:
+            encoder.EncodedImage，交给 Pillow 保存时为 None
+        """
+        fmt = Path(output_path).suffix.lower().lstrip('.')
+        if fmt not in IMAGE_FORMATS:
+            canvas.save(output_path)
+            return None
+        encoded = self.encoder.encode(canvas, fmt)
+        Path(output_path).write_bytes(encoded.data)
+        return encoded
+
     def save_as_image(self, image_path, output_path, width=100, color_mode='gray', brightness=1.0, contrast=1.0, font_size=10, bg_color=None, text_color=None):
         """
         将ASCII艺术保存为图片（模拟文本编辑器显示效果）
@@ -187,109 +589,323 @@ class ASCIIArtGenerator:
             bg_color: 背景色，默认深色主题 (40, 44, 52)
             text_color: 文字颜色，默认浅色 (171, 178, 191)
         """
-        try:
-            img = Image.open(image_path)
-        except Exception as e:
-            raise ValueError(f"无法打开图片文件 {image_path}: {e}")
-
-        # 保存原始长宽比
-        original_aspect_ratio = img.height / img.width
-
-        # 调整亮度和对比度
-        if brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(brightness)
+        canvas = self.render_image(
+            image_path, width=width, color_mode=color_mode, brightness=brightness, contrast=contrast,
+            font_size=font_size, bg_color=bg_color, text_color=text_color
+        )
         
-        if contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(contrast)
+        # 保存
+        self.save_canvas(canvas, output_path)
+        print(f"ASCII图片已保存到: {output_path}")
 
-        # 加载字体
-        font = self._get_font(font_size)
-        
-        # 获取字符尺寸
-        bbox = font.getbbox('M')
-        char_width = bbox[2] - bbox[0]
-        char_height = bbox[3] - bbox[1]
+    def _animation_grids(self, img, width, height, cell_ratio, brightness, contrast, color, max_frames=None):
+        """
+        逐帧计算字符网格，一次只解码一帧
         
-        # 计算字符行数，保持原图长宽比
-        # 我们希望：(height * char_height) / (width * char_width) = original_aspect_ratio
-        # 所以：height = original_aspect_ratio * width * (char_width / char_height)
-        new_height = int(original_aspect_ratio * width * (char_width / char_height))
+        Yields:
+            (AsciiGrid, 帧时长毫秒)
+        """
+        if height is None:
+            height = int(img.height / img.width * width * cell_ratio)
+        for frame, duration in timed('decode', iter_frames(img, max_frames)):
+            with stage('resize'):
+                small = frame.resize((width, height), reducing_gap=REDUCING_GAP)
+            del frame
+            with stage('enhance'):
+                small = apply_tone(small, brightness, contrast)
+            with stage('mapping'):
+                grid = AsciiGrid.from_image(small, self.chars, color)
+            yield grid, duration
+
+    def ascii_animation(self, source, width=100, height=None, color_mode='gray', brightness=1.0, contrast=1.0,
+                        ansi_palette='truecolor', color_step=1, max_frames=None):
+        """
+        将动画（GIF/WebP/APNG）转换为ANSI帧流
+        第一帧清屏并完整绘制，之后每帧只重绘发生变化的字符（帧间增量编码）
         
-        # 调整图片大小到字符网格
-        img_small = img.resize((width, new_height))
+        Args:
+            source: 输入动画，路径、bytes、类文件对象或PIL图片
+            width, height, color_mode, brightness, contrast, ansi_palette, color_step: 同 image_to_ascii
+            max_frames: 最多转换的帧数，默认 animation.MAX_FRAMES
         
-        # 转换为灰度图用于字符选择
-        gray_img = img_small.convert('L')
-        gray_pixels = gray_img.getdata()
+        Yields:
+            (ANSI文本, 帧时长毫秒)；最后一项只把光标移到画面下方，时长为0
+        """
+        img = open_image(source, self.max_pixels)
+        previous = None
+        rows = 0
+        grids = self._animation_grids(img, width, height, 0.55, brightness, contrast, color_mode == 'color', max_frames)
+        for grid, duration in grids:
+            text, previous = encode_ansi_delta(grid.row_chars(), width, grid.rgb, previous, ansi_palette, color_step)
+            rows = grid.rows
+            yield text, duration
+        yield f'\033[{rows + 1};1H', 0
+
+    def render_animation(self, source, output, fmt='png', width=100, color_mode='gray', brightness=1.0, contrast=1.0,
+                         font_size=10, bg_color=None, text_color=None, max_frames=None, workers=None, loop=0):
+        """
+        将动画渲染为动画PNG（APNG）或GIF，逐帧流式写出
+        帧按顺序解码、计算字符网格后交给渲染进程并行绘制和编码，同时处理中的帧数有上限，
+        内存占用与总帧数无关；字形图集在每个进程中只生成一次，供所有帧复用
         
-        # 准备绘制
-        canvas_width = width * char_width
-        canvas_height = new_height * char_height
+        Args:
+            source: 输入动画，路径、bytes、类文件对象或PIL图片（单帧图片得到只有一帧的动画）
+            output: 输出路径或可写的二进制文件对象
+            fmt: 'png'（APNG）或 'gif'
+            width, color_mode, brightness, contrast, font_size, bg_color, text_color: 同 render_image
+            max_frames: 最多转换的帧数，默认 animation.MAX_FRAMES
+            workers: 并行渲染帧的进程数，默认 render_workers（1 表示在当前进程中逐帧渲染）
+            loop: 循环次数，0 表示无限循环
         
-        # 设置默认颜色（模拟 VS Code 深色主题）
-        if bg_color is None:
-            bg_color = (40, 44, 52)  # VS Code 深色背景
-        if text_color is None:
-            text_color = (171, 178, 191)  # VS Code 浅色文字
+        Returns:
+            写出的帧数
+        """
+        if fmt not in ANIMATION_FORMATS:
+            raise ValueError(f"不支持的动画格式 '{fmt}'，可选: {', '.join(ANIMATION_FORMATS)}")
+        img = open_image(source, self.max_pixels)
+        font = self._get_font(font_size)
+        count = frame_count(img, max_frames)
+        grids = self._animation_grids(img, width, None, self.image_cell_ratio(font), brightness, contrast,
+                                      color_mode == 'color', max_frames)
+        if workers is None:
+            workers = self.render_workers or RENDER_WORKERS
         
-        # 创建画布
-        if color_mode == 'color':
-            canvas = Image.new('RGB', (canvas_width, canvas_height), bg_color)
-            img_rgb = img_small.convert('RGB')
-            rgb_pixels = img_rgb.getdata()
+        target = open(output, 'wb') if isinstance(output, (str, Path)) else nullcontext(output)
+        with target as fp:
+            writer = animation_writer(fp, fmt, count, loop)
+            if workers > 1:
+                # 按顺序写出；在途帧数限制为进程数的两倍，保证进程不空闲且内存有界
+                pool = render_pool(workers)
+                pending = deque()
+                for grid, duration in grids:
+                    pending.append((pool.submit(
+                        _render_frame, grid, font_size, color_mode, bg_color, text_color, fmt, self.font_path
+                    ), duration))
+                    if len(pending) >= 2 * workers:
+                        future, frame_duration = pending.popleft()
+                        writer.add_frame(future.result(), frame_duration)
+                for future, frame_duration in pending:
+                    writer.add_frame(future.result(), frame_duration)
+            else:
+                for grid, duration in grids:
+                    canvas = self.render_grid(grid, font, color_mode, bg_color, text_color)
+                    with stage('encode') as encoding:
+                        data = encode_frame(canvas, fmt)
+                        encoding.nbytes = len(data)
+                    writer.add_frame(data, duration)
+            writer.close()
+        return count
+
+
+def _render_frame(grid, font_size, color_mode, bg_color, text_color, fmt, font_path=None):
+    """在渲染进程中绘制并编码一帧（字体和字形图集按进程缓存）"""
+    font = font_registry(font_path).font(font_size)
+    canvas = render_grid(grid, font, color_mode=color_mode, bg_color=bg_color, text_color=text_color, workers=1)
+    return encode_frame(canvas, fmt)
+
+
+def collect_images(patterns):
+    """
+    把命令行给出的文件、通配符和目录展开为图片文件列表
+    
+    Args:
+        patterns: 文件路径、通配符（支持 **）或目录（递归收集常见图片格式）
+    
+    Returns:
+        (去重排序后的绝对路径列表, 无法匹配的参数列表)
+    """
+    found = set()
+    missing = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = [p for p in path.rglob('*') if p.suffix.lower() in IMAGE_SUFFIXES and p.is_file()]
+        elif glob.has_magic(pattern):
+            matches = [Path(p) for p in glob.glob(pattern, recursive=True) if Path(p).is_file()]
         else:
-            # 灰度模式也使用彩色画布，以便设置背景色
-            canvas = Image.new('RGB', (canvas_width, canvas_height), bg_color)
-
-        draw = ImageDraw.Draw(canvas)
-        char_count = len(self.chars)
-        
-        # 绘制字符
-        for i in range(new_height):
-            for j in range(width):
-                idx = i * width + j
-                if idx >= len(gray_pixels):
-                    break
-                
-                # 获取字符
-                gray_val = gray_pixels[idx]
-                char_idx = min(gray_val * char_count // 256, char_count - 1)
-                char = self.chars[char_idx]
-                
-                # 跳过空格（不绘制，保持背景色）
-                if char == ' ':
-                    continue
-                
-                # 计算位置
-                x = j * char_width
-                y = i * char_height
-                
-                # 绘制字符
-                if color_mode == 'color':
-                    # 彩色模式：使用原图颜色，但调整亮度使其更明显
-                    r, g, b = rgb_pixels[idx]
-                    # 确保颜色足够亮，能在深色背景上显示
-                    min_brightness = 80
-                    if r + g + b < min_brightness * 3:
-                        factor = (min_brightness * 3) / max(r + g + b, 1)
-                        r, g, b = min(255, int(r * factor)), min(255, int(g * factor)), min(255, int(b * factor))
-                    color = (r, g, b)
-                else:
-                    # 灰度模式：根据灰度值调整文字颜色
-                    # 灰度值越高（越亮），字符颜色越亮
-                    brightness_factor = gray_val / 255.0
-                    r = int(text_color[0] * (0.3 + 0.7 * brightness_factor))
-                    g = int(text_color[1] * (0.3 + 0.7 * brightness_factor))
-                    b = int(text_color[2] * (0.3 + 0.7 * brightness_factor))
-                    color = (r, g, b)
-                
-                draw.text((x, y), char, font=font, fill=color)
-        
-        # 保存
-        canvas.save(output_path)
-        print(f"ASCII图片已保存到: {output_path}")
+            matches = [path] if path.is_file() else []
+        if not matches:
+            missing.append(pattern)
+        found.update(p.resolve() for p in matches)
+    return sorted(found), missing
+
+
+def _bulk_job(source, targets, options, profile=False):
+    """
+    批量模式的单个任务（在工作进程中执行）
+    
+    Args:
+        source: 输入图片路径
+        targets: {'txt': 路径, 'png': 路径} 中需要生成的输出（'txt' 按 options['format'] 写出文本、HTML或SVG）
+        options: 生成器与转换参数
+        profile: 是否记录各阶段耗时
+    
+    Returns:
+        (输入路径, 错误信息或None, 本任务的CPU时间, 阶段耗时 StageTimer.as_dict() 或None)
+    """
+    cpu_start = time.process_time()
+    with timing(enabled=profile) as timer:
+        error = _bulk_convert(source, targets, options)
+    return source, error, time.process_time() - cpu_start, timer.as_dict() if timer is not None else None
+
+
+def _bulk_convert(source, targets, options):
+    """执行 _bulk_job 的转换，返回错误信息或None；同时输出文本和图片时只解码一次"""
+    try:
+        encoder = ImageEncoder(options.get('png_palette', 'auto'), options.get('compression_level', 6))
+        generator = ASCIIArtGenerator(char_set=options['charset'], invert=options['invert'], encoder=encoder,
+                                      font_path=options.get('font'))
+        fmt = options.get('format', 'text')
+        font_size = options.get('font_size', 10)
+        color_mode = options['color_mode']
+        # 文本网格和图片网格的单元格比例不同，但共用一次解码和缩放
+        shapes = []
+        if 'txt' in targets:
+            shapes.append((options['height'], 0.55 if fmt == 'text' else MARKUP_CELL_RATIO))
+        if 'png' in targets:
+            font = generator._get_font(font_size)
+            shapes.append((None, generator.image_cell_ratio(font)))
+        if not shapes:
+            return None
+        grids = generator.make_grids(source, options['width'], shapes, brightness=options['brightness'],
+                                     contrast=options['contrast'], color=color_mode == 'color')
+        if 'png' in targets:
+            canvas = generator.render_grid(grids[-1], font, color_mode)
+            _write_atomic(targets['png'], generator.encoder.encode(canvas, 'png').data)
+        if 'txt' in targets:
+            if fmt == 'text':
+                rows = generator.export_rows(grids[0], color_mode, options['ansi_palette'], options['color_step'])
+            else:
+                rows = generator.export_markup(grids[0], fmt, color_mode, font_size,
+                                               color_step=options['color_step'])
+            _write_atomic(targets['txt'], '\n'.join(rows).encode('utf-8'))
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def _write_atomic(path, data):
+    """先写临时文件再替换，中断时不会留下写了一半的输出"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+
+def _load_manifest(manifest_path):
+    """读取清单，返回 {输入路径: 记录}；后写入的记录覆盖先写入的"""
+    done = {}
+    if manifest_path.exists():
+        for line in manifest_path.read_text(encoding='utf-8').splitlines():
+            try:
+                record = json.loads(line)
+                done[record['source']] = record
+            except (ValueError, KeyError):
+                # 中断时可能留下半行，忽略即可
+                continue
+    return done
+
+
+def run_bulk(images, output_dir, options, jobs=None, write_text=True, write_image=False, force=False,
+             log=print, profile=False):
+    """
+    批量转换：多进程并行，输出写入 output_dir，已完成的文件记录在清单中以便续传
+    
+    输出文件按输入文件相对于它们公共目录的路径存放，不同目录下的同名图片不会互相覆盖。
+    输入文件的大小、修改时间和转换参数都与清单一致且输出仍存在时跳过。
+    
+    Args:
+        images: 输入图片路径列表（通常来自 collect_images）
+        output_dir: 输出目录
+        options: 转换参数（charset, invert, width, height, color_mode, brightness,
+                 contrast, ansi_palette, color_step，可选 font_size、font、format、png_palette、compression_level）
+        jobs: 并行进程数，默认CPU核数；1 表示在当前进程中执行
+        write_text: 是否写出文本（options['format'] 为 html/svg 时写出 .html/.svg）
+        write_image: 是否写出 .png
+        force: 忽略清单，全部重新生成
+        log: 输出进度信息的函数
+        profile: 记录各阶段耗时，汇总到返回值的 stages
+    
+    Returns:
+        统计信息字典：total, converted, skipped, failed, wall_seconds, cpu_seconds, images_per_second，
+        profile 时还有 stages（metrics.StageMetrics.summary()：每个阶段的次数、总秒数和字节数）
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_NAME
+    done = {} if force else _load_manifest(manifest_path)
+    options_key = hashlib.sha256(json.dumps(
+        {**options, 'txt': write_text, 'png': write_image}, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    images = [Path(p).resolve() for p in images]
+    root = Path(os.path.commonpath([p.parent for p in images])) if images else output_dir
+    pending = []
+    skipped = 0
+    for image in images:
+        relative = image.relative_to(root)
+        targets = {}
+        if write_text:
+            targets['txt'] = str(output_dir / relative.with_suffix(TEXT_SUFFIXES[options.get('format', 'text')]))
+        if write_image:
+            targets['png'] = str(output_dir / relative.with_suffix('.png'))
+        stat = image.stat()
+        record = {'source': str(image), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                  'options': options_key, 'outputs': sorted(targets.values())}
+        previous = done.get(str(image))
+        if previous == record and all(Path(p).exists() for p in targets.values()):
+            skipped += 1
+            continue
+        pending.append((record, targets))
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(pending) or 1))
+    log(f"共 {len(images)} 张图片，跳过已完成 {skipped} 张，待处理 {len(pending)} 张（{jobs} 个进程）")
+
+    converted = failed = 0
+    cpu_seconds = 0.0
+    stage_metrics = StageMetrics()
+    start = time.perf_counter()
+    records = {record['source']: record for record, _ in pending}
+    with open(manifest_path, 'a', encoding='utf-8') as manifest:
+        def finish(source, error, cpu, timings):
+            nonlocal converted, failed, cpu_seconds
+            cpu_seconds += cpu
+            if timings is not None:
+                stage_metrics.observe(StageTimer.from_dict(timings))
+            if error is not None:
+                failed += 1
+                log(f"失败: {source}: {error}")
+                return
+            converted += 1
+            # 每完成一张立即写入清单，中断后可从这里继续
+            manifest.write(json.dumps(records[source], ensure_ascii=False) + '\n')
+            manifest.flush()
+
+        if jobs == 1:
+            for record, targets in pending:
+                finish(*_bulk_job(record['source'], targets, options, profile))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [pool.submit(_bulk_job, record['source'], targets, options, profile)
+                           for record, targets in pending]
+                for future in as_completed(futures):
+                    finish(*future.result())
+
+    wall = time.perf_counter() - start
+    summary = {
+        'total': len(images),
+        'converted': converted,
+        'skipped': skipped,
+        'failed': failed,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu_seconds,
+        'images_per_second': converted / wall if wall > 0 else 0.0,
+    }
+    if profile:
+        summary['stages'] = stage_metrics.summary()
+    return summary
 
 
 def main():
@@ -303,14 +919,25 @@ def main():
   python main.py image.jpg -w 150                   # 指定宽度
   python main.py image.jpg -c detailed              # 使用详细字符集
   python main.py image.jpg --color                  # 彩色输出
+  python main.py image.jpg --color --ansi-palette 256   # 彩色输出（xterm 256色，体积更小）
   python main.py image.jpg -o output.txt            # 保存到文件
   python main.py image.jpg -c blocks --invert       # 使用块字符并反转
+  python main.py image.jpg --color --format html -o art.html   # 彩色HTML（<pre> + 颜色段 <span>）
+  python main.py image.jpg --format svg -o art.svg  # SVG（每行一个 <text>）
+  python main.py image.jpg --save-img out.png --compression-level 9   # 调色板PNG，最高压缩
+  python main.py image.jpg --color --save-img out.webp       # 无损WebP
+  python main.py anim.gif --color                   # 在终端播放动画（只重绘变化的字符）
+  python main.py anim.gif --save-img out.png -f 8   # 保存为动画PNG（.gif 保存为GIF）
+  python main.py photos/ --output-dir out -j 8      # 批量转换目录，8个进程并行
+  python main.py "shots/**/*.png" --output-dir out --save-img --no-txt   # 批量生成图片
+  python main.py image.jpg --save-img out.png --profile   # 打印各阶段耗时
   
 可用字符集: simple, detailed, blocks, minimal, numbers
         '''
     )
     
-    parser.add_argument('image', help='输入图片文件路径')
+    parser.add_argument('image', nargs='+',
+                        help='输入图片文件路径（多个文件、通配符或目录时进入批量模式）')
     parser.add_argument('-w', '--width', type=int, default=100,
                         help='输出宽度（字符数，默认100）')
     parser.add_argument('--height', type=int, default=None,
@@ -321,60 +948,242 @@ def main():
                         help='反转字符顺序（明暗反转）')
     parser.add_argument('--color', action='store_true',
                         help='启用彩色输出（使用ANSI颜色代码）')
+    parser.add_argument('--ansi-palette', choices=ANSI_PALETTES, default='truecolor',
+                        help='彩色输出的调色板（truecolor 24位色 / 256 xterm 256色，默认truecolor）')
+    parser.add_argument('--color-step', type=int, default=None,
+                        help=f'彩色输出时合并相近颜色的量化步长（1为精确颜色，例如8可显著缩小输出；'
+                             f'默认文本为1，HTML/SVG为{MARKUP_COLOR_STEP}）')
     parser.add_argument('-b', '--brightness', type=float, default=1.0,
                         help='亮度调整系数 (默认1.0, <1变暗, >1变亮)')
     parser.add_argument('--contrast', type=float, default=1.0,
                         help='对比度调整系数 (默认1.0, <1降低对比度, >1增加对比度)')
     parser.add_argument('-o', '--output', help='输出文件路径（不指定则打印到控制台）')
-    parser.add_argument('--save-img', help='保存为图片文件的路径 (例如 output.png)')
+    parser.add_argument('--format', choices=('text',) + MARKUP_FORMATS, default='text',
+                        help='文本输出的格式（text 纯文本/ANSI，html，svg，默认text）；批量模式下决定输出文件的扩展名')
+    parser.add_argument('-f', '--font-size', type=int, default=10,
+                        help='保存图片时的字体大小（默认10）')
+    parser.add_argument('--font', default=None,
+                        help='保存图片时使用的等宽字体文件（默认环境变量 ASCII_ART_FONT 或系统等宽字体）')
+    parser.add_argument('--png-palette', choices=PALETTE_MODES, default='auto',
+                        help='保存图片时的调色板模式（auto 颜色少的画布即灰度模式用256色调色板，几乎无损；'
+                             'always 彩色也用，有损；never 完整RGB；默认auto）')
+    parser.add_argument('--compression-level', type=int, choices=range(10), default=6, metavar='0-9',
+                        help='保存图片时的压缩级别（0最快，9最小，默认6）；.webp 保存为无损WebP')
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help='保存大图片时分带并行渲染的进程数（默认1，不分带）')
+    parser.add_argument('--save-img', nargs='?', const=True,
+                        help='保存为图片文件的路径 (例如 output.png)；批量模式下不带路径，表示同时生成 .png')
+    parser.add_argument('--output-dir', help='批量模式的输出目录（默认 ascii_output）')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='批量模式的并行进程数（默认CPU核数）')
+    parser.add_argument('--no-txt', action='store_true', help='批量模式下不生成 .txt（配合 --save-img）')
+    parser.add_argument('--force', action='store_true', help='批量模式下忽略清单，全部重新生成')
+    parser.add_argument('--no-animate', action='store_true', help='动画输入只转换第一帧')
+    parser.add_argument('--max-frames', type=int, default=None,
+                        help='动画最多转换的帧数（默认1000，可用 ASCII_ART_MAX_FRAMES 配置）')
+    parser.add_argument('--profile', action='store_true',
+                        help='结束时在标准错误打印各阶段耗时（解码、缩放、映射、绘制、编码等）；批量模式下汇总所有图片')
     
     args = parser.parse_args()
+    if args.color_step is None:
+        args.color_step = 1 if args.format == 'text' else MARKUP_COLOR_STEP
+    
+    # 多个输入、目录、通配符或指定了输出目录时进入批量模式
+    first = Path(args.image[0])
+    if len(args.image) > 1 or args.output_dir or first.is_dir() or (
+            glob.has_magic(args.image[0]) and not first.exists()):
+        sys.exit(_bulk_main(args))
+    args.image = args.image[0]
+    if args.save_img is True:
+        print("错误: --save-img 需要指定图片路径", file=sys.stderr)
+        sys.exit(1)
     
     # 检查输入文件是否存在
     if not Path(args.image).exists():
         print(f"错误: 找不到图片文件 '{args.image}'", file=sys.stderr)
         sys.exit(1)
     
-    # 创建生成器
-    generator = ASCIIArtGenerator(char_set=args.charset, invert=args.invert)
+    # 创建生成器（空字符集等无效参数在这里报错）
+    try:
+        generator = ASCIIArtGenerator(char_set=args.charset, invert=args.invert, render_workers=args.render_workers,
+                                      encoder=ImageEncoder(args.png_palette, args.compression_level),
+                                      font_path=args.font)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        sys.exit(1)
     
+    # --profile：记录各阶段耗时，结束时打印到标准错误
+    timer = None
     try:
-        # 转换图片
-        color_mode = 'color' if args.color else 'gray'
-        
-        # 如果指定了保存图片
-        if args.save_img:
-            generator.save_as_image(
+        with timing(enabled=args.profile) as timer:
+            # 转换图片
+            color_mode = 'color' if args.color else 'gray'
+            
+            # 动画输入：转换所有帧（HTML/SVG 只转换第一帧）
+            if not args.no_animate and args.format == 'text' and is_animated(open_image(args.image)):
+                _animation_main(args, generator, color_mode)
+                return
+            
+            # 文本网格和图片网格的单元格比例不同，但只解码一次
+            shapes = [(args.height, 0.55 if args.format == 'text' else MARKUP_CELL_RATIO)]
+            if args.save_img:
+                font = generator._get_font(args.font_size)
+                shapes.append((None, generator.image_cell_ratio(font)))
+            grids = generator.make_grids(
                 args.image,
-                args.save_img,
-                width=args.width,
-                color_mode=color_mode,
+                args.width,
+                shapes,
                 brightness=args.brightness,
-                contrast=args.contrast
+                contrast=args.contrast,
+                color=color_mode == 'color'
             )
-        
-        # 正常的文本输出逻辑
-        ascii_art = generator.image_to_ascii(
-            args.image,
-            width=args.width,
-            height=args.height,
-            color_mode=color_mode,
-            brightness=args.brightness,
-            contrast=args.contrast
-        )
-        
-        # 输出结果
-        if args.output:
-            generator.save_to_file(ascii_art, args.output)
-        elif not args.save_img: # 如果只保存图片，就不打印到控制台了，除非没指定输出文件
-            print(ascii_art)
-        elif args.save_img and not args.output:
-             # 如果保存了图片但没指定文本输出，还是打印一下文本预览
-             print(ascii_art)
+            
+            # 如果指定了保存图片
+            if args.save_img:
+                encoded = generator.save_canvas(generator.render_grid(grids[1], font, color_mode), args.save_img)
+                print(f"ASCII图片已保存到: {args.save_img}{_encoded_summary(encoded)}")
+            
+            # 正常的文本输出逻辑：逐行生成，边生成边输出
+            if args.format == 'text':
+                rows = generator.export_rows(grids[0], color_mode, args.ansi_palette, args.color_step)
+            else:
+                rows = generator.export_markup(grids[0], args.format, color_mode, args.font_size,
+                                               color_step=args.color_step)
+            
+            # 输出结果（保存了图片但没指定文本输出时，也打印文本预览）
+            if args.output:
+                generator.save_to_file(rows, args.output)
+            else:
+                for line in rows:
+                    print(line)
+                sys.stdout.flush()
     
+    except BrokenPipeError:
+        # 输出管道提前关闭（如 | head）：静默退出，标准输出指向 devnull，解释器退出时的刷新不再报错
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
     except Exception as e:
         print(f"错误: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if timer is not None:
+            print(f"阶段耗时: {format_timings(timer.as_dict())}", file=sys.stderr)
+
+
+def _encoded_summary(encoded):
+    """保存图片时附加的编码信息：格式、是否使用调色板、体积和编码耗时"""
+    if encoded is None:
+        return ''
+    palette = ' 调色板' if encoded.palette else ''
+    return (f"（{encoded.format.upper()}{palette}，{len(encoded.data) / 1024:.1f} KB，"
+            f"编码 {encoded.seconds * 1000:.1f} ms）")
+
+
+def _animation_main(args, generator, color_mode):
+    """动画模式：保存为动画图片，和/或输出帧间增量编码的ANSI帧流"""
+    if args.save_img:
+        suffix = Path(args.save_img).suffix.lower()
+        fmt = {'.png': 'png', '.apng': 'png', '.gif': 'gif'}.get(suffix)
+        if fmt is None:
+            raise ValueError(f"动画只能保存为 .png（APNG）或 .gif，不支持 '{suffix}'")
+        frames = generator.render_animation(
+            args.image, args.save_img, fmt=fmt, width=args.width, color_mode=color_mode,
+            brightness=args.brightness, contrast=args.contrast, font_size=args.font_size,
+            max_frames=args.max_frames, workers=args.render_workers
+        )
+        print(f"ASCII动画已保存到: {args.save_img}（{frames} 帧）")
+    
+    stream = generator.ascii_animation(
+        args.image, width=args.width, height=args.height, color_mode=color_mode,
+        brightness=args.brightness, contrast=args.contrast, ansi_palette=args.ansi_palette,
+        color_step=args.color_step, max_frames=args.max_frames
+    )
+    if args.output:
+        # 帧流直接写入文件，不在内存中拼接
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for text, _ in stream:
+                f.write(text)
+        print(f"ASCII动画已保存到: {args.output}")
+        return
+    
+    # 输出到终端时按帧时长播放；重定向到管道或文件时直接写出
+    play = sys.stdout.isatty()
+    try:
+        for text, duration in stream:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            if play:
+                time.sleep(duration / 1000)
+    except KeyboardInterrupt:
+        sys.stdout.write('\033[0m\n')
+    sys.stdout.write('\n')
+
+
+def _bulk_main(args):
+    """批量模式入口，返回进程退出码"""
+    if args.output:
+        print("错误: 批量模式请使用 --output-dir 指定输出目录", file=sys.stderr)
+        return 1
+    if args.save_img not in (None, True):
+        print("错误: 批量模式下 --save-img 不接受路径，图片写入 --output-dir", file=sys.stderr)
+        return 1
+    write_image = args.save_img is True
+    if args.no_txt and not write_image:
+        print("错误: --no-txt 需要配合 --save-img 使用", file=sys.stderr)
+        return 1
+    
+    images, missing = collect_images(args.image)
+    for pattern in missing:
+        print(f"警告: 没有匹配的图片 '{pattern}'", file=sys.stderr)
+    if not images:
+        print("错误: 没有找到任何图片", file=sys.stderr)
+        return 1
+    
+    try:
+        # 提前检查字符集和字体，避免每个任务都报同样的错误
+        ASCIIArtGenerator(char_set=args.charset, invert=args.invert)
+        if args.font:
+            font_registry(args.font).resolve()
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    
+    options = {
+        'charset': args.charset,
+        'invert': args.invert,
+        'width': args.width,
+        'height': args.height,
+        'color_mode': 'color' if args.color else 'gray',
+        'brightness': args.brightness,
+        'contrast': args.contrast,
+        'ansi_palette': args.ansi_palette,
+        'color_step': args.color_step,
+        'font_size': args.font_size,
+    }
+    if args.format != 'text':
+        # 纯文本不写入参数，升级前的清单仍然有效
+        options['format'] = args.format
+    if write_image:
+        # 编码参数只影响 .png；调色板编码改变了输出，升级前生成的 .png 会重新生成
+        options['png_palette'] = args.png_palette
+        options['compression_level'] = args.compression_level
+        if args.font:
+            options['font'] = args.font
+    summary = run_bulk(
+        images, args.output_dir or 'ascii_output', options, jobs=args.jobs,
+        write_text=not args.no_txt, write_image=write_image, force=args.force, profile=args.profile
+    )
+    wall = summary['wall_seconds']
+    print(f"完成: 转换 {summary['converted']} 张，跳过 {summary['skipped']} 张，失败 {summary['failed']} 张")
+    print(f"耗时 {wall:.2f} 秒，吞吐 {summary['images_per_second']:.1f} 张/秒，"
+          f"CPU时间合计 {summary['cpu_seconds']:.2f} 秒（平均并行度 {summary['cpu_seconds'] / wall if wall else 0:.1f}）")
+    if args.profile:
+        print("各阶段耗时（所有工作进程合计）:")
+        for name, totals in summary['stages'].items():
+            size = f"，{totals['bytes'] / 1024 / 1024:.1f} MB" if totals['bytes'] is not None else ''
+            print(f"  {name:<8} {totals['seconds']:8.2f} 秒，{totals['count']} 张，"
+                  f"平均 {totals['seconds'] / totals['count'] * 1000:.1f} 毫秒{size}")
+    return 1 if summary['failed'] else 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Stage Metrics
+流水线各阶段的计时、直方图和 Prometheus 文本格式导出
+
+A conversion goes through these stages:
+
+- ``queue``: waiting for a worker pool slot (server)
+- ``download``: reading the input file or fetching the URL (server)
+- ``decode``: parsing the header and decoding the pixels (DCT-scaled for JPEG)
+- ``resize``: downsampling to the character grid
+- ``enhance``: brightness and contrast lookup tables
+- ``mapping``: building the AsciiGrid (glyph indices, luminance, colors)
+- ``export``: writing text, ANSI, HTML or SVG from the grid
+- ``draw``: compositing glyphs onto the canvas
+- ``encode``: PNG / WebP encoding (with output bytes)
+- ``upload``: storing the encoded image (with bytes, server)
+
+``timing()`` starts a StageTimer for the current context (a request, a CLI
+run, a worker job); code along the pipeline wraps its work in
+``stage(name)`` or calls ``record``, which cost one ``perf_counter`` pair
+when a timer is active and nothing otherwise. Worker processes return
+``timer.as_dict()`` with their result and the caller merges it into its own
+timer. StageMetrics accumulates finished timers into latency and size
+histograms and renders them in the Prometheus text exposition format.
+
+Timing is on by default; ``ASCII_ART_TIMING=0`` turns it off.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+STAGES = ('queue', 'download', 'decode', 'resize', 'enhance', 'mapping', 'export', 'draw', 'encode', 'upload')
+
+# 是否记录阶段耗时，可通过环境变量 ASCII_ART_TIMING=0 关闭
+TIMING_ENABLED = os.getenv('ASCII_ART_TIMING', '1') != '0'
+
+# 直方图的桶上限：耗时（秒）和数据量（字节）
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(10))  # 1 KB .. 256 MB
+
+_current_timer: ContextVar['StageTimer | None'] = ContextVar('ascii_art_stage_timer', default=None)
+
+
+class StageTimer:
+    """Seconds and bytes per stage for one request or run.
+
+    Stages entered several times (e.g. once per animation frame) accumulate.
+    """
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+        self.bytes: dict[str, int] = {}
+        self.total = 0.0
+
+    def add(self, name: str, seconds: float, nbytes: int | None = None) -> None:
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        if nbytes is not None:
+            self.bytes[name] = self.bytes.get(name, 0) + nbytes
+
+    def merge(self, timings: dict | None) -> None:
+        """Add the stages of ``as_dict()`` output, e.g. returned by a worker process."""
+        if not timings:
+            return
+        for name, seconds in timings['seconds'].items():
+            self.add(name, seconds, timings['bytes'].get(name))
+
+    @classmethod
+    def from_dict(cls, timings: dict) -> 'StageTimer':
+        """Rebuild a timer from ``as_dict()`` output."""
+        timer = cls()
+        timer.merge(timings)
+        timer.total = timings['total']
+        return timer
+
+    def as_dict(self) -> dict:
+        """Picklable snapshot: ``{'seconds': {...}, 'bytes': {...}, 'total': seconds}``."""
+        return {'seconds': dict(self.seconds), 'bytes': dict(self.bytes), 'total': self.total}
+
+
+class _Stage:
+    """Context manager adding the time spent inside it to a timer."""
+
+    __slots__ = ('timer', 'name', 'nbytes', 'start')
+
+    def __init__(self, timer: StageTimer, name: str):
+        self.timer = timer
+        self.name = name
+        self.nbytes = None
+
+    def __enter__(self) -> '_Stage':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.timer.add(self.name, time.perf_counter() - self.start, self.nbytes)
+
+
+class _NoStage:
+    """Shared no-op stage used when no timer is active."""
+
+    __slots__ = ()
+    nbytes = None
+
+    def __enter__(self) -> '_NoStage':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def __setattr__(self, name, value) -> None:
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """Time the enclosed block as stage ``name`` of the active timer.
+
+    Set ``.nbytes`` on the returned object inside the block to also record
+    the bytes the stage produced or transferred.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        return _NO_STAGE
+    return _Stage(timer, name)
+
+
+def record(name: str, seconds: float, nbytes: int | None = None) -> None:
+    """Add an already measured duration to the active timer, if any."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add(name, seconds, nbytes)
+
+
+def merge_timings(timings: dict | None) -> None:
+    """Add ``StageTimer.as_dict()`` output (e.g. from a worker process) to the active timer, if any."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.merge(timings)
+
+
+def timed(name: str, iterable):
+    """Wrap a lazy iterable so the time spent producing its items counts as stage ``name``.
+
+    Only the iterable's own work is timed, not what the consumer does between
+    items (e.g. writing each row to a file). Returns the iterable unchanged
+    when no timer is active.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        return iterable
+    return _timed_items(timer, name, iter(iterable))
+
+
+def _timed_items(timer: StageTimer, name: str, iterator):
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                return
+            elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        timer.add(name, elapsed)
+
+
+def current_timer() -> StageTimer | None:
+    """Return the active timer of this context, or None."""
+    return _current_timer.get()
+
+
+@contextmanager
+def timing(metrics: 'StageMetrics | None' = None, enabled: bool | None = None):
+    """Activate a new StageTimer for the enclosed block and yield it.
+
+    Yields None when timing is disabled. On exit the timer's total is set and,
+    if ``metrics`` is given, the timer is added to its histograms (also when
+    the block raised, so failed requests show up in the latency).
+    """
+    if enabled is None:
+        enabled = TIMING_ENABLED
+    if not enabled:
+        yield None
+        return
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.total = time.perf_counter() - start
+        _current_timer.reset(token)
+        if metrics is not None:
+            metrics.observe(timer)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yield ``(upper_bound_label, cumulative_count)`` including ``+Inf``."""
+        running = 0
+        for bound, count in zip(self.buckets + (None,), self.counts):
+            running += count
+            yield ('+Inf' if bound is None else f'{bound:g}'), running
+
+
+class StageMetrics:
+    """Latency and size histograms per stage, accumulated across requests (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds: dict[str, Histogram] = {}
+        self.stage_bytes: dict[str, Histogram] = {}
+        self.request_seconds = Histogram(SECONDS_BUCKETS)
+
+    def observe(self, timer: StageTimer) -> None:
+        """Add one finished request (or run) to the histograms."""
+        with self._lock:
+            for name, seconds in timer.seconds.items():
+                self.stage_seconds.setdefault(name, Histogram(SECONDS_BUCKETS)).observe(seconds)
+            for name, nbytes in timer.bytes.items():
+                self.stage_bytes.setdefault(name, Histogram(BYTES_BUCKETS)).observe(nbytes)
+            self.request_seconds.observe(timer.total)
+
+    def summary(self) -> dict:
+        """Per stage count, total seconds and bytes: ``{stage: {'count', 'seconds', 'bytes'}}``."""
+        with self._lock:
+            return {
+                name: {
+                    'count': histogram.count,
+                    'seconds': histogram.sum,
+                    'bytes': int(self.stage_bytes[name].sum) if name in self.stage_bytes else None,
+                }
+                for name, histogram in _in_stage_order(self.stage_seconds)
+            }
+
+    def prometheus(self, prefix: str = 'ascii_art') -> str:
+        """Render all histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            _histogram_lines(lines, f'{prefix}_stage_seconds', 'Time spent in each pipeline stage per request.',
+                             _in_stage_order(self.stage_seconds), 'stage')
+            _histogram_lines(lines, f'{prefix}_stage_bytes', 'Bytes produced or transferred by a stage per request.',
+                             _in_stage_order(self.stage_bytes), 'stage')
+            _histogram_lines(lines, f'{prefix}_request_seconds', 'Total time per request.',
+                             [(None, self.request_seconds)], None)
+        return '\n'.join(lines) + '\n'
+
+
+def _in_stage_order(histograms: dict) -> list:
+    """Known stages in pipeline order, then any others alphabetically."""
+    order = {name: index for index, name in enumerate(STAGES)}
+    return sorted(histograms.items(), key=lambda item: (order.get(item[0], len(STAGES)), item[0]))
+
+
+def _histogram_lines(lines: list, metric: str, help_text: str, histograms, label: str | None) -> None:
+    lines.append(f'# HELP {metric} {help_text}')
+    lines.append(f'# TYPE {metric} histogram')
+    for value, histogram in histograms:
+        labels = f'{label}="{value}",' if label else ''
+        for bound, count in histogram.cumulative():
+            lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {count}')
+        suffix = f'{{{labels.rstrip(",")}}}' if label else ''
+        lines.append(f'{metric}_sum{suffix} {histogram.sum:g}')
+        lines.append(f'{metric}_count{suffix} {histogram.count}')
+
+
+def format_timings(timings: dict, separator: str = ' · ') -> str:
+    """One-line summary of ``StageTimer.as_dict()``: ms per stage, bytes where known, then the total."""
+    order = {name: index for index, name in enumerate(STAGES)}
+    parts = []
+    for name in sorted(timings['seconds'], key=lambda name: (order.get(name, len(STAGES)), name)):
+        part = f"{name} {timings['seconds'][name] * 1000:.1f} ms"
+        if name in timings['bytes']:
+            part += f" ({timings['bytes'][name] / 1024:.1f} KB)"
+        parts.append(part)
+    parts.append(f"total {timings['total'] * 1000:.1f} ms")
+    return separator.join(parts)
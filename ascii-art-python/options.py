@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Options
+字符集与输出格式的取值，只依赖标准库
+
+The MCP server validates parameters and builds cache keys before anything
+is rendered, and with worker processes it never renders at all. Keeping the
+charset presets and format names here lets it do that without importing
+numpy and Pillow, which only load where images are actually processed.
+"""
+
+
+# 内置字符集（从暗到亮）
+CHAR_SETS = {
+    'simple': ' .:-=+*#%@',
+    'detailed': ' .\'"`,^:;Il!i><~+_-?][}{1)(|\\/tfjrxnuvczXYUJCLQ0OZmwqpdbkhao*#MW&8%B@$',
+    'blocks': ' ░▒▓█',
+    'minimal': ' .-+*@',
+    'numbers': ' 123456789',
+}
+
+# 渲染为图片后上传的格式，与内联返回的文档格式
+IMAGE_FORMATS = ('png', 'webp')
+MARKUP_FORMATS = ('html', 'svg')
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+
+
+def resolve_charset(char_set: str, invert: bool = False) -> str:
+    """
+    把字符集名称或自定义字符串解析为实际使用的字符（从暗到亮）
+
+    Args:
+        char_set: CHAR_SETS 中的名称，或自定义字符集字符串
+        invert: 是否反转字符顺序（亮度映射）
+
+    Raises:
+        ValueError: 字符集为空
+    """
+    chars = CHAR_SETS.get(char_set, char_set)
+    if not chars:
+        raise ValueError("字符集不能为空")
+    return chars[::-1] if invert else chars
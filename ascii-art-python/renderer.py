@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Renderer
+基于字形图集（glyph atlas）的ASCII艺术图片渲染器
+
+Every glyph of a charset is rasterized once per (font, size) into alpha
+masks. A canvas is then built for the whole character grid in a few bulk
+passes (gather masks, tint, paste) instead of calling ``ImageDraw.text``
+once per cell.
+
+Very large canvases can be split into horizontal bands of character rows
+that are composited in worker processes and written straight into one
+shared-memory canvas.
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from fonts import cell_size, font_key
+from grid import AsciiGrid
+
+
+# 默认颜色（模拟 VS Code 深色主题）
+DEFAULT_BG_COLOR = (40, 44, 52)
+DEFAULT_TEXT_COLOR = (171, 178, 191)
+
+# 彩色模式下字符的最低亮度，保证在深色背景上可见
+MIN_COLOR_BRIGHTNESS = 80
+
+_ATLAS_CACHE_SIZE = 32
+_atlas_cache: OrderedDict = OrderedDict()
+_atlas_lock = threading.Lock()
+
+# 画布小于该像素数时不分带（进程间传递的开销大于并行收益）
+BAND_MIN_PIXELS = 4_000_000
+# 分带渲染的进程数，可通过环境变量 ASCII_ART_RENDER_WORKERS 配置（1 = 不分带）
+RENDER_WORKERS = int(os.getenv('ASCII_ART_RENDER_WORKERS', 1))
+
+_render_pools: dict[int, ProcessPoolExecutor] = {}
+_render_pools_lock = threading.Lock()
+
+
+def font_cell_size(font) -> tuple[int, int]:
+    """Return the (width, height) of one character cell, measured on 'M' (cached per font and size)."""
+    return cell_size(font)
+
+
+class GlyphAtlas:
+    """Alpha masks for every glyph of a charset at one font and size.
+
+    Each glyph is drawn into a 3x3-cell tile centred on its own cell, so parts
+    that spill up to one cell into a neighbouring cell (descenders, wide or overhanging
+    glyphs) are kept just like ``ImageDraw.text`` would draw them. The tile is
+    split into ``parts``: one entry per neighbour offset that any glyph
+    reaches, cropped to the area actually inked, and sorted in the order in
+    which row-major ``draw.text`` calls overdraw that neighbour.
+    """
+
+    def __init__(self, font, chars: str):
+        self.chars = chars
+        self.cell_width, self.cell_height = font_cell_size(font)
+        if self.cell_width <= 0 or self.cell_height <= 0:
+            raise ValueError("Font has an empty 'M' glyph, cannot size character cells")
+        cw, ch = self.cell_width, self.cell_height
+
+        tiles = np.zeros((len(chars), ch * 3, cw * 3), dtype=np.uint8)
+        for i, glyph in enumerate(chars):
+            if glyph == ' ':
+                # 空格不绘制，保持背景色
+                continue
+            tile = Image.new('L', (cw * 3, ch * 3), 0)
+            ImageDraw.Draw(tile).text((cw, ch), glyph, font=font, fill=255)
+            tiles[i] = np.asarray(tile)
+
+        # 目标单元格相对来源单元格的偏移为 (dy, dx)；来源越早绘制越靠前
+        self.parts = []
+        offsets = sorted(
+            ((dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)),
+            key=lambda offset: (-offset[0], -offset[1])
+        )
+        for dy, dx in offsets:
+            block = tiles[:, (dy + 1) * ch:(dy + 2) * ch, (dx + 1) * cw:(dx + 2) * cw]
+            inked_rows = np.flatnonzero(block.any(axis=(0, 2)))
+            inked_cols = np.flatnonzero(block.any(axis=(0, 1)))
+            if (dy, dx) != (0, 0) and not inked_rows.size:
+                continue
+            if (dy, dx) == (0, 0):
+                y0, y1, x0, x1 = 0, ch, 0, cw
+            else:
+                y0, y1 = inked_rows[0], inked_rows[-1] + 1
+                x0, x1 = inked_cols[0], inked_cols[-1] + 1
+            masks = np.ascontiguousarray(block[:, y0:y1, x0:x1])
+            self.parts.append((dy, dx, (slice(y0, y1), slice(x0, x1)), masks))
+
+
+def get_atlas(font, chars: str) -> GlyphAtlas:
+    """Return the cached atlas for (font, chars), building it on first use."""
+    key = (font_key(font), chars)
+    with _atlas_lock:
+        atlas = _atlas_cache.get(key)
+        if atlas is not None:
+            _atlas_cache.move_to_end(key)
+            return atlas
+
+    atlas = GlyphAtlas(font, chars)
+    with _atlas_lock:
+        _atlas_cache[key] = atlas
+        while len(_atlas_cache) > _ATLAS_CACHE_SIZE:
+            _atlas_cache.popitem(last=False)
+    return atlas
+
+
+def gray_ink_colors(gray: np.ndarray, text_color) -> np.ndarray:
+    """Per-cell ink colors for gray mode: brighter cells get brighter text."""
+    table = np.array([
+        [int(c * (0.3 + 0.7 * (value / 255.0))) for c in text_color]
+        for value in range(256)
+    ], dtype=np.uint8)
+    return table[gray]
+
+
+def color_ink_colors(rgb: np.ndarray) -> np.ndarray:
+    """Per-cell ink colors for color mode: source colors lifted to a minimum brightness."""
+    rgb = rgb.astype(np.float64)
+    total = rgb.sum(axis=-1, keepdims=True)
+    factor = (MIN_COLOR_BRIGHTNESS * 3) / np.maximum(total, 1)
+    boosted = np.minimum(255, np.floor(rgb * factor))
+    return np.where(total < MIN_COLOR_BRIGHTNESS * 3, boosted, rgb).astype(np.uint8)
+
+
+def _offset_slices(offset: int) -> tuple[slice, slice]:
+    """Return (target, source) cell slices along one axis for a neighbour offset."""
+    if offset > 0:
+        return slice(offset, None), slice(None, -offset)
+    if offset < 0:
+        return slice(None, offset), slice(-offset, None)
+    return slice(None), slice(None)
+
+
+def composite(atlas: GlyphAtlas, glyphs: np.ndarray, inks: np.ndarray, bg_color) -> Image.Image:
+    """Build the canvas for a grid of glyph indices and per-cell ink colors.
+
+    Every atlas part is gathered into one full-canvas alpha mask and pasted
+    with the matching ink colors in a single call, in the atlas' overdraw
+    order, so the result matches the per-character renderer pixel for pixel.
+
+    Args:
+        atlas: Glyph atlas for the charset and font
+        glyphs: ``(rows, cols)`` uint8 array of indices into ``atlas.chars``
+        inks: ``(rows, cols, 3)`` uint8 array of ink colors
+        bg_color: Background RGB tuple
+
+    Returns:
+        RGB canvas of ``cols * cell_width`` by ``rows * cell_height`` pixels
+    """
+    rows, cols = glyphs.shape
+    cw, ch = atlas.cell_width, atlas.cell_height
+    canvas = Image.new('RGB', (cols * cw, rows * ch), tuple(bg_color))
+    if glyphs.size == 0:
+        return canvas
+
+    for dy, dx, (y_part, x_part), masks in atlas.parts:
+        target_rows, source_rows = _offset_slices(dy)
+        target_cols, source_cols = _offset_slices(dx)
+        part_glyphs = glyphs[source_rows, source_cols]
+        if part_glyphs.size == 0:
+            continue
+        # 收集每个单元格的遮罩，排成与画布一致的 (行, 像素行, 列, 像素列) 布局
+        gathered = masks[part_glyphs].transpose(0, 2, 1, 3)
+        if not gathered.any():
+            continue
+        if (dy, dx) == (0, 0):
+            alpha = gathered
+            ink_grid = inks
+        else:
+            alpha = np.zeros((rows, ch, cols, cw), dtype=np.uint8)
+            alpha[target_rows, y_part, target_cols, x_part] = gathered
+            ink_grid = np.zeros_like(inks)
+            ink_grid[target_rows, target_cols] = inks[source_rows, source_cols]
+
+        # 每个单元格的颜色放大到像素，再按遮罩混合（与 draw.text 相同的取整方式）
+        ink = Image.fromarray(ink_grid, 'RGB').resize(canvas.size, Image.NEAREST)
+        mask = Image.fromarray(np.ascontiguousarray(alpha).reshape(rows * ch, cols * cw), 'L')
+        canvas.paste(ink, (0, 0), mask)
+
+    return canvas
+
+
+def render_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the shared rendering process pool of a given size, starting it on first use.
+
+    Used for band rendering and for rendering animation frames in parallel.
+    """
+    with _render_pools_lock:
+        pool = _render_pools.get(workers)
+        if pool is None:
+            if not _render_pools:
+                # 在工作进程中（例如服务器的渲染进程）退出时会等待所有子进程，
+                # 需要先关闭进程池，否则空闲的渲染进程会让退出一直阻塞；
+                # 优先级高于队列的清理（10），保证结束信号还能发出去
+                util.Finalize(None, shutdown_render_pools, exitpriority=100)
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _render_pools[workers] = pool
+        return pool
+
+
+def shutdown_render_pools() -> None:
+    """Stop all rendering worker processes."""
+    with _render_pools_lock:
+        pools = list(_render_pools.values())
+        _render_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+
+def _composite_band(atlas: GlyphAtlas, glyphs: np.ndarray, inks: np.ndarray, bg_color, top: int, rows: int,
+                    shm_name: str, canvas_shape: tuple, first_row: int) -> None:
+    """Composite one band in a worker and copy its rows into the shared canvas.
+
+    ``glyphs``/``inks`` hold the band's rows plus up to one context row above
+    and below; ``top`` is the index of the band's first own row in them.
+    """
+    band = np.asarray(composite(atlas, glyphs, inks, bg_color))
+    ch = atlas.cell_height
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        canvas = np.ndarray(canvas_shape, dtype=np.uint8, buffer=shm.buf)
+        canvas[first_row * ch:(first_row + rows) * ch] = band[top * ch:(top + rows) * ch]
+        del canvas
+    finally:
+        shm.close()
+
+
+def composite_bands(atlas: GlyphAtlas, glyphs: np.ndarray, inks: np.ndarray, bg_color,
+                    workers: int) -> Image.Image:
+    """Composite a grid in horizontal bands across worker processes.
+
+    Glyphs reach at most one cell into neighbouring rows, so each band is
+    rendered with one extra context row above and below and then cropped to
+    its own rows. Every pixel therefore sees the same glyphs in the same
+    overdraw order as in ``composite`` and the result is identical.
+
+    Args:
+        atlas: Glyph atlas for the charset and font
+        glyphs: ``(rows, cols)`` uint8 array of indices into ``atlas.chars``
+        inks: ``(rows, cols, 3)`` uint8 array of ink colors
+        bg_color: Background RGB tuple
+        workers: Number of worker processes (and bands)
+
+    Returns:
+        RGB canvas, the same as ``composite`` would return
+    """
+    rows, cols = glyphs.shape
+    bands = min(workers, rows)
+    if bands <= 1:
+        return composite(atlas, glyphs, inks, bg_color)
+
+    cw, ch = atlas.cell_width, atlas.cell_height
+    canvas_shape = (rows * ch, cols * cw, 3)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(canvas_shape)))
+    try:
+        pool = render_pool(workers)
+        bounds = np.linspace(0, rows, bands + 1).astype(int)
+        futures = []
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            start, stop = max(first - 1, 0), min(last + 1, rows)
+            futures.append(pool.submit(
+                _composite_band, atlas, glyphs[start:stop], inks[start:stop], tuple(bg_color),
+                first - start, last - first, shm.name, canvas_shape, first
+            ))
+        for future in futures:
+            future.result()
+        canvas = np.ndarray(canvas_shape, dtype=np.uint8, buffer=shm.buf)
+        image = Image.fromarray(canvas, 'RGB')
+        del canvas
+        return image
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def render_grid(grid: AsciiGrid, font, color_mode: str = 'gray', bg_color=None, text_color=None,
+                workers: int | None = None) -> Image.Image:
+    """Render a character grid to an image.
+
+    Args:
+        grid: Cell data; needs colors for color mode
+        font: PIL font used to draw the glyphs
+        color_mode: 'gray' or 'color'
+        bg_color: Background color, defaults to the VS Code dark theme
+        text_color: Base text color for gray mode
+        workers: Processes for band rendering of large canvases (default RENDER_WORKERS)
+
+    Returns:
+        RGB canvas image
+    """
+    if bg_color is None:
+        bg_color = DEFAULT_BG_COLOR
+    if text_color is None:
+        text_color = DEFAULT_TEXT_COLOR
+
+    atlas = get_atlas(font, grid.chars)
+    if color_mode == 'color':
+        if grid.rgb is None:
+            raise ValueError("color rendering needs a grid built with colors")
+        inks = color_ink_colors(grid.rgb)
+    else:
+        inks = gray_ink_colors(grid.luma, text_color)
+
+    if workers is None:
+        workers = RENDER_WORKERS
+    if workers > 1 and grid.glyphs.size * atlas.cell_width * atlas.cell_height >= BAND_MIN_PIXELS:
+        return composite_bands(atlas, grid.glyphs, inks, bg_color, workers)
+    return composite(atlas, grid.glyphs, inks, bg_color)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Request Coalescing
+相同的并发请求只执行一次，其余请求等待同一个结果
+
+When several clients send the same request at the same moment, the result
+cache cannot help: none of them has finished yet, so each one downloads,
+renders and uploads the same image. SingleFlight keys every request (the
+server uses the normalized parameters plus the input identity) and lets
+only the first caller for a key start the work. Callers arriving while it
+runs await the same task and receive the same result, or the same
+exception. Once the task finishes the key is forgotten; later requests go
+through the result cache as usual.
+
+The work runs in its own task and every caller awaits it through
+``asyncio.shield``, so a caller that is cancelled (e.g. the client that
+started it disconnects) does not cancel the work for the others.
+
+Coalescing is on by default; ``ASCII_ART_COALESCE=0`` turns it off.
+"""
+
+import asyncio
+import os
+from collections.abc import Awaitable, Callable, Hashable
+from typing import TypeVar
+
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with equal keys into one execution.
+
+    Args:
+        enabled: When False every call runs on its own (counters still count
+            executions)
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.failed_waiters = 0
+
+    @classmethod
+    def from_env(cls) -> 'SingleFlight':
+        """Create the coalescer configured by ``ASCII_ART_COALESCE`` (default on)."""
+        return cls(enabled=os.getenv('ASCII_ART_COALESCE', '1') != '0')
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def running(self, key: Hashable | None) -> bool:
+        """Whether a call with ``key`` made now would join an execution in flight."""
+        return key is not None and self.enabled and key in self._tasks
+
+    async def run(self, key: Hashable | None, func: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """Await ``func()``, or the execution already running for ``key``.
+
+        Args:
+            key: Identity of the request; None never coalesces
+            func: Zero-argument coroutine function doing the work
+
+        Returns:
+            Tuple of (result, whether this call joined another call's execution)
+
+        Raises:
+            Exception: Whatever ``func()`` raised, in every caller that awaited it
+        """
+        if key is None or not self.enabled:
+            self.executed += 1
+            return await func(), False
+        task = self._tasks.get(key)
+        joined = task is not None
+        if joined:
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            task = asyncio.create_task(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        try:
+            return await asyncio.shield(task), joined
+        except Exception:
+            if joined:
+                self.failed_waiters += 1
+            raise
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # 取出异常，所有调用方都已离开时也不会出现 "exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+
+    def stats(self) -> dict:
+        """Executions started, calls that joined one, and failures shared with waiters."""
+        return {
+            'enabled': self.enabled,
+            'in_flight': self.in_flight,
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+            'failed_waiters': self.failed_waiters,
+        }
+
+    def prometheus(self, prefix: str = 'ascii_art') -> str:
+        """Render the counters in the Prometheus text exposition format."""
+        lines = []
+        for name, kind, help_text, value in (
+            ('requests_executed_total', 'counter', 'Requests that ran the conversion themselves.', self.executed),
+            ('requests_coalesced_total', 'counter',
+             'Requests that awaited an identical in-flight request instead of running it.', self.coalesced),
+            ('requests_coalesced_failed_total', 'counter',
+             'Coalesced requests that received the error of the request they joined.', self.failed_waiters),
+            ('requests_coalescing_in_flight', 'gauge', 'Distinct requests currently running.', self.in_flight),
+        ):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            lines.append(f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
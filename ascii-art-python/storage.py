@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Storage Backends
+生成图片的存储后端
+
+A backend stores one object and returns its public URL in a single call.
+Three implementations are provided:
+
+- SupabaseStorage talks to the Supabase Storage REST API over a shared,
+  connection-pooling ``httpx.AsyncClient`` and derives the public URL
+  locally instead of asking for it.
+- LocalStorage writes into a directory and returns ``file://`` URLs (or URLs
+  under a configured base URL), for offline use.
+- FakeStorageServer is an in-process HTTP server speaking the same subset of
+  the Supabase Storage API, so SupabaseStorage can be tested and load-tested
+  without a live project.
+
+Transient failures (connection errors, 408/429/5xx responses) are retried
+with exponential backoff.
+"""
+
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, unquote, urlparse
+
+import httpx
+
+
+# 可重试的HTTP状态码
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class StorageError(Exception):
+    """Raised when an object cannot be stored."""
+
+
+class RetryableStorageError(StorageError):
+    """A failure that may succeed when retried."""
+
+
+class StorageBackend(ABC):
+    """Base class: ``upload`` retries ``_upload_once`` with exponential backoff.
+
+    Subclasses implement ``_upload_once``; a backend without it cannot be
+    instantiated.
+
+    Args:
+        retries: Extra attempts after the first failed one
+        backoff: Delay before the first retry in seconds, doubled for each further retry
+    """
+
+    def __init__(self, retries: int = 3, backoff: float = 0.2):
+        self.retries = retries
+        self.backoff = backoff
+
+    async def upload(self, name: str, data: bytes, content_type: str = 'image/png') -> str:
+        """Store data under name, replacing any existing object, and return its public URL.
+
+        Raises:
+            StorageError: If the upload fails permanently or retries are exhausted
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._upload_once(name, data, content_type)
+            except RetryableStorageError:
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    @abstractmethod
+    async def _upload_once(self, name: str, data: bytes, content_type: str) -> str:
+        """Make one upload attempt and return the public URL.
+
+        Raises:
+            RetryableStorageError: For failures worth retrying (connection errors, 408/429/5xx)
+            StorageError: For permanent failures
+        """
+
+    async def aclose(self) -> None:
+        """Release pooled connections, if any."""
+
+
+class SupabaseStorage(StorageBackend):
+    """Supabase Storage bucket accessed through its REST API.
+
+    Args:
+        url: Project URL, e.g. ``https://xyz.supabase.co``
+        key: Service or anon key used as bearer token
+        bucket: Bucket name; it must be public for the returned URLs to work
+        timeout: Request timeout in seconds
+        max_connections: Connection pool size
+    """
+
+    def __init__(self, url: str, key: str, bucket: str, timeout: float = 30.0, max_connections: int = 20,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.url = url.rstrip('/')
+        self.key = key
+        self.bucket = bucket
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                headers={'Authorization': f'Bearer {self.key}', 'apikey': self.key},
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    def public_url(self, name: str) -> str:
+        """Return the public URL of an object; no request is made."""
+        return f"{self.url}/storage/v1/object/public/{self.bucket}/{quote(name)}"
+
+    async def _upload_once(self, name: str, data: bytes, content_type: str) -> str:
+        try:
+            response = await self.client.post(
+                f"{self.url}/storage/v1/object/{self.bucket}/{quote(name)}",
+                content=data,
+                headers={'Content-Type': content_type, 'x-upsert': 'true', 'Cache-Control': 'max-age=3600'},
+            )
+        except httpx.TransportError as e:
+            raise RetryableStorageError(f"Upload of {name} failed: {e}") from e
+        if response.status_code in RETRY_STATUS:
+            raise RetryableStorageError(f"Upload of {name} failed: HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise StorageError(f"Upload of {name} failed: HTTP {response.status_code} {response.text[:200]}")
+        return self.public_url(name)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class LocalStorage(StorageBackend):
+    """Objects written into a local directory.
+
+    Args:
+        directory: Target directory, created if missing
+        base_url: Prefix for returned URLs (e.g. a static file server);
+            defaults to ``file://`` URLs of the written files
+    """
+
+    def __init__(self, directory: str, base_url: str | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = Path(directory)
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    async def _upload_once(self, name: str, data: bytes, content_type: str) -> str:
+        path = self.directory / name
+        await asyncio.to_thread(self._write, path, data)
+        if self.base_url:
+            return f"{self.base_url}/{quote(name)}"
+        return path.resolve().as_uri()
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        # 先写临时文件再替换，读取方不会看到写了一半的图片
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+
+def storage_from_env() -> StorageBackend | None:
+    """Pick a backend from the environment.
+
+    ``ASCII_ART_STORAGE_URL=file:///some/dir`` (or a plain directory path)
+    selects LocalStorage; otherwise SUPABASE_URL and SUPABASE_KEY select
+    SupabaseStorage. Returns None when neither is configured.
+    """
+    storage_url = os.getenv('ASCII_ART_STORAGE_URL', '')
+    if storage_url:
+        parsed = urlparse(storage_url)
+        directory = unquote(parsed.path) if parsed.scheme == 'file' else storage_url
+        return LocalStorage(directory, base_url=os.getenv('ASCII_ART_STORAGE_BASE_URL') or None)
+
+    supabase_url = os.getenv('SUPABASE_URL', '')
+    supabase_key = os.getenv('SUPABASE_KEY', '')
+    if supabase_url and supabase_key:
+        return SupabaseStorage(supabase_url, supabase_key, os.getenv('SUPABASE_BUCKET', 'ascii-art-images'))
+    return None
+
+
+class _FakeStorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和正文分开写出，不关闭 Nagle 会叠加延迟确认的 40 ms
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            failing = server.fail_next > 0
+            if failing:
+                server.fail_next -= 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        prefix = '/storage/v1/object/'
+        if not self.path.startswith(prefix) or self.path.startswith(prefix + 'public/'):
+            return self._reply(404, {'error': 'not found'})
+        if server.key and self.headers.get('Authorization') != f'Bearer {server.key}':
+            return self._reply(403, {'error': 'unauthorized'})
+        if failing:
+            return self._reply(503, {'error': 'injected failure'})
+        object_path = unquote(self.path[len(prefix):])
+        with server.lock:
+            if object_path in server.objects and self.headers.get('x-upsert') != 'true':
+                return self._reply(409, {'error': 'duplicate'})
+            server.objects[object_path] = body
+        self._reply(200, {'Key': object_path})
+
+    do_PUT = do_POST
+
+    def do_GET(self):
+        prefix = '/storage/v1/object/public/'
+        data = self.server.objects.get(unquote(self.path[len(prefix):])) if self.path.startswith(prefix) else None
+        if data is None:
+            return self._reply(404, {'error': 'not found'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeStorageServer:
+    """In-process stand-in for the Supabase Storage API, for tests and load tests.
+
+    Use as a context manager; ``url`` is the project URL to pass to
+    SupabaseStorage. Uploaded objects are kept in ``objects`` keyed by
+    ``bucket/name``.
+
+    Args:
+        key: Expected bearer token (None accepts any)
+        latency: Seconds added to every upload, to simulate a remote round trip
+    """
+
+    def __init__(self, key: str | None = None, latency: float = 0.0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeStorageHandler)
+        self._server.daemon_threads = True
+        self._server.key = key
+        self._server.latency = latency
+        self._server.objects = {}
+        self._server.requests = 0
+        self._server.connections = set()
+        self._server.fail_next = 0
+        self._server.lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def objects(self) -> dict:
+        return self._server.objects
+
+    @property
+    def requests(self) -> int:
+        """Number of upload requests received."""
+        return self._server.requests
+
+    @property
+    def connections(self) -> int:
+        """Number of distinct client connections that uploaded."""
+        return len(self._server.connections)
+
+    def fail_next(self, count: int) -> None:
+        """Answer the next ``count`` uploads with HTTP 503."""
+        with self._server.lock:
+            self._server.fail_next = count
+
+    def start(self) -> 'FakeStorageServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeStorageServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+测试动画输入：逐帧渲染的动画PNG/GIF与帧间增量编码的ANSI帧流
+"""
+
+import io
+import re
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from animation import ApngWriter, encode_frame
+from exporters import encode_ansi_delta
+from main import ASCIIArtGenerator
+
+
+def _make_animation(fmt='GIF', frames=6):
+    """小球从左向右移动的动画，只有小球附近的字符会变化"""
+    images = []
+    for i in range(frames):
+        im = Image.new('RGB', (240, 120), (20, 20, 60))
+        ImageDraw.Draw(im).ellipse((10 + i * 30, 30, 70 + i * 30, 90), fill=(250, 200, 40))
+        images.append(im)
+    buffer = io.BytesIO()
+    images[0].save(buffer, format=fmt, save_all=True, append_images=images[1:], duration=70, loop=0)
+    return buffer.getvalue(), images
+
+
+def _replay(stream, rows, cols):
+    """在虚拟终端上执行帧流（忽略颜色），返回每帧结束时的屏幕内容"""
+    screen = [[' '] * cols for _ in range(rows)]
+    screens = []
+    for text, _ in stream:
+        row = col = 0
+        for token in re.findall(r'\033\[(\d+);(\d+)H|\033\[[\d;]*[mJ]|(.)', text, re.S):
+            if token[0]:
+                row, col = int(token[0]) - 1, int(token[1]) - 1
+            elif token[2]:
+                screen[row][col] = token[2]
+                col += 1
+        screens.append('\n'.join(''.join(line) for line in screen))
+    return screens
+
+
+def test_apng_frames_match_still_renders():
+    data, images = _make_animation('GIF')
+    generator = ASCIIArtGenerator(char_set='blocks')
+    output = io.BytesIO()
+    assert generator.render_animation(data, output, fmt='png', width=30, color_mode='color', font_size=8) == 6
+
+    animation = Image.open(io.BytesIO(output.getvalue()))
+    assert animation.n_frames == 6 and animation.info['loop'] == 0
+    for index, frame in enumerate(images):
+        animation.seek(index)
+        assert animation.info['duration'] == 70
+        expected = generator.render_image(frame, width=30, color_mode='color', font_size=8)
+        assert np.array_equal(np.asarray(animation.convert('RGB')), np.asarray(expected))
+
+
+def test_parallel_frames_produce_identical_file():
+    data, _ = _make_animation('WEBP', frames=5)
+    generator = ASCIIArtGenerator()
+    serial, parallel = io.BytesIO(), io.BytesIO()
+    generator.render_animation(data, serial, width=24, workers=1)
+    generator.render_animation(data, parallel, width=24, workers=2)
+    assert serial.getvalue() == parallel.getvalue()
+
+
+def test_gif_output_and_frame_limit():
+    data, _ = _make_animation('GIF')
+    output = io.BytesIO()
+    ASCIIArtGenerator().render_animation(data, output, fmt='gif', width=20, max_frames=4)
+    animation = Image.open(io.BytesIO(output.getvalue()))
+    assert animation.format == 'GIF' and animation.n_frames == 4
+    animation.seek(3)
+    assert animation.info['duration'] == 70
+
+
+def test_apng_writer_rejects_frame_count_mismatch():
+    frame = encode_frame(Image.new('RGB', (4, 4)), 'png')
+    writer = ApngWriter(io.BytesIO(), frames=2)
+    writer.add_frame(frame, 100)
+    with pytest.raises(ValueError, match='declared 2 frames, got 1'):
+        writer.close()
+
+
+def test_ansi_stream_repaints_only_changed_cells():
+    data, images = _make_animation('GIF')
+    generator = ASCIIArtGenerator()
+    stream = list(generator.ascii_animation(data, width=40))
+    assert len(stream) == 7 and stream[-1] == ('\033[12;1H', 0)
+
+    # 每帧结束时屏幕内容与单独转换该帧的结果一致
+    screens = _replay(stream[:-1], 11, 40)
+    for screen, frame in zip(screens, images):
+        assert screen == generator.image_to_ascii(frame, width=40)
+
+    # 第一帧完整绘制，之后只重绘小球附近的字符
+    full = len(stream[0][0])
+    assert all(len(text) < full / 2 for text, _ in stream[1:-1])
+
+
+def test_ansi_stream_color_deltas():
+    data, images = _make_animation('GIF', frames=3)
+    generator = ASCIIArtGenerator()
+    stream = list(generator.ascii_animation(data, width=40, color_mode='color'))
+    screens = _replay(stream[:-1], 11, 40)
+    for screen, frame in zip(screens, images):
+        assert screen == generator.image_to_ascii(frame, width=40)
+    for text, _ in stream[1:-1]:
+        assert text.count('\033[') < stream[0][0].count('\033[') and text.endswith('\033[0m')
+
+
+def test_unchanged_frame_encodes_to_nothing():
+    rgb = np.zeros((2, 3, 3), dtype=np.uint8)
+    rgb[0, 0] = (255, 0, 0)
+    text, state = encode_ansi_delta('@ .#@ ', 3, rgb)
+    assert text.startswith('\033[2J\033[1;1H\033[38;2;255;0;0m@')
+    assert encode_ansi_delta('@ .#@ ', 3, rgb, state)[0] == ''
+    # 空格的颜色变化不可见，不需要重绘
+    rgb[0, 1] = (0, 255, 0)
+    assert encode_ansi_delta('@ .#@ ', 3, rgb, state)[0] == ''
+    text, _ = encode_ansi_delta('@ .#@#', 3, rgb, state)
+    assert text == '\033[2;3H\033[38;2;0;0;0m#\033[0m'
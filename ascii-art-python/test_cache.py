@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+测试结果缓存
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from PIL import Image
+
+from cache import GridCache, ResultCache, digest_bytes, make_key
+
+
+def test_key_depends_on_content_and_params():
+    params = {'width': 80, 'chars': ' .:'}
+    key = make_key(digest_bytes(b'image'), params)
+    assert key == make_key(digest_bytes(b'image'), dict(reversed(list(params.items()))))
+    assert key != make_key(digest_bytes(b'other'), params)
+    assert key != make_key(digest_bytes(b'image'), {**params, 'width': 81})
+
+
+def test_memory_lru_eviction():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', {'url': 'a'})
+    cache.put('b', {'url': 'b'})
+    assert cache.get('a') == {'url': 'a'}
+    cache.put('c', {'url': 'c'})
+    assert cache.get('b') is None
+    assert cache.get('a') == {'url': 'a'}
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_disabled_cache_never_hits():
+    cache = ResultCache(max_entries=0)
+    cache.put('a', {'url': 'a'})
+    assert cache.get('a') is None
+
+
+def test_ttl_expires_entries(monkeypatch):
+    cache = ResultCache(ttl_seconds=10)
+    cache.put('a', {'url': 'a'})
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert cache.get('a') is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    ResultCache(disk_dir=str(tmp_path)).put('a', {'url': 'a'})
+    restarted = ResultCache(disk_dir=str(tmp_path))
+    assert restarted.get('a') == {'url': 'a'}
+
+
+def test_async_disk_tier_runs_off_the_event_loop(tmp_path, monkeypatch):
+    cache = ResultCache(disk_dir=str(tmp_path))
+    threads = []
+    original = cache._disk_put
+
+    def disk_put(*args):
+        threads.append(threading.current_thread())
+        original(*args)
+
+    monkeypatch.setattr(cache, '_disk_put', disk_put)
+
+    async def scenario():
+        await cache.aput('a', {'url': 'a'})
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(scenario())
+    assert threads and threads[0] is not loop_thread
+    assert asyncio.run(ResultCache(disk_dir=str(tmp_path)).aget('a')) == {'url': 'a'}
+    # 只有内存层时直接在事件循环中查找
+    memory = ResultCache()
+    asyncio.run(memory.aput('b', {'url': 'b'}))
+    assert asyncio.run(memory.aget('b')) == {'url': 'b'}
+
+
+def test_disk_tier_size_eviction(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path), disk_max_bytes=400)
+    for i in range(10):
+        cache.put(f'key{i}', {'url': 'x' * 50})
+        # 保证修改时间递增，淘汰顺序确定
+        os.utime(tmp_path / f'key{i}.json', (i, i))
+    remaining = sorted(p.stem for p in tmp_path.glob('*.json'))
+    assert sum(p.stat().st_size for p in tmp_path.glob('*.json')) <= 400
+    assert 'key9' in remaining and 'key0' not in remaining
+
+
+def test_disk_tier_overwrite_keeps_size_accurate(tmp_path):
+    """覆盖同一个键不会重复计入磁盘占用"""
+    cache = ResultCache(disk_dir=str(tmp_path), disk_max_bytes=400)
+    for _ in range(10):
+        cache.put('same', {'url': 'x' * 50})
+    assert cache._disk_bytes == (tmp_path / 'same.json').stat().st_size
+    cache.put('other', {'url': 'y' * 50})
+    assert len(list(tmp_path.glob('*.json'))) == 2
+
+
+def test_grid_cache_memory_budget():
+    grid = Image.new('RGB', (10, 10))
+    cache = GridCache(max_bytes=650)
+    cache.put(('a', 10, 10), grid)
+    cache.put(('b', 10, 10), grid)
+    assert cache.get(('a', 10, 10)) is grid
+    cache.put(('c', 10, 10), grid)
+    assert cache.get(('b', 10, 10)) is None
+    stats = cache.stats()
+    assert stats == {'hits': 1, 'misses': 1, 'evictions': 1, 'entries': 2, 'bytes': 600, 'max_bytes': 650}
+
+
+def test_grid_cache_skips_oversized_grids():
+    cache = GridCache(max_bytes=10)
+    cache.put(('a', 10, 10), Image.new('L', (10, 10)))
+    assert cache.get(('a', 10, 10)) is None
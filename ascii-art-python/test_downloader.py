@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试图片下载器（使用本地HTTP服务器代替远程站点）
+"""
+
+import asyncio
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from downloader import DownloadError, ImageDownloader, sniff_image_type, url_basename
+
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / 'scan_test.jpg'
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """/image.jpg 返回示例图片；/huge 不带 Content-Length 持续输出；/fake 是伪装成图片的 HTML"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path == '/image.jpg':
+            self._send(SAMPLE_IMAGE.read_bytes(), 'image/jpeg')
+        elif self.path == '/fake.png':
+            self._send(b'<html><body>not an image</body></html>', 'image/png')
+        elif self.path == '/octet':
+            self._send(SAMPLE_IMAGE.read_bytes(), 'application/octet-stream')
+        elif self.path == '/declared-huge':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(1 << 40))
+            self.end_headers()
+        elif self.path == '/huge':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            chunk = b'\xff\xd8\xff' + b'\0' * (64 * 1024 - 3)
+            try:
+                for _ in range(1024):
+                    self.wfile.write(chunk)
+                    self.server.bytes_sent += len(chunk)
+            except OSError:
+                pass
+            self.close_connection = True
+        else:
+            self.send_error(404)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.connections = set()
+    server.bytes_sent = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def _fetch_all(downloader, urls):
+    async def scenario():
+        try:
+            return [await downloader.fetch(url) for url in urls]
+        finally:
+            await downloader.aclose()
+    return asyncio.run(scenario())
+
+
+def test_connections_are_reused(stand_in):
+    server, base = stand_in
+    results = _fetch_all(ImageDownloader(), [f'{base}/image.jpg'] * 5)
+    assert all(data == SAMPLE_IMAGE.read_bytes() for data, _ in results)
+    assert results[0][1] == 'image'
+    assert len(server.connections) == 1
+
+
+def test_type_is_sniffed_not_trusted(stand_in):
+    _, base = stand_in
+    with pytest.raises(DownloadError, match='does not point to a supported image'):
+        _fetch_all(ImageDownloader(), [f'{base}/fake.png'])
+    # 内容是图片时，即使 Content-Type 不对也接受
+    [(data, basename)] = _fetch_all(ImageDownloader(), [f'{base}/octet'])
+    assert sniff_image_type(data) == 'jpeg' and basename == 'octet'
+
+
+def test_download_is_returned_without_a_copy(stand_in):
+    from main import open_image
+
+    _, base = stand_in
+    [(data, _)] = _fetch_all(ImageDownloader(), [f'{base}/image.jpg'])
+    # 返回接收缓冲区本身；打开图片时也不再复制（解码器的像素缓冲区不在 tracemalloc 统计内）
+    assert isinstance(data, bytearray)
+    open_image(data).load()
+    tracemalloc.start()
+    try:
+        img = open_image(data)
+        img.load()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert img.tobytes() == open_image(SAMPLE_IMAGE.read_bytes()).tobytes()
+    assert peak < len(data)
+
+
+def test_declared_oversize_rejected_before_reading(stand_in):
+    _, base = stand_in
+    with pytest.raises(DownloadError, match='too large'):
+        _fetch_all(ImageDownloader(max_bytes=1024 * 1024), [f'{base}/declared-huge'])
+
+
+def test_streamed_oversize_aborts_with_bounded_memory(stand_in):
+    server, base = stand_in
+    limit = 2 * 1024 * 1024
+    downloader = ImageDownloader(max_bytes=limit)
+
+    async def scenario():
+        # 先完成一次下载，客户端和连接池的固定开销不计入峰值
+        await downloader.fetch(f'{base}/image.jpg')
+        tracemalloc.reset_peak()
+        with pytest.raises(DownloadError, match='exceeds'):
+            await downloader.fetch(f'{base}/huge')
+        await downloader.aclose()
+
+    tracemalloc.start()
+    try:
+        asyncio.run(scenario())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # 服务器准备发送 64 MB；客户端读到上限后即断开，内存峰值只与上限相关
+    # （缓冲区扩容时短暂存在两份，加上连接读缓冲）
+    assert peak < limit * 4
+    assert server.bytes_sent < 32 * 1024 * 1024
+
+
+def test_url_basename():
+    assert url_basename('https://example.com/a/photo%20one.jpg?x=1') == 'photo one'
+    assert url_basename('https://example.com/') == 'image'
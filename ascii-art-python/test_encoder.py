@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+测试图片编码器：调色板PNG、压缩级别、无损WebP和编码计数
+"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from encoder import ImageEncoder
+from main import ASCIIArtGenerator
+
+
+def _gradient(width=64, height=48):
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    y = np.linspace(0, 255, height, dtype=np.uint8)
+    data = np.stack([np.tile(x, (height, 1)), np.tile(y[:, None], (1, width)), np.full((height, width), 90, np.uint8)], 2)
+    return Image.fromarray(data, 'RGB')
+
+
+def _canvas(color_mode):
+    return ASCIIArtGenerator(char_set='detailed').render_image(_gradient(), width=48, color_mode=color_mode, font_size=8)
+
+
+def _decode(data):
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGB')).astype(int)
+
+
+def test_auto_palette_is_near_lossless_for_gray():
+    canvas = _canvas('gray')
+    rgb = ImageEncoder('never').encode(canvas)
+    paletted = ImageEncoder('auto').encode(canvas)
+    assert not rgb.palette and paletted.palette
+    assert len(paletted.data) < len(rgb.data)
+    assert np.abs(_decode(paletted.data) - np.asarray(canvas).astype(int)).max() <= 1
+
+
+def test_auto_palette_keeps_color_canvas_lossless():
+    canvas = _canvas('color')
+    encoded = ImageEncoder('auto').encode(canvas)
+    assert not encoded.palette
+    assert np.array_equal(_decode(encoded.data), np.asarray(canvas))
+    assert ImageEncoder('always').encode(canvas).palette
+
+
+@pytest.mark.parametrize('level', [0, 6, 9])
+def test_webp_is_lossless(level):
+    canvas = _canvas('color')
+    encoded = ImageEncoder('never', level).encode(canvas, 'webp')
+    assert encoded.mime_type == 'image/webp' and encoded.data[8:12] == b'WEBP'
+    assert np.array_equal(_decode(encoded.data), np.asarray(canvas))
+
+
+def test_compression_level_trades_size():
+    canvas = _canvas('gray')
+    assert len(ImageEncoder('never', 9).encode(canvas).data) < len(ImageEncoder('never', 0).encode(canvas).data)
+
+
+def test_stats_count_encodes():
+    encoder = ImageEncoder()
+    gray = encoder.encode(_canvas('gray'))
+    color = encoder.encode(_canvas('color'), 'webp')
+    stats = encoder.stats()
+    assert stats['encoded'] == 2 and stats['palette_encoded'] == 1
+    assert stats['bytes'] == len(gray.data) + len(color.data) and stats['seconds'] > 0
+
+
+def test_invalid_arguments(monkeypatch):
+    with pytest.raises(ValueError):
+        ImageEncoder(palette='sometimes')
+    with pytest.raises(ValueError):
+        ImageEncoder(compress_level=10)
+    with pytest.raises(ValueError):
+        ImageEncoder().encode(_canvas('gray'), 'jpeg')
+    monkeypatch.setenv('ASCII_ART_PNG_PALETTE', 'never')
+    monkeypatch.setenv('ASCII_ART_COMPRESSION_LEVEL', '2')
+    encoder = ImageEncoder.from_env()
+    assert (encoder.palette, encoder.compress_level) == ('never', 2)
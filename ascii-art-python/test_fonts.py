@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+测试字体注册表：查找顺序、只查找一次、按字号缓存字体和字形度量、离线时使用附带字体
+"""
+
+import pytest
+from PIL import Image, ImageFont
+
+import fonts
+import main
+from fonts import BUNDLED_FONT, FontRegistry, cell_size, font_registry, glyph_metrics
+from main import ASCIIArtGenerator
+from workers import warm_job
+
+
+@pytest.fixture
+def truetype_calls(monkeypatch):
+    """记录 ImageFont.truetype 的调用参数"""
+    calls = []
+    original = ImageFont.truetype
+
+    def truetype(font, size, *args, **kwargs):
+        calls.append((font, size))
+        return original(font, size, *args, **kwargs)
+
+    monkeypatch.setattr(ImageFont, 'truetype', truetype)
+    return calls
+
+
+def test_bundled_font_when_no_system_font(truetype_calls, capsys):
+    registry = FontRegistry(candidates=('NoSuchMono.ttf',))
+    font = registry.font(12)
+    assert registry.resolve() == str(BUNDLED_FONT)
+    # 附带字体是等宽的
+    assert font.getlength('i') == font.getlength('M') == font.getlength('█')
+    assert registry.font(12) is font
+    assert [size for name, size in truetype_calls if name == 'NoSuchMono.ttf'] == [10]
+    assert capsys.readouterr().err == ''
+
+
+def test_resolves_once_and_caches_per_size(truetype_calls):
+    registry = FontRegistry(candidates=('NoSuchMono.ttf',))
+    small = [registry.font(8) for _ in range(3)]
+    large = [registry.font(20) for _ in range(3)]
+    assert small[0] is small[2] and large[0] is large[2] and small[0] is not large[0]
+    # 一次探测（找不到）、一次确认附带字体，之后每个字号加载一次
+    assert len(truetype_calls) == 4
+    assert registry.stats() == {'font': str(BUNDLED_FONT), 'resolved': True, 'sizes': [8, 20]}
+
+
+def test_default_font_warns_once(capsys):
+    registry = FontRegistry(candidates=(), bundled=None)
+    assert registry.font(10) is registry.font(10)
+    registry.font(14)
+    assert registry.resolve() is None
+    assert capsys.readouterr().err.count('警告') == 1
+
+
+def test_configured_path_takes_precedence(monkeypatch, tmp_path):
+    monkeypatch.setattr(fonts, '_registries', {})
+    monkeypatch.setenv(fonts.FONT_ENV, str(BUNDLED_FONT))
+    registry = font_registry()
+    assert registry.resolve() == str(BUNDLED_FONT)
+    assert font_registry() is registry and font_registry(BUNDLED_FONT) is registry
+
+    broken = tmp_path / 'broken.ttf'
+    broken.write_bytes(b'not a font')
+    with pytest.raises(ValueError):
+        FontRegistry(broken).font(10)
+
+
+def test_glyph_metrics_are_cached(monkeypatch):
+    font = FontRegistry(candidates=()).font(16)
+    bbox = font.getbbox('M')
+    assert cell_size(font) == (bbox[2] - bbox[0], bbox[3] - bbox[1])
+    assert glyph_metrics(font, 'M').advance == font.getlength('M')
+
+    # 同一字体和字号的度量不再重新计算
+    monkeypatch.setattr(font, 'getbbox', lambda *args, **kwargs: pytest.fail('getbbox called again'))
+    assert cell_size(font) == (bbox[2] - bbox[0], bbox[3] - bbox[1])
+    assert cell_size(FontRegistry(candidates=()).font(16)) == cell_size(font)
+
+
+def test_generator_and_warm_job_share_the_registry(monkeypatch):
+    monkeypatch.setattr(fonts, '_registries', {})
+    monkeypatch.setenv(fonts.FONT_ENV, str(BUNDLED_FONT))
+    warm_job((9,))
+    assert font_registry().stats()['sizes'] == [9]
+    generator = ASCIIArtGenerator()
+    assert generator._get_font(9) is font_registry().font(9)
+    assert ASCIIArtGenerator(font_path=BUNDLED_FONT)._get_font(9) is generator._get_font(9)
+
+
+def test_cli_font_option(monkeypatch, tmp_path, capsys):
+    source = tmp_path / 'in.png'
+    Image.linear_gradient('L').save(source)
+    monkeypatch.setattr('sys.argv', ['main.py', str(source), '-w', '20', '--save-img', str(tmp_path / 'out.png'),
+                                     '--font', str(BUNDLED_FONT)])
+    main.main()
+    expected = ASCIIArtGenerator(font_path=BUNDLED_FONT).render_png(str(source), width=20)
+    assert (tmp_path / 'out.png').read_bytes() == expected
+
+    monkeypatch.setattr('sys.argv', ['main.py', str(source), '--save-img', str(tmp_path / 'bad.png'),
+                                     '--font', str(tmp_path / 'missing.ttf')])
+    with pytest.raises(SystemExit):
+        main.main()
+    assert '无法加载字体' in capsys.readouterr().err
+
+
+def test_bundled_font_is_package_data(monkeypatch):
+    """没有配置路径也没有系统字体时，使用作为包数据安装的附带字体"""
+    from importlib import resources
+    from pathlib import Path
+
+    monkeypatch.setattr(fonts, '_registries', {})
+    monkeypatch.delenv(fonts.FONT_ENV, raising=False)
+    monkeypatch.setattr(fonts, 'SYSTEM_FONTS', {name: ('NoSuchMono.ttf',) for name in fonts.SYSTEM_FONTS})
+    registry = font_registry()
+    assert registry.resolve() == str(BUNDLED_FONT)
+    assert registry.font(10).getlength('i') == registry.font(10).getlength('M')
+
+    packaged = resources.files('ascii_art_assets').joinpath('fonts').joinpath(BUNDLED_FONT.name)
+    assert packaged.is_file() and str(packaged) == str(BUNDLED_FONT)
+    # 构建配置把字体声明为包数据，安装后的副本同样带有字体
+    tomllib = pytest.importorskip('tomllib')
+    config = tomllib.loads((Path(fonts.__file__).parent / 'pyproject.toml').read_text(encoding='utf-8'))
+    setuptools = config['tool']['setuptools']
+    assert 'ascii_art_assets' in setuptools['packages']
+    assert any(Path('fonts', BUNDLED_FONT.name).match(pattern)
+               for pattern in setuptools['package-data']['ascii_art_assets'])
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+测试字符网格（AsciiGrid）：一次计算，文本、ANSI、HTML、SVG和PNG输出共用
+"""
+
+import html
+import io
+import pickle
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import main
+from exporters import MARKUP_CELL_RATIO, ansi_lines, html_lines, quantize_colors, svg_lines, text_lines
+from grid import AsciiGrid
+from main import ASCIIArtGenerator
+from renderer import color_ink_colors
+
+
+def _gradient(width=64, height=48):
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    y = np.linspace(0, 255, height, dtype=np.uint8)
+    data = np.stack([np.tile(x, (height, 1)), np.tile(y[:, None], (1, width)), np.full((height, width), 90, np.uint8)], 2)
+    return Image.fromarray(data, 'RGB')
+
+
+def _png_bytes(img):
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_grid_cells_and_text():
+    img = _gradient()
+    generator = ASCIIArtGenerator(char_set='simple')
+    grid = AsciiGrid.from_image(img, generator.chars)
+    assert (grid.rows, grid.cols) == (48, 64) and grid.rgb is None
+    assert grid.glyphs.dtype == np.uint8 and grid.nbytes == 2 * 48 * 64
+
+    luma = np.asarray(img.convert('L')).astype(int)
+    chars = generator.chars
+    expected = [''.join(chars[min(v * len(chars) // 256, len(chars) - 1)] for v in row) for row in luma]
+    assert list(text_lines(grid, block_rows=5)) == expected
+    assert grid.row_chars(3, 5) == ''.join(expected[3:5])
+
+
+def test_ansi_export_requires_colors():
+    grid = AsciiGrid.from_image(_gradient(8, 4), ASCIIArtGenerator().chars)
+    with pytest.raises(ValueError):
+        list(ansi_lines(grid))
+    colored = AsciiGrid.from_image(_gradient(8, 4), ASCIIArtGenerator().chars, color=True)
+    assert colored.nbytes == 5 * 8 * 4
+    assert len(list(ansi_lines(colored))) == 4
+
+
+def test_large_unicode_charset_fits_in_uint8():
+    chars = ''.join(chr(0x4e00 + i) for i in range(1000))
+    generator = ASCIIArtGenerator(char_set=chars)
+    img = _gradient()
+    grid = AsciiGrid.from_image(img, generator.chars)
+    assert len(grid.chars) <= 256
+    luma = np.asarray(img.convert('L')).astype(int)
+    expected = ''.join(chars[min(v * len(chars) // 256, len(chars) - 1)] for v in luma.ravel())
+    assert grid.row_chars() == expected
+
+
+def test_grid_pickles_compactly():
+    grid = AsciiGrid.from_image(_gradient(), ASCIIArtGenerator().chars, color=True)
+    data = pickle.dumps(grid)
+    assert len(data) < grid.nbytes + 1024
+    copy = pickle.loads(data)
+    assert copy.row_chars() == grid.row_chars() and np.array_equal(copy.rgb, grid.rgb)
+
+
+def test_make_grids_decodes_once(monkeypatch):
+    data = _png_bytes(_gradient(400, 300))
+    generator = ASCIIArtGenerator()
+    font = generator._get_font(8)
+    ratio = generator.image_cell_ratio(font)
+
+    opened = []
+    original = main.open_image
+    monkeypatch.setattr(main, 'open_image', lambda *a, **k: opened.append(1) or original(*a, **k))
+    text_grid, image_grid = generator.make_grids(data, 40, [(None, 0.55), (None, ratio)], color=True)
+    assert len(opened) == 1
+
+    assert '\n'.join(generator.export_rows(text_grid, 'color')) == \
+        generator.image_to_ascii(data, width=40, color_mode='color')
+    expected = generator.render_image(data, width=40, color_mode='color', font_size=8)
+    assert generator.render_grid(image_grid, font, 'color').tobytes() == expected.tobytes()
+
+
+def test_cli_text_and_image_share_one_decode(monkeypatch, tmp_path, capsys):
+    source = tmp_path / 'in.png'
+    _gradient(200, 150).save(source)
+    opened = []
+    original = main.open_image
+    monkeypatch.setattr(main, 'open_image', lambda *a, **k: opened.append(1) or original(*a, **k))
+    monkeypatch.setattr('sys.argv', ['main.py', str(source), '-w', '30', '--save-img', str(tmp_path / 'out.png'),
+                                     '--font-size', '8'])
+    main.main()
+    # 一次检查是否为动画，一次解码
+    assert len(opened) == 2
+
+    generator = ASCIIArtGenerator()
+    assert (tmp_path / 'out.png').read_bytes() == generator.render_png(str(source), width=30, font_size=8)
+    assert capsys.readouterr().out.endswith(generator.image_to_ascii(str(source), width=30) + '\n')
+
+
+def _html_cells(document):
+    """把HTML的 <pre> 内容还原为 [(字符, 颜色)] 行列表"""
+    styles = dict(re.findall(r'\.(c\d+)\{color:(#[0-9a-f]{6})\}', document))
+    body = document.split('<pre>\n', 1)[1].rsplit('\n</pre>', 1)[0]
+    rows = []
+    for line in body.split('\n'):
+        cells = []
+        for name, text, plain in re.findall(r'<i class=(c\d+)>(.*?)</i>|([^<]+)', line):
+            cells.extend((char, styles.get(name)) for char in html.unescape(text or plain))
+        rows.append(cells)
+    return rows
+
+
+def test_html_escapes_and_matches_text():
+    # 字符集包含HTML特殊字符
+    generator = ASCIIArtGenerator(char_set=' <&>"#')
+    grid = AsciiGrid.from_image(_gradient(), generator.chars)
+    document = '\n'.join(html_lines(grid, block_rows=5))
+    assert '&lt;' in document and '&amp;' in document
+    rows = _html_cells(document)
+    assert [''.join(char for char, _ in row) for row in rows] == list(text_lines(grid))
+
+
+@pytest.mark.parametrize('color_step', [1, 16])
+def test_html_color_runs_match_ink_colors(color_step):
+    grid = AsciiGrid.from_image(_gradient(), ASCIIArtGenerator(char_set='detailed').chars, color=True)
+    document = '\n'.join(html_lines(grid, 'color', color_step=color_step))
+    ink = quantize_colors(color_ink_colors(grid.rgb), color_step)
+    rows = _html_cells(document)
+    for row, (cells, line) in enumerate(zip(rows, text_lines(grid))):
+        assert ''.join(char for char, _ in cells) == line
+        for col, (char, color) in enumerate(cells):
+            if char != ' ':
+                assert color == '#{:02x}{:02x}{:02x}'.format(*ink[row, col])
+    if color_step > 1:
+        # 渐变图每个单元格颜色都不同，量化后相邻颜色合并为颜色段
+        assert document.count('<i ') < grid.rows * grid.cols / 3
+
+
+def test_svg_is_valid_and_matches_text():
+    grid = AsciiGrid.from_image(_gradient(), ASCIIArtGenerator(char_set=' <&>"#').chars, color=True)
+    root = ET.fromstring('\n'.join(svg_lines(grid, 'color', font_size=12)))
+    assert float(root.get('width')) == pytest.approx(grid.cols * 12 * MARKUP_CELL_RATIO)
+    assert float(root.get('height')) == grid.rows * 12
+    texts = root.findall('.//{http://www.w3.org/2000/svg}text')
+    assert [''.join(text.itertext()) for text in texts] == list(text_lines(grid))
+
+
+def test_markup_requires_colors_for_color_mode():
+    grid = AsciiGrid.from_image(_gradient(8, 4), ASCIIArtGenerator().chars)
+    with pytest.raises(ValueError):
+        list(html_lines(grid, 'color'))
+
+
+def test_cli_format_html(monkeypatch, tmp_path):
+    source = tmp_path / 'in.png'
+    _gradient(200, 150).save(source)
+    output = tmp_path / 'out.html'
+    monkeypatch.setattr('sys.argv', ['main.py', str(source), '-w', '30', '--color', '--format', 'html',
+                                     '-o', str(output)])
+    main.main()
+    expected = ASCIIArtGenerator().render_markup(str(source), 'html', width=30, color_mode='color')
+    assert output.read_text(encoding='utf-8') == expected
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+测试压力测试工具：百分位数、请求混合、结果汇总与比较，以及一次小规模的端到端运行
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+import loadtest
+from loadtest import build_workload, compare, percentile, summarize
+
+
+def test_percentile_interpolates_between_ranks():
+    samples = [0.4, 0.1, 0.3, 0.2]
+    assert percentile(samples, 0) == 0.1 and percentile(samples, 100) == 0.4
+    assert percentile(samples, 50) == pytest.approx(0.25)
+    assert percentile([0.7], 99) == 0.7
+    assert percentile([], 50) is None
+
+
+def test_workload_is_seeded_and_mixed():
+    images = [Path('/data/a.png'), Path('/data/b.jpg')]
+    workload = build_workload(images, 'http://127.0.0.1:9', 200, url_ratio=0.25, widths=(40, 60), seed=3)
+    assert workload == build_workload(images, 'http://127.0.0.1:9', 200, url_ratio=0.25, widths=(40, 60), seed=3)
+    assert workload != build_workload(images, 'http://127.0.0.1:9', 200, url_ratio=0.25, widths=(40, 60), seed=4)
+    urls = [request for request in workload if request['source'] == 'url']
+    assert 25 < len(urls) < 75
+    assert all(request['image_path'] in ('http://127.0.0.1:9/a.png', 'http://127.0.0.1:9/b.jpg') for request in urls)
+    assert {request['width'] for request in workload} == {40, 60}
+
+
+def test_summary_counts_errors_and_successful_throughput():
+    outcomes = [
+        {'source': 'path', 'latency': 0.1, 'error': None},
+        {'source': 'url', 'latency': 0.3, 'error': None},
+        {'source': 'url', 'latency': 0.01, 'error': '❌ Error: Server busy'},
+        {'source': 'url', 'latency': 0.01, 'error': '❌ Error: Server busy'},
+    ]
+    summary = summarize(outcomes, elapsed=2.0)
+    assert summary['errors'] == 2 and summary['error_rate'] == 0.5
+    assert summary['errors_by_message'] == {'❌ Error: Server busy': 2}
+    assert summary['throughput_rps'] == 1.0
+    assert summary['latency_ms']['max'] == 300.0
+    assert summary['latency_by_source_ms']['path']['count'] == 1
+
+
+def test_compare_marks_direction():
+    baseline = {'throughput_rps': 10.0, 'latency_ms': {'p50': 100.0, 'p95': 200.0, 'p99': 300.0},
+                'error_rate': 0.0, 'peak_rss_mb': {'total': None}}
+    current = {'throughput_rps': 12.0, 'latency_ms': {'p50': 120.0, 'p95': 200.0, 'p99': 300.0},
+               'error_rate': 0.0, 'peak_rss_mb': {'total': 150.0}}
+    lines = compare(baseline, current)
+    assert '+20.0%  better' in lines[0] and '+20.0%  worse' in lines[1]
+    assert lines[2].rstrip().endswith('+0.0%')
+    assert 'None' in lines[5]
+
+
+def test_small_run_end_to_end():
+    results = loadtest.run(clients=2, requests=6, url_ratio=0.5, widths=(20, 24), formats=('png', 'svg'),
+                           workers=1, seed=1, warmup=1, storage_latency=0.0)
+    assert results['requests'] == 6 and results['errors'] == 0, results['errors_by_message']
+    assert results['latency_ms']['p50'] > 0 and results['throughput_rps'] > 0
+    assert results['server_exit_code'] == 0
+    assert results['config']['workers'] == 1
+    # 合并的请求不会重复下载和上传，SVG 不上传
+    assert results['downloads'] <= results['latency_by_source_ms'].get('url', {'count': 0})['count']
+    assert results['uploads'] <= 6
+    assert results['server_stats']['coalescing']['executed'] >= 1
+    if results['peak_rss_mb']['total'] is not None:
+        assert results['peak_rss_mb']['total'] > results['peak_rss_mb']['server'] > 0
+    assert json.loads(json.dumps(results)) == results
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+测试ASCIIArtGenerator的核心转换逻辑
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageEnhance
+
+from main import REDUCING_GAP, ASCIIArtGenerator, apply_tone, collect_images, draft_for_grid, encode_png, run_bulk
+from renderer import DEFAULT_BG_COLOR, DEFAULT_TEXT_COLOR, composite, composite_bands, font_cell_size, get_atlas
+
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / "scan_test.jpg"
+
+
+def _gradient_image(width=64, height=48):
+    """生成覆盖全部灰度值的彩色渐变图"""
+    img = Image.new('RGB', (width, height))
+    img.putdata([
+        ((x * 4) % 256, (y * 5) % 256, (x * y) % 256)
+        for y in range(height) for x in range(width)
+    ])
+    return img
+
+
+def _reference_grayscale(chars, img, width):
+    """逐像素映射的参考实现（与查找表版本逐字节对比）"""
+    pixels = img.convert('L').tobytes()
+    char_count = len(chars)
+    ascii_str = ''.join(chars[min(p * char_count // 256, char_count - 1)] for p in pixels)
+    return '\n'.join(ascii_str[i:i+width] for i in range(0, len(ascii_str), width))
+
+
+def _decode_ansi(text):
+    """解析ANSI文本，返回每个字符及其前景色 [(char, color), ...]"""
+    cells = []
+    color = None
+    i = 0
+    while i < len(text):
+        if text[i] == '\033':
+            end = text.index('m', i)
+            params = text[i+2:end].split(';')
+            if params == ['0']:
+                color = None
+            elif params[:2] == ['38', '2']:
+                color = tuple(int(p) for p in params[2:5])
+            elif params[:2] == ['38', '5']:
+                color = int(params[2])
+            i = end + 1
+        elif text[i] == '\n':
+            color = None
+            i += 1
+        else:
+            cells.append((text[i], color))
+            i += 1
+    return cells
+
+
+def _reference_canvas(chars, img, font, color_mode):
+    """逐字符调用 draw.text 的参考渲染"""
+    char_width, char_height = font_cell_size(font)
+    gray_pixels = img.convert('L').tobytes()
+    rgb = img.convert('RGB').tobytes()
+    canvas = Image.new('RGB', (img.width * char_width, img.height * char_height), DEFAULT_BG_COLOR)
+    draw = ImageDraw.Draw(canvas)
+    char_count = len(chars)
+    for idx, gray_val in enumerate(gray_pixels):
+        char = chars[min(gray_val * char_count // 256, char_count - 1)]
+        if char == ' ':
+            continue
+        if color_mode == 'color':
+            r, g, b = rgb[idx*3:idx*3+3]
+            if r + g + b < 240:
+                factor = 240 / max(r + g + b, 1)
+                r, g, b = min(255, int(r * factor)), min(255, int(g * factor)), min(255, int(b * factor))
+            color = (r, g, b)
+        else:
+            color = tuple(int(c * (0.3 + 0.7 * (gray_val / 255.0))) for c in DEFAULT_TEXT_COLOR)
+        draw.text(((idx % img.width) * char_width, (idx // img.width) * char_height), char, font=font, fill=color)
+    return canvas
+
+
+@pytest.mark.parametrize('charset', list(ASCIIArtGenerator.CHAR_SETS) + ['ab', '█x ·'])
+@pytest.mark.parametrize('invert', [False, True])
+def test_grayscale_lut_matches_reference(charset, invert):
+    generator = ASCIIArtGenerator(char_set=charset, invert=invert)
+    img = _gradient_image()
+    expected = _reference_grayscale(generator.chars, img, img.width)
+    assert generator._create_grayscale_ascii(img, img.width) == expected
+
+
+@pytest.mark.parametrize('charset', ['simple', 'blocks'])
+def test_colored_ansi_keeps_every_cell_color(charset):
+    generator = ASCIIArtGenerator(char_set=charset)
+    img = _gradient_image(32, 16)
+    art = generator._create_colored_ascii(img, img.width)
+    rgb = img.tobytes()
+
+    cells = _decode_ansi(art)
+    assert ''.join(char for char, _ in cells) == generator._create_grayscale_ascii(img, img.width).replace('\n', '')
+    for idx, (char, color) in enumerate(cells):
+        if char != ' ':
+            assert color == tuple(rgb[idx*3:idx*3+3])
+    # 没有逐字符的重置序列，每行只在末尾重置一次
+    assert art.count('\033[0m') == img.height
+
+
+def test_colored_ansi_coalesces_runs():
+    generator = ASCIIArtGenerator(char_set='simple')
+    img = Image.new('RGB', (40, 4), (200, 30, 30))
+    art = generator._create_colored_ascii(img, img.width)
+    assert art.count('\033[38;2;200;30;30m') == img.height
+
+
+def test_colored_ansi_256_palette():
+    generator = ASCIIArtGenerator(char_set='simple')
+    img = Image.new('RGB', (10, 2), (255, 0, 0))
+    art = generator._create_colored_ascii(img, img.width, ansi_palette='256')
+    assert {color for _, color in _decode_ansi(art)} == {196}
+
+
+@pytest.mark.parametrize('color_mode', ['gray', 'color'])
+def test_streamed_rows_match_whole_string(monkeypatch, color_mode):
+    generator = ASCIIArtGenerator(char_set='detailed')
+    expected = generator.image_to_ascii(SAMPLE_IMAGE, width=60, color_mode=color_mode, color_step=8)
+    # 块大小不能整除行数，覆盖块边界和最后一个不完整的块
+    monkeypatch.setattr('main.STREAM_ROW_BLOCK', 7)
+    rows = generator.iter_ascii_rows(SAMPLE_IMAGE, width=60, color_mode=color_mode, color_step=8)
+    first = next(rows)
+    assert [first] + list(rows) == expected.split('\n')
+    assert len(expected.split('\n')) % 7 != 0
+
+
+def test_save_to_file_streams_rows(tmp_path):
+    generator = ASCIIArtGenerator()
+    expected = generator.image_to_ascii(SAMPLE_IMAGE, width=30)
+    generator.save_to_file(generator.iter_ascii_rows(SAMPLE_IMAGE, width=30), tmp_path / 'art.txt')
+    assert (tmp_path / 'art.txt').read_text(encoding='utf-8') == expected
+
+
+@pytest.mark.parametrize('charset', ['detailed', 'blocks'])
+@pytest.mark.parametrize('color_mode', ['gray', 'color'])
+@pytest.mark.parametrize('font_size', [10, 17])
+def test_atlas_canvas_matches_draw_text(charset, color_mode, font_size):
+    generator = ASCIIArtGenerator(char_set=charset)
+    font = generator._get_font(font_size)
+    img = _gradient_image(24, 12)
+    expected = _reference_canvas(generator.chars, img, font, color_mode)
+    canvas = generator._render_canvas(img, font, color_mode)
+    assert canvas.size == expected.size
+    assert np.array_equal(np.asarray(canvas), np.asarray(expected))
+
+
+def test_image_to_ascii_dimensions():
+    generator = ASCIIArtGenerator()
+    art = generator.image_to_ascii(str(SAMPLE_IMAGE), width=40, height=20)
+    lines = art.split('\n')
+    assert len(lines) == 20
+    assert all(len(line) == 40 for line in lines)
+
+
+def test_render_png_accepts_bytes_and_images():
+    generator = ASCIIArtGenerator()
+    data = SAMPLE_IMAGE.read_bytes()
+    from_path = generator.render_png(str(SAMPLE_IMAGE), width=30)
+    from_bytes = generator.render_png(data, width=30)
+    from_image = generator.render_png(Image.open(SAMPLE_IMAGE), width=30)
+    assert from_path == from_bytes == from_image
+    assert from_bytes.startswith(b'\x89PNG')
+    assert from_bytes == encode_png(generator.render_image(data, width=30))
+
+
+def test_pixel_ceiling_rejects_before_decode():
+    generator = ASCIIArtGenerator(max_pixels=1000)
+    with pytest.raises(ValueError, match='图片过大'):
+        generator.image_to_ascii(str(SAMPLE_IMAGE), width=20)
+
+
+def test_decode_ceiling_applies_after_draft():
+    # JPEG按目标尺寸解码后远小于原图，小网格可以通过较低的内存上限
+    full_bytes = 1279 * 1706 * 3
+    generator = ASCIIArtGenerator(max_decode_bytes=full_bytes // 4)
+    assert generator.image_to_ascii(str(SAMPLE_IMAGE), width=20)
+    with pytest.raises(ValueError, match='MB'):
+        generator.render_image(str(SAMPLE_IMAGE), width=1000)
+
+
+def test_draft_decode_matches_full_decode():
+    generator = ASCIIArtGenerator()
+    full = Image.open(SAMPLE_IMAGE).convert('RGB').resize((80, 58)).convert('L')
+    drafted = Image.open(SAMPLE_IMAGE)
+    drafted = draft_for_grid(drafted, (80, 58)).resize((80, 58), reducing_gap=REDUCING_GAP).convert('L')
+    diff = np.abs(np.asarray(full, dtype=np.int16) - np.asarray(drafted, dtype=np.int16))
+    assert diff.mean() < 2
+
+
+@pytest.mark.parametrize('brightness,contrast', [(1.3, 1.0), (0.7, 1.0), (1.0, 1.5), (1.2, 1.4), (0.8, 2.0)])
+def test_tone_lut_within_tolerance(brightness, contrast):
+    source = Image.open(SAMPLE_IMAGE)
+    small = source.resize((100, 73))
+
+    # 同一尺寸下与 ImageEnhance 相差不超过1个灰度级
+    enhanced = ImageEnhance.Contrast(ImageEnhance.Brightness(small).enhance(brightness)).enhance(contrast)
+    toned = apply_tone(small, brightness, contrast)
+    assert np.abs(np.asarray(enhanced, dtype=np.int16) - np.asarray(toned, dtype=np.int16)).max() <= 1
+
+    # 与先在原图上调整再缩放相比，平均误差小于1个灰度级
+    full = ImageEnhance.Contrast(ImageEnhance.Brightness(source).enhance(brightness)).enhance(contrast)
+    legacy = np.asarray(full.resize((100, 73)).convert('L'), dtype=np.int16)
+    assert np.abs(legacy - np.asarray(toned.convert('L'), dtype=np.int16)).mean() < 1
+
+
+def test_grid_cache_reused_across_retuning():
+    from cache import GridCache
+    grid_cache = GridCache()
+    data = SAMPLE_IMAGE.read_bytes()
+    for charset, invert, color_mode, brightness in [('simple', False, 'gray', 1.0), ('blocks', True, 'color', 1.3)]:
+        cached = ASCIIArtGenerator(char_set=charset, invert=invert, grid_cache=grid_cache)
+        plain = ASCIIArtGenerator(char_set=charset, invert=invert)
+        options = dict(width=40, color_mode=color_mode, brightness=brightness)
+        assert cached.render_png(data, **options) == plain.render_png(data, **options)
+        assert cached.image_to_ascii(data, **options) == plain.image_to_ascii(data, **options)
+    stats = grid_cache.stats()
+    assert stats['misses'] == 2  # 图片模式与文本模式的网格高度不同
+    assert stats['hits'] == 2
+
+
+def test_empty_charset_rejected():
+    with pytest.raises(ValueError):
+        ASCIIArtGenerator(char_set='')
+
+
+def test_cli_empty_charset_exits_with_message(monkeypatch, tmp_path, capsys):
+    import main
+
+    source = tmp_path / 'in.png'
+    _gradient_image().save(source)
+    monkeypatch.setattr('sys.argv', ['main.py', str(source), '-c', ''])
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().err.startswith('错误: ')
+
+
+def test_band_parallel_composite_identical():
+    generator = ASCIIArtGenerator(char_set='detailed')
+    atlas = get_atlas(generator._get_font(12), generator.chars)
+    rng = np.random.default_rng(1)
+    glyphs = rng.integers(0, len(generator.chars), (23, 17), dtype=np.uint8)
+    inks = rng.integers(0, 256, (23, 17, 3), dtype=np.uint8)
+    expected = composite(atlas, glyphs, inks, DEFAULT_BG_COLOR)
+    banded = composite_bands(atlas, glyphs, inks, DEFAULT_BG_COLOR, workers=3)
+    assert banded.size == expected.size
+    assert banded.tobytes() == expected.tobytes()
+
+
+BULK_OPTIONS = dict(charset='simple', invert=False, width=30, height=None, color_mode='gray',
+                    brightness=1.0, contrast=1.0, ansi_palette='truecolor', color_step=1)
+
+
+@pytest.mark.parametrize('fmt', ['text', 'html'])
+def test_bulk_text_and_image_decode_once(tmp_path, monkeypatch, fmt):
+    import main
+
+    opened = []
+    original = main.open_image
+
+    def counting_open(source, *args, **kwargs):
+        opened.append(source)
+        return original(source, *args, **kwargs)
+
+    monkeypatch.setattr(main, 'open_image', counting_open)
+    options = {**BULK_OPTIONS, 'format': fmt, 'color_step': 1}
+    summary = run_bulk([SAMPLE_IMAGE], tmp_path / 'out', options, jobs=1, write_image=True, log=lambda line: None)
+    assert summary['converted'] == 1
+    assert len(opened) == 1
+    # 输出与分别生成时一致
+    generator = ASCIIArtGenerator()
+    suffix = '.txt' if fmt == 'text' else '.html'
+    expected = (generator.image_to_ascii(str(SAMPLE_IMAGE), width=30) if fmt == 'text'
+                else generator.render_markup(str(SAMPLE_IMAGE), 'html', width=30, color_step=1))
+    assert (tmp_path / 'out' / f'scan_test{suffix}').read_text(encoding='utf-8') == expected
+    assert (tmp_path / 'out' / 'scan_test.png').read_bytes() == generator.render_png(str(SAMPLE_IMAGE), width=30)
+
+
+def test_bulk_mode_outputs_and_resume(tmp_path):
+    source_dir = tmp_path / 'in'
+    for sub in ('a', 'b'):
+        (source_dir / sub).mkdir(parents=True)
+        (source_dir / sub / 'scan.jpg').write_bytes(SAMPLE_IMAGE.read_bytes())
+    (source_dir / 'b' / 'broken.png').write_bytes(b'not an image')
+    (source_dir / 'b' / 'notes.txt').write_text('skip me')
+    images, missing = collect_images([str(source_dir), str(tmp_path / 'none' / '*.jpg')])
+    assert [p.name for p in images] == ['scan.jpg', 'broken.png', 'scan.jpg']
+    assert missing == [str(tmp_path / 'none' / '*.jpg')]
+
+    out = tmp_path / 'out'
+    logs = []
+    summary = run_bulk(images, out, BULK_OPTIONS, jobs=2, write_image=True, log=logs.append)
+    assert (summary['converted'], summary['skipped'], summary['failed']) == (2, 0, 1)
+    expected_text = ASCIIArtGenerator().image_to_ascii(str(SAMPLE_IMAGE), width=30)
+    # 不同目录下的同名图片分别输出
+    assert (out / 'a' / 'scan.txt').read_text(encoding='utf-8') == expected_text
+    assert (out / 'b' / 'scan.png').read_bytes() == ASCIIArtGenerator().render_png(str(SAMPLE_IMAGE), width=30)
+    assert any('broken.png' in line for line in logs)
+
+    # 续传：已完成的跳过，失败的重试
+    summary = run_bulk(images, out, BULK_OPTIONS, jobs=2, write_image=True, log=logs.append)
+    assert (summary['converted'], summary['skipped'], summary['failed']) == (0, 2, 1)
+    # 参数变化或输出被删除时重新生成
+    (out / 'a' / 'scan.png').unlink()
+    summary = run_bulk(images, out, {**BULK_OPTIONS, 'width': 31}, jobs=1, write_image=True, log=logs.append)
+    assert (summary['converted'], summary['skipped']) == (2, 0)
+    assert (out / 'a' / 'scan.png').exists()
+
+
+def test_cli_stops_quietly_when_the_pipe_closes():
+    import subprocess
+    import sys
+
+    # 彩色输出远大于管道缓冲区，读取方读完第一行就关闭
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve().parent / 'main.py'), str(SAMPLE_IMAGE), '-w', '400', '--color'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdout.readline()
+    process.stdout.close()
+    assert process.wait(timeout=60) == 0
+    assert process.stderr.read() == b''
@@ -1,137 +1,175 @@
 #!/usr/bin/env python3
 """
-测试ASCII Art MCP Server的工具
+测试ASCII Art MCP Server的工具（逐个调用，使用本地存储）
 """
 
 import asyncio
-from ascii_art_server import generate_ascii_art, generate_ascii_image
+import threading
+import time
 from pathlib import Path
 
+import pytest
+from PIL import Image
 
-async def test_ascii_art():
-    """测试文本ASCII艺术生成"""
-    print("=" * 60)
-    print("测试 1: 生成文本ASCII艺术（使用绝对路径）")
-    print("=" * 60)
-    
-    # 获取绝对路径
-    abs_path = Path("scan_test.jpg").absolute()
-    
-    result = await generate_ascii_art(
-        image_path=str(abs_path),
-        width=80,
-        charset="simple"
-    )
-    
-    print(result)
-    print()
-
-
-async def test_ascii_image():
-    """测试图片ASCII艺术生成"""
-    print("=" * 60)
-    print("测试 2: 生成ASCII艺术图片（使用绝对路径）")
-    print("=" * 60)
-    
-    # 获取绝对路径
-    abs_path = Path("scan_test.jpg").absolute()
-    
-    result = await generate_ascii_image(
-        image_path=str(abs_path),
-        width=100,
-        charset="detailed",
-        color_mode="gray"
-    )
-    
-    print(result)
-    print()
-
-
-async def test_custom_output():
-    """测试自定义输出文件名（同目录）"""
-    print("=" * 60)
-    print("测试 3: 自定义输出文件名")
-    print("=" * 60)
-    
-    # 获取绝对路径
-    abs_path = Path("scan_test.jpg").absolute()
-    
-    result_txt = await generate_ascii_art(
-        image_path=str(abs_path),
-        output_path="custom_output.txt",  # 只提供文件名
-        width=60,
-        charset="blocks"
-    )
-    print(result_txt)
-    
-    result_img = await generate_ascii_image(
-        image_path=str(abs_path),
-        output_path="custom_output.png",  # 只提供文件名
-        width=80,
-        charset="minimal"
-    )
-    print(result_img)
-    print()
-
-
-async def test_path_restrictions():
-    """测试路径限制"""
-    print("=" * 60)
-    print("测试 4: 路径限制验证")
-    print("=" * 60)
-    
-    # 测试相对路径（应该失败）
-    print("4.1 测试相对路径（应该被拒绝）：")
-    result = await generate_ascii_art(
-        image_path="scan_test.jpg",  # 相对路径
-        width=50
-    )
-    print(result)
-    print()
-    
-    # 测试输出路径包含目录（应该失败）
-    print("4.2 测试输出路径包含目录（应该被拒绝）：")
-    abs_path = Path("scan_test.jpg").absolute()
-    result = await generate_ascii_image(
-        image_path=str(abs_path),
-        output_path="output/test.png",  # 包含路径
-        width=50
-    )
-    print(result)
-    print()
-
-
-async def main():
-    """运行所有测试"""
-    # 检查测试图片是否存在
-    if not Path("scan_test.jpg").exists():
-        print("错误: 找不到 scan_test.jpg 测试图片")
-        print("请确保 scan_test.jpg 在当前目录中")
-        return
-    
-    print("\n开始测试 ASCII Art MCP Server\n")
-    
-    await test_ascii_art()
-    await test_ascii_image()
-    await test_custom_output()
-    await test_path_restrictions()
-    
-    print("=" * 60)
-    print("所有测试完成！")
-    print("=" * 60)
-    print("\n生成的文件（在 scan_test.jpg 同目录下）：")
-    print("- scan_test_ascii.txt")
-    print("- scan_test_ascii.png")
-    print("- custom_output.txt")
-    print("- custom_output.png")
-    print("\n路径限制：")
-    print("✅ 输入必须是绝对路径")
-    print("✅ 输出只能是文件名，会保存在输入图片的同一目录")
-    print("\n下一步:")
-    print("1. 配置 Claude Desktop (参考 claude_config_example.md)")
-    print("2. 重启 Claude Desktop")
-    print("3. 在 Claude 中测试工具")
-
-
-if __name__ == "__main__":
-    asyncio.run(main())
+import ascii_art_server as server
+import workers
+from cache import ResultCache
+from singleflight import SingleFlight
+from storage import LocalStorage
+from workers import WorkerPool
+
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / 'scan_test.jpg'
+
+
+@pytest.fixture
+def local_server(monkeypatch, tmp_path):
+    """线程模式的工作池，结果写入临时目录"""
+    monkeypatch.setattr(server, 'worker_pool', WorkerPool(workers=0))
+    monkeypatch.setattr(server, 'result_cache', ResultCache(max_entries=16))
+    monkeypatch.setattr(server, 'inflight', SingleFlight())
+    monkeypatch.setattr(server, 'storage', LocalStorage(str(tmp_path / 'store')))
+    monkeypatch.setattr(server, 'render_config', None)
+    return tmp_path / 'store'
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    if SAMPLE_IMAGE.exists():
+        return SAMPLE_IMAGE
+    path = tmp_path / 'scan_test.png'
+    Image.linear_gradient('L').resize((320, 240)).save(path)
+    return path
+
+
+def test_ascii_image(local_server, image_file):
+    """生成ASCII艺术图片（使用绝对路径），重复请求命中缓存"""
+    message = asyncio.run(server.generate_ascii_image(str(image_file), width=100, charset='detailed'))
+    assert message.startswith('✅') and 'Cache: miss' in message
+    [stored] = local_server.iterdir()
+    assert stored.suffix == '.png' and stored.as_uri() in message
+
+    again = asyncio.run(server.generate_ascii_image(str(image_file), width=100, charset='detailed'))
+    assert 'Cache: hit' in again and len(list(local_server.iterdir())) == 1
+
+
+def test_encoder_config_in_cache_key(local_server, image_file, monkeypatch):
+    """编码器配置改变后（如重启），不再返回旧配置生成的缓存图片"""
+    first = asyncio.run(server.generate_ascii_image(str(image_file), width=80))
+    assert 'Cache: miss' in first
+    monkeypatch.setenv('ASCII_ART_COMPRESSION_LEVEL', '1')
+    monkeypatch.setattr(workers, '_image_encoder', None)
+    monkeypatch.setattr(server, 'render_config', None)
+    again = asyncio.run(server.generate_ascii_image(str(image_file), width=80))
+    assert 'Cache: miss' in again and len(list(local_server.iterdir())) == 2
+    assert server.render_config['compress_level'] == 1 and server.render_config['font']['face']
+
+
+def test_inline_markup(local_server, image_file):
+    """HTML/SVG 直接返回文档，不上传"""
+    message = asyncio.run(server.generate_ascii_image(str(image_file), width=60, output_format='svg'))
+    assert message.startswith('✅') and '<svg' in message
+    assert not local_server.exists() or not any(local_server.iterdir())
+
+
+def test_batch(local_server, image_file):
+    message = asyncio.run(server.generate_ascii_batch(
+        [str(image_file), {'image_path': str(image_file), 'width': 40, 'charset': 'blocks'}], width=60))
+    assert '2 of 2 images converted' in message
+    assert len(list(local_server.iterdir())) == 2
+
+
+def test_batch_item_overrides(local_server, image_file):
+    """条目里的选项覆盖共享选项，其他条目不受影响"""
+    message = asyncio.run(server.generate_ascii_batch(
+        [str(image_file), {'image_path': str(image_file), 'width': 40, 'charset': 'blocks', 'output_format': 'svg'}],
+        width=60))
+    first, second = message.split('\n2. ')
+    assert '2 of 2 images converted' in first and '🌐' in first
+    assert second.startswith('✅') and '40×' in second and '<svg' in second and '█' in second
+    # 只有共享选项的 PNG 被上传
+    assert len(list(local_server.iterdir())) == 1
+
+
+def test_batch_partial_failure(local_server, image_file):
+    """未知选项、相对路径和不存在的文件只让各自的条目失败"""
+    message = asyncio.run(server.generate_ascii_batch([
+        str(image_file),
+        {'image_path': str(image_file), 'colour': 'red'},
+        'scan_test.jpg',
+        '/nonexistent/scan_test.jpg',
+        {'image_path': str(image_file), 'width': 30},
+    ], width=50))
+    summary, *entries = message.split('\n')
+    assert summary.startswith('⚠️') and '2 of 5 images converted, 3 failed' in summary
+    assert '2. ❌' in message and 'Error: Unknown options: colour' in message
+    assert '3. ❌ scan_test.jpg\n   Error: Only absolute paths are allowed' in message
+    assert '4. ❌ /nonexistent/scan_test.jpg\n   Error: Image file not found' in message
+    assert '1. ✅' in message and '5. ✅' in message
+    assert len(list(local_server.iterdir())) == 2
+
+
+class _Concurrency:
+    """记录同时进行的调用数的峰值"""
+
+    def __init__(self):
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.active -= 1
+
+
+def test_batch_stage_limits(local_server, tmp_path, monkeypatch):
+    """下载、渲染和上传各自不超过批处理的并发上限"""
+    downloads, renders, uploads = _Concurrency(), _Concurrency(), _Concurrency()
+    load_source, render_job = server.load_source, server.render_job
+
+    async def tracked_load(image_path):
+        with downloads:
+            await asyncio.sleep(0.02)
+            return await load_source(image_path)
+
+    def tracked_render(*args):
+        with renders:
+            time.sleep(0.02)
+            return render_job(*args)
+
+    class TrackedStorage(LocalStorage):
+        async def _upload_once(self, name, data, content_type):
+            with uploads:
+                # 上传比渲染慢，不限流时会重叠
+                await asyncio.sleep(0.1)
+                return await super()._upload_once(name, data, content_type)
+
+    monkeypatch.setattr(server, 'BATCH_DOWNLOADS', 2)
+    monkeypatch.setattr(server, 'BATCH_UPLOADS', 1)
+    monkeypatch.setattr(server, 'load_source', tracked_load)
+    monkeypatch.setattr(server, 'render_job', tracked_render)
+    monkeypatch.setattr(server, 'storage', TrackedStorage(str(local_server)))
+    # 内容不同的输入，避免被缓存或合并
+    paths = []
+    for i in range(6):
+        path = tmp_path / f'input{i}.png'
+        Image.linear_gradient('L').resize((64 + i * 8, 48)).save(path)
+        paths.append(str(path))
+
+    message = asyncio.run(server.generate_ascii_batch(paths, width=20))
+    assert '6 of 6 images converted' in message
+    assert (downloads.peak, renders.peak, uploads.peak) == (2, 1, 1)
+
+
+def test_path_restrictions(local_server):
+    """相对路径、不存在的文件和不支持的格式被拒绝"""
+    relative = asyncio.run(server.generate_ascii_image('scan_test.jpg', width=50))
+    assert relative.startswith('❌ Error: Only absolute paths are allowed')
+    missing = asyncio.run(server.generate_ascii_image(str(Path('/nonexistent/scan_test.jpg')), width=50))
+    assert missing.startswith('❌ Error: Image file not found')
+    unsupported = asyncio.run(server.generate_ascii_image(str(SAMPLE_IMAGE), output_format='bmp'))
+    assert unsupported.startswith("❌ Error: Unsupported output_format 'bmp'")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试阶段计时：计时器、直方图与 Prometheus 文本格式、生成器和工作进程中的阶段、--profile
+"""
+
+import io
+import re
+
+import pytest
+from PIL import Image
+
+import main
+from main import ASCIIArtGenerator, run_bulk
+from metrics import StageMetrics, StageTimer, format_timings, merge_timings, stage, timed, timing
+from workers import markup_job, render_job
+
+
+def _png_bytes(width=320, height=240):
+    buffer = io.BytesIO()
+    Image.linear_gradient('L').resize((width, height)).convert('RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_stages_accumulate_and_merge():
+    with timing(enabled=True) as timer:
+        for _ in range(3):
+            with stage('decode'):
+                pass
+        with stage('upload') as uploading:
+            uploading.nbytes = 100
+        merge_timings({'seconds': {'draw': 0.5, 'encode': 0.25}, 'bytes': {'encode': 40}, 'total': 1.0})
+        rows = list(timed('export', iter(['a', 'b'])))
+    assert rows == ['a', 'b']
+    assert set(timer.seconds) == {'decode', 'upload', 'draw', 'encode', 'export'}
+    assert timer.bytes == {'upload': 100, 'encode': 40}
+    assert timer.seconds['draw'] == 0.5 and timer.total > 0
+    assert StageTimer.from_dict(timer.as_dict()).as_dict() == timer.as_dict()
+    assert format_timings(timer.as_dict()).endswith(f"total {timer.total * 1000:.1f} ms")
+
+
+def test_disabled_timing_is_a_no_op():
+    with timing(enabled=False) as timer:
+        with stage('decode') as decoding:
+            decoding.nbytes = 10
+        assert timed('export', 'abc') == 'abc'
+    assert timer is None
+    # 计时器结束后不再记录
+    with timing(enabled=True) as timer:
+        pass
+    with stage('decode'):
+        pass
+    assert timer.seconds == {}
+
+
+def test_prometheus_histograms():
+    metrics = StageMetrics()
+    for seconds, nbytes in ((0.002, 500), (0.2, 5000), (3.0, 5000)):
+        timer = StageTimer()
+        timer.add('encode', seconds, nbytes)
+        timer.total = seconds
+        metrics.observe(timer)
+    text = metrics.prometheus()
+    assert '# TYPE ascii_art_stage_seconds histogram' in text
+    assert 'ascii_art_stage_seconds_bucket{stage="encode",le="0.0025"} 1' in text
+    assert 'ascii_art_stage_seconds_bucket{stage="encode",le="0.25"} 2' in text
+    assert 'ascii_art_stage_seconds_bucket{stage="encode",le="+Inf"} 3' in text
+    assert 'ascii_art_stage_seconds_count{stage="encode"} 3' in text
+    assert 'ascii_art_stage_bytes_sum{stage="encode"} 10500' in text
+    assert 'ascii_art_request_seconds_count 3' in text
+    # 每个桶的计数不递减
+    counts = [int(n) for n in re.findall(r'stage_seconds_bucket\{stage="encode",le="[^"]+"\} (\d+)', text)]
+    assert counts == sorted(counts)
+    assert metrics.summary()['encode'] == {'count': 3, 'seconds': pytest.approx(3.202), 'bytes': 10500}
+
+
+def test_generator_records_pipeline_stages():
+    generator = ASCIIArtGenerator()
+    with timing(enabled=True) as timer:
+        png = generator.render_png(_png_bytes(), width=40, brightness=1.2)
+        text = generator.image_to_ascii(_png_bytes(), width=40)
+    assert {'decode', 'resize', 'enhance', 'mapping', 'draw', 'encode', 'export'} <= set(timer.seconds)
+    assert timer.bytes['encode'] == len(png) and text
+
+
+def test_worker_jobs_return_timings():
+    data = _png_bytes()
+    rendered = render_job(data, 'digest-a', ' .:#', False, 40, 'gray', 1.0, 1.0, 8)
+    assert {'decode', 'resize', 'mapping', 'draw', 'encode'} <= set(rendered['timings']['seconds'])
+    assert rendered['timings']['bytes']['encode'] == len(rendered['data'])
+    converted = markup_job(data, 'digest-b', ' .:#', False, 'svg', 40, 'gray', 1.0, 1.0, 8)
+    assert 'export' in converted['timings']['seconds']
+
+
+def test_cli_profile(monkeypatch, tmp_path, capsys):
+    source = tmp_path / 'in.png'
+    source.write_bytes(_png_bytes())
+    monkeypatch.setattr('sys.argv', ['main.py', str(source), '-w', '30', '--save-img', str(tmp_path / 'out.png'),
+                                     '--profile'])
+    main.main()
+    err = capsys.readouterr().err
+    assert re.search(r'decode [\d.]+ ms .* draw [\d.]+ ms .* encode [\d.]+ ms \([\d.]+ KB\)', err)
+
+
+def test_bulk_profile_summary(tmp_path):
+    for name in ('a.png', 'b.png'):
+        (tmp_path / name).write_bytes(_png_bytes())
+    options = {'charset': 'simple', 'invert': False, 'width': 20, 'height': None, 'color_mode': 'gray',
+               'brightness': 1.0, 'contrast': 1.0, 'ansi_palette': 'truecolor', 'color_step': 1}
+    summary = run_bulk(sorted(tmp_path.glob('*.png')), tmp_path / 'out', options, jobs=1, log=lambda _: None,
+                       profile=True)
+    assert summary['stages']['decode']['count'] == 2 and summary['stages']['export']['seconds'] > 0
+    assert 'stages' not in run_bulk(sorted(tmp_path.glob('*.png')), tmp_path / 'out2', options, jobs=1,
+                                    log=lambda _: None)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+测试请求合并：相同的并发请求只执行一次，结果和错误共享给所有等待者
+"""
+
+import asyncio
+import os
+
+import pytest
+from PIL import Image
+
+import ascii_art_server as server
+from cache import ResultCache
+from metrics import StageMetrics
+from singleflight import SingleFlight
+from storage import StorageError
+from workers import WorkerPool
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.run(key, lambda key=key: work(key)) for key in (1, 1, 1, 2)))
+        assert results == [(2, False), (2, True), (2, True), (4, False)]
+        assert flight.in_flight == 0
+        # 完成后不再合并，下一次调用重新执行
+        assert await flight.run(1, lambda: work(1)) == (2, False)
+
+    asyncio.run(scenario())
+    assert calls == [1, 2, 1]
+    assert flight.stats() == {'enabled': True, 'in_flight': 0, 'executed': 3, 'coalesced': 2, 'failed': 0,
+                              'failed_waiters': 0}
+    assert 'ascii_art_requests_coalesced_total 2' in flight.prometheus()
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError('broken input')
+
+    async def scenario():
+        return await asyncio.gather(*(flight.run('key', fail) for _ in range(3)), return_exceptions=True)
+
+    outcomes = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(outcome, ValueError) and str(outcome) == 'broken input' for outcome in outcomes)
+    assert flight.stats()['failed'] == 1 and flight.stats()['failed_waiters'] == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    async def scenario():
+        first = asyncio.create_task(flight.run('key', work))
+        second = asyncio.create_task(flight.run('key', work))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == ('done', True)
+        assert first.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_disabled_or_keyless_calls_run_separately():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return len(calls)
+
+    async def scenario(flight, key):
+        return await asyncio.gather(flight.run(key, work), flight.run(key, work))
+
+    assert [joined for _, joined in asyncio.run(scenario(SingleFlight(enabled=False), 'key'))] == [False, False]
+    assert [joined for _, joined in asyncio.run(scenario(SingleFlight(), None))] == [False, False]
+    assert len(calls) == 4
+
+
+class _Storage:
+    """记录上传次数的存储替身"""
+
+    def __init__(self, error=None):
+        self.uploads = []
+        self.error = error
+
+    async def upload(self, name, data, content_type):
+        self.uploads.append(name)
+        await asyncio.sleep(0.01)
+        if self.error:
+            raise StorageError(self.error)
+        return f'https://storage.invalid/{name}'
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / 'gradient.png'
+    Image.linear_gradient('L').resize((160, 120)).save(path)
+    return path
+
+
+@pytest.fixture
+def quiet_server(monkeypatch):
+    """线程模式的工作池、不缓存结果、新的合并计数和阶段直方图"""
+    monkeypatch.setattr(server, 'worker_pool', WorkerPool(workers=0))
+    monkeypatch.setattr(server, 'stage_metrics', StageMetrics())
+    monkeypatch.setattr(server, 'result_cache', ResultCache(max_entries=0))
+    monkeypatch.setattr(server, 'inflight', SingleFlight())
+    return server
+
+
+def test_server_coalesces_identical_requests(quiet_server, image_file, monkeypatch):
+    storage = _Storage()
+    monkeypatch.setattr(server, 'storage', storage)
+
+    async def scenario():
+        same = [server.generate_ascii_image(str(image_file), width=30) for _ in range(3)]
+        # 参数不同的请求单独转换
+        return await asyncio.gather(*same, server.generate_ascii_image(str(image_file), width=40))
+
+    messages = asyncio.run(scenario())
+    assert all(message.startswith('✅') for message in messages)
+    assert len(storage.uploads) == 2
+    assert sum('shared with an identical in-flight request' in message for message in messages) == 2
+    assert server.inflight.stats()['coalesced'] == 2 and server.inflight.stats()['executed'] == 2
+    assert '"coalesced": 2' in server.server_stats()
+    # 直方图只记录实际执行的两次转换，合并的请求不重复计入
+    assert server.stage_metrics.request_seconds.count == 2
+    assert server.stage_metrics.stage_seconds['upload'].count == 2
+    assert 'ascii_art_requests_coalesced_total 2' in server.server_metrics()
+
+
+def test_request_key_identifies_file_version(image_file):
+    key = server.request_key(str(image_file), {'width': 30})
+    assert key == server.request_key(str(image_file), {'width': 30}) != server.request_key(str(image_file), {})
+    assert server.request_key('https://example.com/a.png', {}) != server.request_key('https://example.com/b.png', {})
+    # 不存在的文件和相对路径不合并，由 load_source 报错
+    assert server.request_key(str(image_file.with_name('missing.png')), {}) is None
+    assert server.request_key('gradient.png', {}) is None
+    # 文件被改写后（修改时间和大小变化）不与旧内容的请求合并
+    Image.linear_gradient('L').resize((80, 60)).save(image_file)
+    os.utime(image_file, ns=(0, 0))
+    assert server.request_key(str(image_file), {'width': 30}) != key
+
+
+def test_server_shares_errors_with_duplicates(quiet_server, image_file, monkeypatch):
+    storage = _Storage(error='bucket unavailable')
+    monkeypatch.setattr(server, 'storage', storage)
+
+    async def scenario():
+        return await asyncio.gather(*(server.generate_ascii_image(str(image_file), width=30) for _ in range(3)))
+
+    messages = asyncio.run(scenario())
+    assert messages == ['❌ Error: bucket unavailable'] * 3
+    assert len(storage.uploads) == 1
+    assert server.inflight.stats()['failed_waiters'] == 2
+    assert server.stage_metrics.request_seconds.count == 1
+
+
+def test_batch_duplicates_are_converted_once(quiet_server, image_file, monkeypatch):
+    storage = _Storage()
+    monkeypatch.setattr(server, 'storage', storage)
+    message = asyncio.run(server.generate_ascii_batch([str(image_file)] * 3, width=20))
+    assert '3 of 3 images converted' in message and '2 shared with identical requests' in message
+    assert len(storage.uploads) == 1
+    assert server.stage_metrics.request_seconds.count == 1
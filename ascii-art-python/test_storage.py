@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试存储后端（使用进程内的假存储服务器代替 Supabase）
+"""
+
+import asyncio
+from urllib.request import urlopen
+
+import pytest
+
+from storage import FakeStorageServer, LocalStorage, StorageBackend, StorageError, SupabaseStorage, storage_from_env
+
+
+def _upload_all(backend, uploads):
+    async def scenario():
+        try:
+            return await asyncio.gather(*(backend.upload(name, data) for name, data in uploads))
+        finally:
+            await backend.aclose()
+    return asyncio.run(scenario())
+
+
+def test_supabase_backend_against_fake_server():
+    with FakeStorageServer(key='secret') as server:
+        backend = SupabaseStorage(server.url, 'secret', 'art')
+        [url] = _upload_all(backend, [('cat picture.png', b'png-1')])
+        assert url == f'{server.url}/storage/v1/object/public/art/cat%20picture.png'
+        # 同名上传覆盖原对象
+        _upload_all(SupabaseStorage(server.url, 'secret', 'art'), [('cat picture.png', b'png-2')])
+        with urlopen(url) as response:
+            assert response.read() == b'png-2'
+        assert server.requests == 2
+
+
+def test_supabase_backend_reuses_connections():
+    with FakeStorageServer() as server:
+        backend = SupabaseStorage(server.url, 'key', 'art')
+
+        async def sequential():
+            for i in range(5):
+                await backend.upload(f'{i}.png', b'data')
+            await backend.aclose()
+
+        asyncio.run(sequential())
+        assert server.requests == 5
+        assert server.connections == 1
+
+
+def test_transient_failures_are_retried():
+    with FakeStorageServer() as server:
+        server.fail_next(2)
+        [url] = _upload_all(SupabaseStorage(server.url, 'key', 'art', backoff=0.01), [('a.png', b'data')])
+        assert url.endswith('/art/a.png')
+        assert server.requests == 3
+
+        server.fail_next(5)
+        with pytest.raises(StorageError, match='503'):
+            _upload_all(SupabaseStorage(server.url, 'key', 'art', retries=2, backoff=0.01), [('b.png', b'data')])
+
+
+def test_permanent_failures_are_not_retried():
+    with FakeStorageServer(key='secret') as server:
+        with pytest.raises(StorageError, match='403'):
+            _upload_all(SupabaseStorage(server.url, 'wrong', 'art', backoff=0.01), [('a.png', b'data')])
+        assert server.requests == 1
+
+
+def test_local_storage(tmp_path):
+    [url] = _upload_all(LocalStorage(str(tmp_path)), [('a.png', b'data')])
+    assert url == (tmp_path / 'a.png').resolve().as_uri()
+    assert (tmp_path / 'a.png').read_bytes() == b'data'
+    [url] = _upload_all(LocalStorage(str(tmp_path), base_url='http://cdn/x/'), [('b c.png', b'data')])
+    assert url == 'http://cdn/x/b%20c.png'
+
+
+def test_storage_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv('SUPABASE_URL', raising=False)
+    monkeypatch.delenv('ASCII_ART_STORAGE_URL', raising=False)
+    assert storage_from_env() is None
+    monkeypatch.setenv('ASCII_ART_STORAGE_URL', tmp_path.as_uri())
+    backend = storage_from_env()
+    assert isinstance(backend, LocalStorage) and backend.directory == tmp_path
+
+
+def test_backend_without_upload_once_cannot_be_created():
+    class Incomplete(StorageBackend):
+        pass
+
+    with pytest.raises(TypeError, match='_upload_once'):
+        Incomplete()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+测试网络传输模式：健康检查与就绪检查、优雅退出、通过 streamable HTTP 调用工具
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+import pytest
+from mcp import ClientSession
+from mcp.client.streamable_http import streamable_http_client
+from PIL import Image
+
+import ascii_art_server as server
+
+
+SERVER = Path(__file__).resolve().parent / 'ascii_art_server.py'
+
+
+def _future(exception=None):
+    future = Future()
+    if exception is None:
+        future.set_result(os.getpid())
+    else:
+        future.set_exception(exception)
+    return future
+
+
+def _probe(handler):
+    response = asyncio.run(handler(None))
+    return response.status_code, json.loads(response.body)
+
+
+def test_readiness_follows_warmup_and_draining(monkeypatch):
+    pending = Future()
+    monkeypatch.setattr(server, 'warmup', [_future(), pending])
+    assert _probe(server.health) == (200, {'status': 'ok'})
+    status, body = _probe(server.readiness)
+    assert status == 503 and body['status'] == 'starting' and 'in_flight' in body['worker_pool']
+
+    pending.set_result(os.getpid())
+    assert _probe(server.readiness)[0] == 200
+
+    monkeypatch.setattr(server, 'warmup', [_future(RuntimeError('font missing'))])
+    assert _probe(server.readiness) == (503, _probe(server.readiness)[1]) and server.readiness_status() == 'failed'
+
+    monkeypatch.setattr(server, 'warmup', [])
+    monkeypatch.setattr(server, 'draining', True)
+    assert _probe(server.readiness)[1]['status'] == 'draining'
+
+
+def test_draining_refuses_new_tool_calls(monkeypatch, tmp_path):
+    image = tmp_path / 'in.png'
+    Image.linear_gradient('L').save(image)
+    monkeypatch.setattr(server, 'draining', True)
+    message = asyncio.run(server.generate_ascii_image(str(image), width=20, output_format='svg'))
+    assert message.startswith('❌ Error: Server is shutting down')
+    assert asyncio.run(server.generate_ascii_batch([str(image)])).startswith('❌ Error: Server is shutting down')
+    assert server.active_requests == 0
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """在子进程中以 streamable HTTP 模式启动服务器，等待就绪"""
+    port = _free_port()
+    env = {**os.environ, 'ASCII_ART_STORAGE_URL': str(tmp_path / 'store'), 'ASCII_ART_CACHE_SIZE': '0'}
+    process = subprocess.Popen(
+        [sys.executable, str(SERVER), '--transport', 'streamable-http', '--port', str(port), '--workers', '1'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if httpx.get(f'{url}/readyz').status_code == 200:
+                break
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            pytest.fail(f'server did not become ready: {process.stderr.read().decode()[-2000:]}')
+        time.sleep(0.1)
+    yield process, url
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+class _HeldImageHandler(BaseHTTPRequestHandler):
+    """返回一张PNG，但要等测试放行（server.release）后才发送"""
+
+    def do_GET(self):
+        self.server.requested.set()
+        self.server.release.wait(30)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def held_image(tmp_path):
+    image = tmp_path / 'in.png'
+    Image.linear_gradient('L').resize((400, 300)).save(image)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _HeldImageHandler)
+    httpd.daemon_threads = True
+    httpd.body = image.read_bytes()
+    httpd.requested, httpd.release = threading.Event(), threading.Event()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield image, httpd
+    httpd.release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_http_transport_serves_tools_and_drains(http_server, held_image, tmp_path):
+    process, url = http_server
+    image, httpd = held_image
+
+    async def call(session, image_path, **arguments):
+        result = await session.call_tool('generate_ascii_image', {'image_path': image_path, **arguments})
+        return result.content[0].text
+
+    async def scenario():
+        async with streamable_http_client(f'{url}/mcp') as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                assert (await call(session, str(image), width=30)).startswith('✅')
+                # 退出信号到达时正在处理的请求（正在下载输入）仍然完成
+                held_url = f'http://127.0.0.1:{httpd.server_address[1]}/held.png'
+                pending = asyncio.create_task(call(session, held_url, width=40))
+                await asyncio.to_thread(httpd.requested.wait, 30)
+                process.send_signal(signal.SIGTERM)
+                await asyncio.sleep(0.2)
+                assert httpx.get(f'{url}/readyz').json()['status'] == 'draining'
+                refused = await call(session, str(image), width=50)
+                httpd.release.set()
+                return refused, await pending
+
+    refused, drained = asyncio.run(scenario())
+    assert refused.startswith('❌ Error: Server is shutting down')
+    assert drained.startswith('✅')
+    assert process.wait(timeout=30) == 0
+    assert len(list((tmp_path / 'store').iterdir())) == 2
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试工作池的并发限制与进程内渲染
+"""
+
+import asyncio
+import io
+import os
+from pathlib import Path
+
+import pytest
+
+from main import ASCIIArtGenerator
+from cache import digest_bytes
+from workers import ServerBusyError, WorkerPool, markup_job, render_job
+
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / 'scan_test.jpg'
+
+
+def test_full_queue_rejects_immediately():
+    pool = WorkerPool(workers=0, max_concurrency=1, max_queue=1)
+
+    async def hold(release):
+        async with pool.slot():
+            await release.wait()
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(release))
+        waiting = asyncio.create_task(hold(release))
+        await asyncio.sleep(0)
+        assert pool.stats()['in_flight'] == 1
+        assert pool.stats()['queued'] == 1
+        with pytest.raises(ServerBusyError):
+            async with pool.slot():
+                pass
+        release.set()
+        await asyncio.gather(running, waiting)
+
+    asyncio.run(scenario())
+    stats = pool.stats()
+    assert stats['completed'] == 2
+    assert stats['rejected'] == 1
+    assert stats['in_flight'] == 0 and stats['queued'] == 0
+
+
+def test_render_job_in_worker_process_matches_in_process_render():
+    data = SAMPLE_IMAGE.read_bytes()
+    args = (data, digest_bytes(data), 'blocks', False, 40, 'color', 1.1, 1.2, 10)
+    pool = WorkerPool(workers=1)
+    try:
+        result = asyncio.run(pool.run(render_job, *args))
+    finally:
+        pool.shutdown()
+    expected = ASCIIArtGenerator(char_set='blocks').render_png(
+        data, width=40, color_mode='color', brightness=1.1, contrast=1.2, font_size=10)
+    assert result['data'] == expected and result['format'] == 'png'
+    assert result['grid_cache']['misses'] == 1
+
+
+def test_render_job_animated_input_returns_animated_png():
+    from PIL import Image
+    from test_animation import _make_animation
+
+    data, _ = _make_animation('GIF', frames=3)
+    result = render_job(data, digest_bytes(data), 'simple', False, 20, 'gray', 1.0, 1.0, 8)
+    animation = Image.open(io.BytesIO(result['data']))
+    assert result['frames'] == animation.n_frames == 3
+    assert (result['width'], result['height']) == animation.size
+
+
+def test_markup_job_returns_inline_document():
+    import gzip
+
+    data = SAMPLE_IMAGE.read_bytes()
+    result = markup_job(data, digest_bytes(data), 'simple', False, 'svg', 30, 'color', 1.0, 1.0, 10)
+    expected = ASCIIArtGenerator().render_markup(data, 'svg', width=30, color_mode='color')
+    assert result['markup'] == expected
+    assert result['cols'] == 30 and expected.count('<text ') == result['rows']
+    assert result['size'] == len(expected.encode('utf-8'))
+    assert result['gzip_size'] == len(gzip.compress(expected.encode('utf-8')))
+
+
+def test_server_import_does_not_load_rendering_modules():
+    import subprocess
+    import sys
+
+    probe = ('import sys, ascii_art_server; '
+             'print(" ".join(m for m in ("numpy", "PIL", "main", "exporters", "encoder") if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                            cwd=Path(__file__).resolve().parent).stdout
+    assert output.strip() == ''
+
+
+def test_prewarm_starts_workers():
+    pool = WorkerPool(workers=2)
+    try:
+        futures = pool.prewarm((8, 10))
+        assert len(futures) == 2
+        pids = {future.result(timeout=60) for future in futures}
+        assert pids and os.getpid() not in pids
+    finally:
+        pool.shutdown()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+ASCII Art Worker Pool
+把CPU密集的渲染工作移出MCP事件循环
+
+The MCP tools are ``async``; decoding, rendering and PNG encoding are CPU
+bound and would stall every other client if they ran on the event loop. A
+WorkerPool runs them in a process pool (or in threads when no worker
+processes are configured), caps how many requests are in flight and keeps a
+bounded waiting queue that rejects new requests immediately when full.
+
+The rendering modules (numpy, Pillow, main) are imported inside the jobs,
+so the server process only loads them if it renders in threads itself.
+``prewarm`` starts the workers and loads fonts in the background, before
+the first request needs them.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+import signal
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+
+from cache import GridCache
+from metrics import stage, timing
+
+if TYPE_CHECKING:
+    from encoder import ImageEncoder
+
+
+class ServerBusyError(Exception):
+    """Raised when both the in-flight slots and the waiting queue are full."""
+
+
+# 每个进程（工作进程或线程模式下的服务器进程）各自的网格缓存和图片编码器
+_grid_cache: GridCache | None = None
+_image_encoder: 'ImageEncoder | None' = None
+
+
+def local_grid_cache() -> GridCache:
+    """Return the grid cache of the current process, creating it on first use."""
+    global _grid_cache
+    if _grid_cache is None:
+        _grid_cache = GridCache.from_env()
+    return _grid_cache
+
+
+def local_image_encoder() -> 'ImageEncoder':
+    """Return the image encoder of the current process (configured from the environment)."""
+    from encoder import ImageEncoder
+
+    global _image_encoder
+    if _image_encoder is None:
+        _image_encoder = ImageEncoder.from_env()
+    return _image_encoder
+
+
+def _ignore_shutdown_signals() -> None:
+    """Leave shutdown to the server process in worker processes.
+    
+    Ctrl+C, ``timeout`` and systemd send SIGINT/SIGTERM to the whole
+    process group; the workers ignore them so renders in progress finish
+    while the server drains, and exit when it shuts the pool down.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def warm_job(font_sizes: tuple[int, ...]) -> int:
+    """Import the rendering modules and load the fonts of a worker ahead of its first request.
+
+    Returns:
+        The worker's pid
+    """
+    # 导入渲染模块（连同 numpy 和 Pillow），再解析字体并测量字符单元格
+    import main
+    from fonts import font_registry
+
+    font_registry().preload(font_sizes)
+    local_image_encoder()
+    return os.getpid()
+
+
+def render_identity_job() -> dict:
+    """Describe the worker configuration that changes rendered images, for the result cache key.
+
+    Returns:
+        Dict with the resolved font (FontRegistry.identity) and the image
+        encoder's palette mode and compression level
+    """
+    from fonts import font_registry
+
+    encoder = local_image_encoder()
+    return {'font': font_registry().identity(), 'palette': encoder.palette, 'compress_level': encoder.compress_level}
+
+
+def _with_timings(job):
+    """Run a job under a fresh stage timer and add ``timings`` (StageTimer.as_dict() or None) to its result."""
+    @functools.wraps(job)
+    def wrapper(*args):
+        with timing() as timer:
+            result = job(*args)
+        result['timings'] = timer.as_dict() if timer is not None else None
+        return result
+    return wrapper
+
+
+@_with_timings
+def render_job(source: bytes | bytearray, digest: str, charset: str, invert: bool, width: int, color_mode: str,
+               brightness: float, contrast: float, font_size: int, image_format: str = 'png') -> dict:
+    """Render one image to PNG or lossless WebP; runs inside a worker.
+
+    Only picklable arguments and results cross the process boundary, so the
+    generator is rebuilt here (its font and glyph atlas are cached per process).
+
+    Animated inputs (GIF, WebP, APNG) are rendered to an animated PNG whatever
+    the requested format; the frames are rendered one after another inside
+    this worker.
+
+    Returns:
+        Dict with the encoded bytes, their format, whether a palette was used,
+        the encode time (None for animations), canvas size, frame count, the
+        worker's pid, snapshots of the worker's grid cache and encoder counters
+        and the stage timings of this job
+    """
+    import io
+
+    from animation import is_animated
+    from main import ASCIIArtGenerator, open_image
+
+    grid_cache = local_grid_cache()
+    encoder = local_image_encoder()
+    generator = ASCIIArtGenerator(char_set=charset, invert=invert, grid_cache=grid_cache, encoder=encoder)
+    options = dict(width=width, color_mode=color_mode, brightness=brightness, contrast=contrast,
+                   font_size=font_size)
+    if is_animated(open_image(source)):
+        buffer = io.BytesIO()
+        frames = generator.render_animation(source, buffer, fmt='png', workers=1, **options)
+        data = buffer.getvalue()
+        canvas_size = open_image(data).size
+        image_format, palette, encode_ms = 'png', False, None
+    else:
+        canvas = generator.render_image(source, digest=digest, **options)
+        encoded = encoder.encode(canvas, image_format)
+        data = encoded.data
+        canvas_size = canvas.size
+        frames = 1
+        palette, encode_ms = encoded.palette, encoded.seconds * 1000
+    return {
+        'data': data,
+        'format': image_format,
+        'palette': palette,
+        'encode_ms': encode_ms,
+        'width': canvas_size[0],
+        'height': canvas_size[1],
+        'frames': frames,
+        'pid': os.getpid(),
+        'grid_cache': grid_cache.stats(),
+        'encoder': encoder.stats(),
+    }
+
+
+@_with_timings
+def markup_job(source: bytes | bytearray, digest: str, charset: str, invert: bool, fmt: str, width: int, color_mode: str,
+               brightness: float, contrast: float, font_size: int) -> dict:
+    """Convert one image to an HTML or SVG document; runs inside a worker.
+
+    Animated inputs use their first frame.
+
+    Returns:
+        Dict with the document, its UTF-8 and gzipped sizes, the grid size,
+        the worker's pid, a snapshot of the worker's grid cache counters and
+        the stage timings of this job
+    """
+    import gzip
+
+    from exporters import MARKUP_CELL_RATIO
+    from main import ASCIIArtGenerator
+
+    grid_cache = local_grid_cache()
+    generator = ASCIIArtGenerator(char_set=charset, invert=invert, grid_cache=grid_cache)
+    grid = generator.make_grid(source, width, None, MARKUP_CELL_RATIO, brightness, contrast, color_mode == 'color',
+                               digest)
+    markup = '\n'.join(generator.export_markup(grid, fmt, color_mode, font_size))
+    data = markup.encode('utf-8')
+    return {
+        'markup': markup,
+        'cols': grid.cols,
+        'rows': grid.rows,
+        'size': len(data),
+        'gzip_size': len(gzip.compress(data)),
+        'pid': os.getpid(),
+        'grid_cache': grid_cache.stats(),
+    }
+
+
+class WorkerPool:
+    """Bounded executor for CPU stages plus admission control for requests.
+
+    Args:
+        workers: Number of worker processes; 0 runs CPU stages in a thread pool
+            inside the server process instead
+        max_concurrency: Requests allowed in flight at once
+        max_queue: Requests allowed to wait for a slot; further requests fail
+            fast with ServerBusyError
+    """
+
+    def __init__(self, workers: int = 0, max_concurrency: int = 4, max_queue: int = 32):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    @classmethod
+    def from_env(cls, workers: int | None = None) -> 'WorkerPool':
+        """Build a pool from ASCII_ART_WORKERS / _MAX_CONCURRENCY / _MAX_QUEUE.
+
+        Args:
+            workers: Number of worker processes, overriding ASCII_ART_WORKERS
+        """
+        if workers is None:
+            workers = int(os.getenv('ASCII_ART_WORKERS', min(4, os.cpu_count() or 1)))
+        return cls(
+            workers=workers,
+            max_concurrency=int(os.getenv('ASCII_ART_MAX_CONCURRENCY', max(workers, 1) * 2)),
+            max_queue=int(os.getenv('ASCII_ART_MAX_QUEUE', 32)),
+        )
+
+    @property
+    def executor(self) -> Executor:
+        """The CPU executor, started lazily on first use."""
+        if self._executor is None:
+            if self.workers > 0:
+                # spawn 在各平台行为一致，也避免在带线程的事件循环进程里 fork
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_ignore_shutdown_signals)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency, thread_name_prefix='ascii-art')
+        return self._executor
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot for the duration of a request.
+
+        Raises:
+            ServerBusyError: If all slots are busy and the waiting queue is full
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ServerBusyError(
+                f"Server busy: {self.in_flight} requests in flight and {self.queued} queued, try again later")
+
+        self.queued += 1
+        try:
+            with stage('queue'):
+                await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def run(self, func, *args):
+        """Run a CPU-bound function in the executor and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def stats(self) -> dict:
+        """Return queue depth, in-flight count and limits."""
+        return {
+            'workers': self.workers,
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    def prewarm(self, font_sizes: tuple[int, ...] = (10,)) -> list:
+        """Start every worker and load the rendering modules and fonts in the background.
+
+        Returns immediately; the returned futures finish when the workers
+        are warm. In thread mode the modules are loaded into the server
+        process by a background thread.
+        """
+        return [self.executor.submit(warm_job, font_sizes) for _ in range(max(self.workers, 1))]
+
+    def shutdown(self) -> None:
+        """Stop the executor; pending CPU work is cancelled."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None